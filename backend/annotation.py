@@ -0,0 +1,142 @@
+"""
+Render-on-read annotated images
+
+Once a target has been edited, its annotated image is fully defined by the
+original upload, the stored shots, the calibration and the render options.
+Edits only write those to metadata. The image is drawn when someone asks
+for it and kept in a bounded LRU keyed by a hash of the inputs, so repeated
+views (and edits that land on an already rendered state) cost nothing.
+"""
+import hashlib
+import json
+import threading
+from collections import OrderedDict
+
+# Bump when the drawing changes so earlier renders (and cached URLs) are not reused
+RENDER_VERSION = 1
+
+# Manual shots and legacy entries store [x, y]; this radius is drawn for them
+DEFAULT_SHOT_RADIUS = 10
+
+
+def draw_reference_scale(image, pixels_per_inch):
+    """Draw a 1-inch reference scale in the top-right corner of the image (in place)"""
+    import cv2
+
+    height, width = image.shape[:2]
+    scale_length_pixels = int(pixels_per_inch)
+
+    # Position the scale in the top-right corner
+    margin = 20
+    scale_start_x = width - margin - scale_length_pixels
+    scale_start_y = margin + 30
+    scale_end_x = scale_start_x + scale_length_pixels
+    scale_end_y = scale_start_y
+
+    # Draw the scale line (thick white line with black border)
+    cv2.line(image, (scale_start_x, scale_start_y), (scale_end_x, scale_end_y), (0, 0, 0), 5)  # Black border
+    cv2.line(image, (scale_start_x, scale_start_y), (scale_end_x, scale_end_y), (255, 255, 255), 3)  # White line
+
+    # Add tick marks at the ends
+    tick_height = 10
+    cv2.line(image, (scale_start_x, scale_start_y - tick_height//2), (scale_start_x, scale_start_y + tick_height//2), (0, 0, 0), 3)
+    cv2.line(image, (scale_end_x, scale_end_y - tick_height//2), (scale_end_x, scale_end_y + tick_height//2), (0, 0, 0), 3)
+    cv2.line(image, (scale_start_x, scale_start_y - tick_height//2), (scale_start_x, scale_start_y + tick_height//2), (255, 255, 255), 2)
+    cv2.line(image, (scale_end_x, scale_end_y - tick_height//2), (scale_end_x, scale_end_y + tick_height//2), (255, 255, 255), 2)
+
+    # Add text label
+    label = "1 inch"
+    font = cv2.FONT_HERSHEY_SIMPLEX
+    font_scale = 0.7
+    font_thickness = 2
+
+    # Get text size to center it above the scale
+    (text_width, text_height), _ = cv2.getTextSize(label, font, font_scale, font_thickness)
+    text_x = scale_start_x + (scale_length_pixels - text_width) // 2
+    text_y = scale_start_y - 10
+
+    # Draw text with black border for visibility
+    cv2.putText(image, label, (text_x, text_y), font, font_scale, (0, 0, 0), font_thickness + 1)  # Black border
+    cv2.putText(image, label, (text_x, text_y), font, font_scale, (255, 255, 255), font_thickness)  # White text
+
+    return image
+
+
+def render_annotated(original, shots, pixels_per_inch):
+    """
+    Draw shots and the reference scale on a copy of the original image
+
+    Args:
+        original: BGR array of the uploaded image (not modified)
+        shots: List of [x, y] or [x, y, radius]
+        pixels_per_inch: Calibrated (or default) scale
+
+    Returns:
+        Annotated BGR array
+    """
+    import cv2
+
+    annotated_image = original.copy()
+    for shot in shots:
+        x, y = int(shot[0]), int(shot[1])
+        radius = int(shot[2]) if len(shot) > 2 else DEFAULT_SHOT_RADIUS
+        # Draw circle around the shot and its center point
+        cv2.circle(annotated_image, (x, y), radius, (0, 255, 0), 2)
+        cv2.circle(annotated_image, (x, y), 2, (0, 0, 255), -1)
+    return draw_reference_scale(annotated_image, pixels_per_inch)
+
+
+def render_key(entry, pixels_per_inch, image_format, quality):
+    """Hash of everything that determines an entry's rendered annotated image"""
+    inputs = {
+        'version': RENDER_VERSION,
+        'original': [entry['filename'], entry.get('original_generation')],
+        'shots': entry.get('shots') or [],
+        'pixels_per_inch': pixels_per_inch,
+        'format': image_format,
+        'quality': quality,
+    }
+    return hashlib.sha256(json.dumps(inputs, sort_keys=True).encode('utf-8')).hexdigest()
+
+
+class RenderCache:
+    """Bounded LRU of encoded renders (EncodedImage), keyed by render_key"""
+
+    def __init__(self, max_bytes=64 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._size = 0
+        self.hits = 0
+        self.misses = 0
+
+    def get_or_render(self, key, render):
+        """
+        Return the cached render for key, calling render() on a miss
+
+        render() returns an EncodedImage, or None if the inputs are unavailable
+        (None is not cached). Two requests missing on the same key at once may
+        both render; the result is identical, so the second simply replaces the first.
+        """
+        with self._lock:
+            encoded = self._entries.get(key)
+            if encoded is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return encoded
+            self.misses += 1
+
+        encoded = render()
+        if encoded is None or len(encoded.data) > self.max_bytes:
+            return encoded
+
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self._size -= len(previous.data)
+            self._entries[key] = encoded
+            self._size += len(encoded.data)
+            while self._size > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self._size -= len(evicted.data)
+        return encoded
@@ -1,89 +1,422 @@
-from flask import Flask, request, jsonify, send_from_directory
+from flask import Flask, Response, g, request, jsonify, send_from_directory, stream_with_context, url_for
 from flask_cors import CORS
 import os
+import io
 import json
+import threading
+import time
 import cv2
 import numpy as np
 from PIL import Image
-import base64
-from datetime import datetime
+import hashlib
+import functools
+from collections import OrderedDict
+from datetime import datetime, timezone
+from urllib.parse import urlencode
+from werkzeug.exceptions import RequestEntityTooLarge, UnsupportedMediaType
+from werkzeug.utils import safe_join
 from shot_detector import ShotDetector
 from moa_calculator import MOACalculator
+from metadata_store import create_metadata_store, decode_cursor, encode_cursor
+from image_encoding import EncodedImage, encode_image, format_for_filename
+from annotation import RenderCache, draw_reference_scale, render_annotated, render_key
+from derivatives import DERIVATIVE_SIZES, derivative_name, make_derivatives
+from concurrent.futures import ThreadPoolExecutor
+from job_queue import JobQueue
+from admission import AdmissionController, AdmissionRejected
+from image_probe import InvalidImage, probe_image
+from batch_upload import BoundedBatch, expand_batch
+from ids import new_id
+from ingest import InMemoryUploadRequest, buffer_bytes
+from image_store import LocalImageStore, content_digest
+from targets import TargetService
+import metrics
+from profiling import RequestProfiler, detector_parameters, profile_requested
 
 app = Flask(__name__)
-CORS(app)
+app.request_class = InMemoryUploadRequest
+CORS(app, expose_headers=['ETag', 'Last-Modified', 'Link', 'X-Next-Cursor', 'X-Profile-Id'])
 
 # Configuration
-UPLOAD_FOLDER = '../uploads'
-METADATA_FILE = 'metadata.json'
+UPLOAD_FOLDER = os.environ.get('UPLOAD_FOLDER', '../uploads')
+METADATA_FILE = os.environ.get('METADATA_FILE', 'metadata.json')
+METADATA_DB = os.environ.get('METADATA_DB', 'metadata.db')
+METADATA_BACKEND = os.environ.get('METADATA_BACKEND', 'sqlite')  # 'sqlite', 'journal', 'json' or 'memory'
+METADATA_JOURNAL = os.environ.get('METADATA_JOURNAL', 'metadata.journal')
+METADATA_FSYNC = os.environ.get('METADATA_FSYNC', 'always')  # 'always', 'interval' or 'never'
+METADATA_COMPACT_INTERVAL = float(os.environ.get('METADATA_COMPACT_INTERVAL', '60'))  # Seconds
+HISTORY_MAX_LIMIT = 500  # Largest page /api/history will return
+IMAGE_IMMUTABLE_MAX_AGE = 365 * 24 * 3600  # Seconds; for /api/image URLs pinned to a content hash
+IMAGE_DIGEST_CACHE_SIZE = 1024  # File hashes kept per worker for /api/image ETags
+USE_X_SENDFILE = os.environ.get('USE_X_SENDFILE', '0') == '1'  # Let a fronting Apache/lighttpd send image files
+METADATA_CACHE = os.environ.get('METADATA_CACHE', '1') == '1'  # In-memory index per worker
+ANNOTATED_FORMAT = os.environ.get('ANNOTATED_FORMAT', 'jpeg')  # 'jpeg' or 'webp' for new uploads
+ANNOTATED_QUALITY = int(os.environ.get('ANNOTATED_QUALITY', '90'))  # 0-100
+RENDER_CACHE_MB = int(os.environ.get('RENDER_CACHE_MB', '64'))  # Rendered annotated images kept per worker
+DERIVATIVES_FOLDER = os.path.join(UPLOAD_FOLDER, 'derivatives')  # History thumbnails
+DERIVATIVE_QUALITY = int(os.environ.get('DERIVATIVE_QUALITY', '80'))  # WebP quality, 0-100
+JOBS_FOLDER = os.environ.get('JOBS_FOLDER', os.path.join(UPLOAD_FOLDER, 'jobs'))  # Durable queue for ?mode=async uploads
+ANALYSIS_WORKERS = int(os.environ.get('ANALYSIS_WORKERS', '2'))  # Worker threads per process for queued uploads
+JOB_EVENTS_HEARTBEAT = 15  # Seconds between keep-alive comments on job event streams
+ADMISSION_MAX_IN_FLIGHT = int(os.environ.get('ADMISSION_MAX_IN_FLIGHT', str(os.cpu_count() or 2)))  # Concurrent detections per worker
+ADMISSION_MEMORY_MB = int(os.environ.get('ADMISSION_MEMORY_MB', '1024'))  # Estimated detection memory per worker
+ADMISSION_BYTES_PER_PIXEL = int(os.environ.get('ADMISSION_BYTES_PER_PIXEL', '16'))  # Memory estimate per image pixel
+ADMISSION_QUEUE_TIMEOUT = float(os.environ.get('ADMISSION_QUEUE_TIMEOUT', '10'))  # Seconds an upload waits for capacity before 429
+ADMISSION_MAX_WAITING = int(os.environ.get('ADMISSION_MAX_WAITING', '16'))  # Uploads allowed to wait; more get 429 at once
+BATCH_WORKERS = int(os.environ.get('BATCH_WORKERS', str(os.cpu_count() or 2)))  # Images of a batch upload analyzed in parallel
+BATCH_MAX_IMAGES = int(os.environ.get('BATCH_MAX_IMAGES', '200'))  # Per batch upload, including archive contents
+BATCH_MAX_IMAGE_MB = int(os.environ.get('BATCH_MAX_IMAGE_MB', '50'))  # Largest single image in a batch
+BATCH_MAX_TOTAL_MB = int(os.environ.get('BATCH_MAX_TOTAL_MB', '1024'))  # All images of a batch, uncompressed
+MAX_IMAGE_MEGAPIXELS = float(os.environ.get('MAX_IMAGE_MEGAPIXELS', '50'))  # Larger images are refused before decoding
+MAX_IMAGE_PIXELS = int(MAX_IMAGE_MEGAPIXELS * 1_000_000)
+UPLOAD_MAX_MB = int(os.environ.get('UPLOAD_MAX_MB', '50'))  # Largest request body for single uploads (and other routes)
+BATCH_MAX_MB = int(os.environ.get('BATCH_MAX_MB', '500'))  # Largest request body for batch uploads
+UPLOAD_WRITE_WORKERS = 4  # Threads writing originals to the upload folder while detection runs
+BLOB_REFS_DB = os.environ.get('BLOB_REFS_DB', os.path.join(UPLOAD_FOLDER, 'refs', 'blobs.db'))  # Reference counts of stored images
+PROFILING = os.environ.get('PROFILING', '0') == '1'  # Honor X-Profile / ?profile= on upload and edit routes
+PROFILING_TOKEN = os.environ.get('PROFILING_TOKEN')  # If set, the header or parameter must carry this value
+PROFILES_FOLDER = os.environ.get('PROFILES_FOLDER', os.path.join(UPLOAD_FOLDER, 'profiles'))
+PROFILE_SAMPLE_INTERVAL_MS = float(os.environ.get('PROFILE_SAMPLE_INTERVAL_MS', '5'))
 app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
+app.config['USE_X_SENDFILE'] = USE_X_SENDFILE
+app.config['UPLOAD_MAX_BYTES'] = UPLOAD_MAX_MB * 1024 * 1024
+app.config['BATCH_MAX_BYTES'] = BATCH_MAX_MB * 1024 * 1024
+app.config['BATCH_ENDPOINTS'] = ('upload_batch',)
 
-# Ensure upload directory exists
+# Ensure upload directories exist
 os.makedirs(UPLOAD_FOLDER, exist_ok=True)
+os.makedirs(DERIVATIVES_FOLDER, exist_ok=True)
 
 # Initialize components
 shot_detector = ShotDetector()
 moa_calculator = MOACalculator()
-
-def load_metadata():
-    """Load metadata from JSON file"""
-    if os.path.exists(METADATA_FILE):
-        with open(METADATA_FILE, 'r') as f:
-            return json.load(f)
-    return []
-
-def save_metadata(metadata):
-    """Save metadata to JSON file"""
-    with open(METADATA_FILE, 'w') as f:
-        json.dump(metadata, f, indent=2)
+metadata_store = create_metadata_store(
+    METADATA_BACKEND, METADATA_FILE, METADATA_DB, cache=METADATA_CACHE,
+    journal_path=METADATA_JOURNAL, fsync=METADATA_FSYNC, compact_interval=METADATA_COMPACT_INTERVAL
+)
+render_cache = RenderCache(RENDER_CACHE_MB * 1024 * 1024)
+derivative_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='derivatives')
+admission = AdmissionController(
+    ADMISSION_MAX_IN_FLIGHT, ADMISSION_MEMORY_MB * 1024 * 1024,
+    max_waiting=ADMISSION_MAX_WAITING, bytes_per_pixel=ADMISSION_BYTES_PER_PIXEL
+)
+batch_executor = ThreadPoolExecutor(max_workers=BATCH_WORKERS, thread_name_prefix='batch')
+upload_write_executor = ThreadPoolExecutor(max_workers=UPLOAD_WRITE_WORKERS, thread_name_prefix='upload-write')
+image_store = LocalImageStore(UPLOAD_FOLDER, BLOB_REFS_DB)
 
 def add_reference_scale(image, pixels_per_inch=None):
     """Add a 1-inch reference scale to the image"""
-    height, width = image.shape[:2]
-    
     # Use provided pixels_per_inch or default from MOA calculator
     if pixels_per_inch is None:
         pixels_per_inch = moa_calculator.pixels_per_inch
-    scale_length_pixels = int(pixels_per_inch)
-    
-    # Position the scale in the top-right corner
-    margin = 20
-    scale_start_x = width - margin - scale_length_pixels
-    scale_start_y = margin + 30
-    scale_end_x = scale_start_x + scale_length_pixels
-    scale_end_y = scale_start_y
-    
-    # Draw the scale line (thick white line with black border)
-    cv2.line(image, (scale_start_x, scale_start_y), (scale_end_x, scale_end_y), (0, 0, 0), 5)  # Black border
-    cv2.line(image, (scale_start_x, scale_start_y), (scale_end_x, scale_end_y), (255, 255, 255), 3)  # White line
-    
-    # Add tick marks at the ends
-    tick_height = 10
-    cv2.line(image, (scale_start_x, scale_start_y - tick_height//2), (scale_start_x, scale_start_y + tick_height//2), (0, 0, 0), 3)
-    cv2.line(image, (scale_end_x, scale_end_y - tick_height//2), (scale_end_x, scale_end_y + tick_height//2), (0, 0, 0), 3)
-    cv2.line(image, (scale_start_x, scale_start_y - tick_height//2), (scale_start_x, scale_start_y + tick_height//2), (255, 255, 255), 2)
-    cv2.line(image, (scale_end_x, scale_end_y - tick_height//2), (scale_end_x, scale_end_y + tick_height//2), (255, 255, 255), 2)
-    
-    # Add text label
-    label = "1 inch"
-    font = cv2.FONT_HERSHEY_SIMPLEX
-    font_scale = 0.7
-    font_thickness = 2
-    
-    # Get text size to center it above the scale
-    (text_width, text_height), _ = cv2.getTextSize(label, font, font_scale, font_thickness)
-    text_x = scale_start_x + (scale_length_pixels - text_width) // 2
-    text_y = scale_start_y - 10
-    
-    # Draw text with black border for visibility
-    cv2.putText(image, label, (text_x, text_y), font, font_scale, (0, 0, 0), font_thickness + 1)  # Black border
-    cv2.putText(image, label, (text_x, text_y), font, font_scale, (255, 255, 255), font_thickness)  # White text
+    return draw_reference_scale(image, pixels_per_inch)
+
+def write_upload(data, filename, fsync=False):
+    """Write bytes to the upload folder (atomically, so readers never see a partial file)"""
+    path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp_path, 'wb') as f:
+        f.write(data)
+        if fsync:
+            f.flush()
+            os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+def save_encoded_image(encoded, filename):
+    """Write already-encoded image bytes to the upload folder"""
+    write_upload(encoded.data, filename)
+
+def annotation_pixels_per_inch(entry):
+    """Scale drawn on an entry's annotated image"""
+    return entry['calibration']['pixels_per_inch'] if 'calibration' in entry else moa_calculator.pixels_per_inch
+
+def annotation_version(entry):
+    """Hash identifying an entry's current annotated image (used as its ETag and ?v=)"""
+    if entry.get('rendered_annotations'):
+        image_format = format_for_filename(entry['annotated_filename'])
+        return render_key(entry, annotation_pixels_per_inch(entry), image_format, ANNOTATED_QUALITY)
+    if entry.get('annotated_hash'):
+        return entry['annotated_hash']
+    # Older uploads: identify the file by name, size and mtime rather than hashing it on every history read
+    stat = os.stat(os.path.join(app.config['UPLOAD_FOLDER'], entry['annotated_filename']))
+    return hashlib.sha256(f"{entry['annotated_filename']}|{stat.st_size}|{stat.st_mtime_ns}".encode()).hexdigest()
+
+def load_annotated_image(entry):
+    """
+    Current annotated image of an entry as an EncodedImage, or None if its inputs are missing
+
+    Until the first edit this is the file saved at upload (the detector's own
+    annotation). Edits only update metadata and set rendered_annotations, after
+    which the image is rendered from the original and cached in render_cache.
+    """
+    image_format = format_for_filename(entry['annotated_filename'])
+    if not entry.get('rendered_annotations'):
+        try:
+            with open(os.path.join(app.config['UPLOAD_FOLDER'], entry['annotated_filename']), 'rb') as f:
+                return EncodedImage(f.read(), image_format)
+        except FileNotFoundError:
+            return None
+
+    pixels_per_inch = annotation_pixels_per_inch(entry)
+    key = render_key(entry, pixels_per_inch, image_format, ANNOTATED_QUALITY)
+
+    def render():
+        original = cv2.imread(os.path.join(app.config['UPLOAD_FOLDER'], entry['filename']))
+        if original is None:
+            return None
+        annotated_image = render_annotated(original, entry.get('shots') or [], pixels_per_inch)
+        schedule_derivatives(entry['id'], key, annotated_image)
+        return encode_image(annotated_image, image_format, ANNOTATED_QUALITY)
+
+    return render_cache.get_or_render(key, render)
+
+def store_derivatives(image_id, version, annotated_image):
+    """Write the thumbnails of one annotated image version and remove those of older versions"""
+    os.makedirs(os.path.join(DERIVATIVES_FOLDER, image_id), exist_ok=True)
+    current = set()
+    for size, encoded in make_derivatives(annotated_image, DERIVATIVE_QUALITY).items():
+        name = derivative_name(image_id, version, size)
+        save_encoded_image(encoded, os.path.join('derivatives', name))
+        current.add(os.path.basename(name))
+    remove_derivatives(image_id, keep=current)
+
+def remove_derivatives(image_id, keep=()):
+    """Delete an entry's thumbnails, except the file names in keep"""
+    folder = os.path.join(DERIVATIVES_FOLDER, image_id)
+    try:
+        names = os.listdir(folder)
+    except FileNotFoundError:
+        return
+    for name in names:
+        if name not in keep and not name.endswith('.tmp'):
+            try:
+                os.remove(os.path.join(folder, name))
+            except FileNotFoundError:
+                pass
+
+def schedule_derivatives(image_id, version, annotated_image):
+    """Generate thumbnails off the request path (the image must not be modified afterwards)"""
+    def run():
+        try:
+            store_derivatives(image_id, version, annotated_image)
+        except Exception as e:
+            print(f"Error generating thumbnails for {image_id}: {e}")
+    return derivative_executor.submit(run)
+
+def thumbnail_urls(entry):
+    """Versioned URLs of an entry's thumbnails, or None if its annotated image is missing"""
+    try:
+        version = annotation_version(entry)
+    except FileNotFoundError:
+        return None
+    return {
+        size: url_for('get_thumbnail', image_id=entry['id'], size=size, v=version[:16], _external=True)
+        for size in DERIVATIVE_SIZES
+    }
+
+def annotated_image_fields(entry, annotated=None):
+    """
+    Response fields for an entry's annotated image
+
+    Inline by default (a base64 data URL, rendered now if needed). With
+    ?response=url the response carries a versioned /api/annotated URL
+    instead, and nothing is rendered until the browser fetches it.
+    """
+    if request.args.get('response') == 'url':
+        version = annotation_version(entry)
+        return {'annotated_url': url_for('get_annotated_image', image_id=entry['id'], v=version[:16], _external=True)}
+    if annotated is None:
+        annotated = load_annotated_image(entry)
+    return {'annotated_image': annotated.data_url()} if annotated is not None else {}
+
+def cache_image_response(response, version):
+    """Cache immutably when the request's ?v= pins this version; otherwise require revalidation"""
+    requested = request.args.get('v')
+    if requested and version.startswith(requested):
+        response.cache_control.no_cache = None
+        response.cache_control.public = True
+        response.cache_control.max_age = IMAGE_IMMUTABLE_MAX_AGE
+        response.cache_control.immutable = True
+    else:
+        response.cache_control.no_cache = True
+    return response
+
+def annotated_stored(image_id, annotated, annotated_image):
+    """Thumbnails of a new upload are made off the request path, so there is nothing to wait for"""
+    schedule_derivatives(image_id, annotated.digest, annotated_image)
+    return []
+
+# Upload and delete paths shared with the Cloud Function (see targets.py)
+targets = TargetService(
+    image_store, metadata_store, lambda: shot_detector, lambda: moa_calculator, add_reference_scale, admission,
+    annotated_format=ANNOTATED_FORMAT, annotated_quality=ANNOTATED_QUALITY, max_image_pixels=MAX_IMAGE_PIXELS,
+    executor=upload_write_executor, on_annotated=annotated_stored
+)
+
+def analyze_target(image_id, original_name, data=None, filename=None, admission_timeout=ADMISSION_QUEUE_TIMEOUT):
+    """
+    Detect shots in an upload and save its images and metadata entry
+
+    data is the uploaded bytes; without it the original is read from the
+    image store, where it was already stored as filename (as for queued
+    jobs). Returns (metadata_entry, annotated EncodedImage). Safe to run
+    again for the same upload (as queued jobs are after a crash): an entry
+    that was already saved is returned as is, with None for the image.
+    """
+    existing = metadata_store.get(image_id)
+    if existing is not None:
+        return existing, None
     
-    return image
+    if data is None:
+        data = image_store.get(filename)
+        if data is None:
+            raise FileNotFoundError(f"Upload {filename} is missing")
+    metadata_entry, annotated = analyze_image(image_id, original_name, data, admission_timeout, filename)
+    targets.save(metadata_entry)
+    return metadata_entry, annotated
+
+def analyze_image(image_id, original_name, data, admission_timeout=ADMISSION_QUEUE_TIMEOUT, filename=None):
+    """
+    Detect shots in uploaded image bytes and store the original and annotated images
+
+    See TargetService.analyze; returns (metadata_entry, annotated
+    EncodedImage) once both images are on disk. The entry is not saved, and
+    the caller owns its image references.
+    """
+    metadata_entry, annotated, pending = targets.analyze(
+        image_id, original_name, data, admission_timeout=admission_timeout, stored_original=filename)
+    try:
+        for future in pending:
+            future.result()
+    except Exception:
+        targets.discard([metadata_entry])
+        raise
+    return metadata_entry, annotated
+
+def upload_response(entry, annotated=None):
+    """Body of a successful upload response (also the result of a finished upload job)"""
+    return {
+        'success': True,
+        'id': entry['id'],
+        'shot_count': entry['shot_count'],
+        'moa_value': entry['moa_value'],
+        **annotated_image_fields(entry, annotated),
+        'shots': entry['shots']
+    }
+
+def run_analysis_job(payload):
+    """Job handler for queued uploads; the result points at the saved entry"""
+    # Queued jobs already wait their turn, so they wait for capacity instead of failing
+    entry, _ = analyze_target(payload['image_id'], payload.get('original_name'),
+                              filename=payload['filename'], admission_timeout=None)
+    return {'id': entry['id']}
+
+def abandon_analysis_job(payload):
+    """A queued upload given up on releases its stored original, unless an earlier attempt saved the entry"""
+    if metadata_store.get(payload['image_id']) is None:
+        image_store.release(payload['filename'])
+
+def job_response(job):
+    """Public view of a job; a finished job carries the same body a synchronous upload returns"""
+    response = {
+        'job_id': job['id'],
+        'status': job['state'],
+        'status_url': url_for('get_job', job_id=job['id'], _external=True),
+        'events_url': url_for('get_job_events', job_id=job['id'], _external=True)
+    }
+    if job['state'] == 'done':
+        entry = metadata_store.get(job['result']['id'])
+        if entry is not None:
+            response['result'] = upload_response(entry)
+    elif job['state'] == 'failed':
+        response['error'] = job['error']
+    return response
+
+metrics.register_admission(lambda: targets.admission)
+metrics.register_cache('render', lambda: render_cache)
+metrics.REGISTRY.gauge_callback('photomoa_jobs_pending', 'Queued uploads waiting for a worker in this process',
+                                lambda: job_queue.pending())
+
+@app.before_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+
+@app.after_request
+def record_request_metrics(response):
+    """Count the request and time it, by route pattern so IDs do not each get a series"""
+    route = request.url_rule.rule if request.url_rule is not None else 'unmatched'
+    metrics.HTTP_REQUESTS.inc(route, request.method, str(response.status_code))
+    started = g.get('request_started')
+    if started is not None:
+        metrics.HTTP_REQUEST_SECONDS.observe(time.perf_counter() - started, route)
+    return response
+
+def profile_parameters(response, image_id=None):
+    """What a profiled request ran on, so it can be reproduced offline"""
+    if image_id is None and response.is_json:
+        image_id = (response.get_json(silent=True) or {}).get('id')
+    entry = metadata_store.get(image_id) if image_id else None
+    return {
+        'route': request.url_rule.rule,
+        'method': request.method,
+        'args': request.args.to_dict(),
+        'files': [{'field': field, 'filename': file.filename, 'bytes': len(buffer_bytes(file))}
+                  for field, file in request.files.items(multi=True)],
+        'json': request.get_json(silent=True),
+        'status': response.status_code,
+        'image_id': image_id,
+        'image': entry and {key: entry.get(key) for key in
+                            ('filename', 'original_name', 'annotated_filename', 'shots', 'manual_shots', 'calibration')},
+        'annotated_format': ANNOTATED_FORMAT,
+        'annotated_quality': ANNOTATED_QUALITY,
+        **detector_parameters(shot_detector, moa_calculator)
+    }
+
+def profiled(view):
+    """
+    Run a view under RequestProfiler when the request asks for it (see profiling.py)
+
+    The profile is written to PROFILES_FOLDER/<profile id>/, and the id is
+    returned in the X-Profile-Id header.
+    """
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        if not profile_requested(request, PROFILING, PROFILING_TOKEN):
+            return view(*args, **kwargs)
+        with RequestProfiler(PROFILE_SAMPLE_INTERVAL_MS / 1000) as profiler:
+            response = app.make_response(view(*args, **kwargs))
+        profile_id = new_id()
+        folder = os.path.join(PROFILES_FOLDER, profile_id)
+        os.makedirs(folder, exist_ok=True)
+        params = profile_parameters(response, kwargs.get('image_id'))
+        files = profiler.files(params)
+        # Keep the image too, so the profile outlives the entry it was taken on
+        original = params['image'] and image_store.get(params['image']['filename'])
+        if original:
+            files['original' + os.path.splitext(params['image']['filename'])[1]] = original
+        for name, data in files.items():
+            with open(os.path.join(folder, name), 'wb') as f:
+                f.write(data)
+        response.headers['X-Profile-Id'] = profile_id
+        return response
+    return wrapper
+
+@app.errorhandler(RequestEntityTooLarge)
+@app.errorhandler(UnsupportedMediaType)
+def upload_rejected(error):
+    """Uploads refused while the body is being read (too large, or not an image)"""
+    return jsonify({'error': error.description}), error.code
 
 @app.route('/api/upload', methods=['POST'])
+@profiled
 def upload_target():
-    """Handle target photo upload and analysis"""
+    """
+    Handle target photo upload and analysis
+
+    With ?mode=async the upload is stored and queued, and the response is
+    202 with a job id; poll /api/jobs/<job_id> or subscribe to
+    /api/jobs/<job_id>/events for the result.
+    """
     try:
         if 'image' not in request.files:
             return jsonify({'error': 'No image file provided'}), 400
@@ -92,84 +425,333 @@ def upload_target():
         if file.filename == '':
             return jsonify({'error': 'No file selected'}), 400
         
-        # Save the uploaded file
-        timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-        filename = f"target_{timestamp}_{file.filename}"
-        filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-        file.save(filepath)
-        
-        # Load and process the image
-        image = cv2.imread(filepath)
-        if image is None:
-            return jsonify({'error': 'Invalid image file'}), 400
-        
-        # Detect shots in the image
-        shots, annotated_image = shot_detector.detect_shots(image)
-        
-        # Add 1-inch reference scale to the image
-        annotated_image = add_reference_scale(annotated_image)
-        
-        # Calculate MOA if shots are detected
-        moa_value = None
-        if len(shots) > 0:
-            moa_value = moa_calculator.calculate_moa(shots)
-        
-        # Save annotated image
-        annotated_filename = f"annotated_{filename}"
-        annotated_filepath = os.path.join(app.config['UPLOAD_FOLDER'], annotated_filename)
-        cv2.imwrite(annotated_filepath, annotated_image)
-        
-        # Convert annotated image to base64 for frontend display
-        _, buffer = cv2.imencode('.jpg', annotated_image)
-        img_base64 = base64.b64encode(buffer).decode('utf-8')
-        
-        # Create metadata entry
-        metadata_entry = {
-            'id': timestamp,
-            'filename': filename,
-            'annotated_filename': annotated_filename,
-            'upload_time': datetime.now().isoformat(),
-            'shot_count': len(shots),
-            'moa_value': moa_value,
-            'shots': shots.tolist() if shots is not None else []
-        }
-        
-        # Update metadata
-        metadata = load_metadata()
-        metadata.append(metadata_entry)
-        save_metadata(metadata)
-        
-        return jsonify({
-            'success': True,
-            'id': timestamp,
-            'shot_count': len(shots),
-            'moa_value': moa_value,
-            'annotated_image': f"data:image/jpeg;base64,{img_base64}",
-            'shots': shots.tolist() if shots is not None else []
-        })
-        
+        # The upload was buffered in memory by the request; work from those bytes
+        image_id = new_id()
+        data = buffer_bytes(file)
+        
+        if request.args.get('mode') == 'async':
+            # Refuse bad uploads now rather than in a job the client has to poll
+            try:
+                info = probe_image(io.BytesIO(data), MAX_IMAGE_PIXELS)
+            except InvalidImage as e:
+                return jsonify({'error': str(e)}), e.status_code
+            # The job must not outlive its input, so flush the upload to disk first
+            filename = image_store.put(data, info.extension, fsync=True).name
+            job = job_queue.submit({'image_id': image_id, 'filename': filename, 'original_name': file.filename})
+            response = jsonify(job_response(job))
+            response.status_code = 202
+            response.headers['Location'] = url_for('get_job', job_id=job['id'])
+            return response
+        
+        try:
+            metadata_entry, annotated = analyze_target(image_id, file.filename, data)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), getattr(e, 'status_code', 400)
+        except AdmissionRejected as e:
+            response = jsonify({'error': str(e), 'retry_after': e.retry_after})
+            response.status_code = 429
+            response.headers['Retry-After'] = str(e.retry_after)
+            return response
+        return jsonify(upload_response(metadata_entry, annotated))
+        
+    except (RequestEntityTooLarge, UnsupportedMediaType):
+        raise
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+@app.route('/api/upload/batch', methods=['POST'])
+def upload_batch():
+    """
+    Upload and analyze many targets at once
+
+    Accepts any number of 'images' files, each an image or a zip archive of
+    images. They are analyzed in parallel, at most BATCH_WORKERS at a time
+    (archive members are extracted only when their turn comes), and the
+    response streams one NDJSON line per image as it finishes ({index,
+    filename} plus the single upload fields, or an error), in completion
+    order. The metadata for the whole batch is saved in one write, after
+    which a final {"done": true, ...} line is sent.
+    """
+    files = request.files.getlist('images')
+    if not files:
+        return jsonify({'error': 'No image files provided'}), 400
+    try:
+        items = expand_batch([(file.filename, buffer_bytes(file)) for file in files],
+                             BATCH_MAX_IMAGES, BATCH_MAX_IMAGE_MB * 1024 * 1024, BATCH_MAX_TOTAL_MB * 1024 * 1024)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    errors = [{'index': index, 'filename': name, 'error': error}
+              for index, (name, _, error) in enumerate(items) if error is not None]
+    # The batch was accepted as a whole, so its images wait for detection capacity
+    batch = BoundedBatch(
+        batch_executor, lambda name, read: analyze_image(new_id(), os.path.basename(name), read(), None),
+        [(index, name, read) for index, (name, read, error) in enumerate(items) if error is None], BATCH_WORKERS
+    )
+    
+    def stream():
+        try:
+            for line in errors:
+                yield json.dumps(line) + '\n'
+            for index, name, future in batch:
+                try:
+                    entry, annotated = future.result()
+                except Exception as e:
+                    line = {'index': index, 'filename': name, 'error': str(e)}
+                else:
+                    line = {'index': index, 'filename': name, **upload_response(entry, annotated)}
+                yield json.dumps(line) + '\n'
+        finally:
+            # A client that disconnects early still gets everything that was analyzed saved
+            entries = [future.result()[0] for future in batch.finish() if future.exception() is None]
+            if entries:
+                targets.save_many(entries)
+        yield json.dumps({
+            'done': True,
+            'saved': len(entries),
+            'failed': len(items) - len(entries),
+            'ids': [entry['id'] for entry in entries]
+        }) + '\n'
+    
+    return Response(stream_with_context(stream()), mimetype='application/x-ndjson',
+                    headers={'X-Accel-Buffering': 'no'})
+
+@app.route('/api/jobs/<job_id>', methods=['GET'])
+def get_job(job_id):
+    """Status of a queued upload ('queued', 'running', 'done' with result, or 'failed' with error)"""
+    job = job_queue.get(job_id)
+    if job is None:
+        return jsonify({'error': 'Job not found'}), 404
+    return jsonify(job_response(job))
+
+@app.route('/api/jobs/<job_id>/events', methods=['GET'])
+def get_job_events(job_id):
+    """Server-sent events for a queued upload: one event per state change, ending when it finishes"""
+    job = job_queue.get(job_id)
+    if job is None:
+        return jsonify({'error': 'Job not found'}), 404
+
+    def stream():
+        state = None
+        current = job
+        last_sent = time.monotonic()
+        while True:
+            if current['state'] != state:
+                state = current['state']
+                last_sent = time.monotonic()
+                yield f"event: {state}\ndata: {json.dumps(job_response(current))}\n\n"
+                if state in ('done', 'failed'):
+                    return
+            elif time.monotonic() - last_sent >= JOB_EVENTS_HEARTBEAT:
+                last_sent = time.monotonic()
+                yield ": keep-alive\n\n"
+            # Wakes up on state changes in this process; jobs run by other workers are polled
+            current = job_queue.wait(job_id, timeout=1.0) or current
+
+    return Response(stream_with_context(stream()), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+def project_entry(entry, fields=None, exclude=None):
+    """Return a copy of a metadata entry limited to the requested fields ('id' is always kept)"""
+    if fields:
+        return {key: value for key, value in entry.items() if key in fields or key == 'id'}
+    if exclude:
+        return {key: value for key, value in entry.items() if key not in exclude}
+    return entry
+
+def history_entry(entry, fields=None, exclude=None):
+    """Projected history entry plus the URLs of its thumbnails (requested like any other field)"""
+    projected = project_entry(entry, fields, exclude)
+    if (fields and 'thumbnails' not in fields) or (exclude and 'thumbnails' in exclude):
+        return projected
+    thumbnails = thumbnail_urls(entry)
+    return {**projected, 'thumbnails': thumbnails} if thumbnails else projected
+
+def parse_field_list(value):
+    """Parse a comma separated query parameter into a set of field names"""
+    return {field.strip() for field in value.split(',') if field.strip()} if value else None
+
 @app.route('/api/history', methods=['GET'])
 def get_history():
-    """Get upload history"""
+    """
+    Get upload history, newest first
+
+    Query parameters (all optional; without them the full history is returned):
+        limit: Page size, up to HISTORY_MAX_LIMIT
+        after: Cursor from the previous page's X-Next-Cursor header
+        fields: Comma separated fields to include, e.g. fields=id,upload_time,moa_value
+        exclude: Comma separated fields to omit, e.g. exclude=shots
+    """
     try:
-        metadata = load_metadata()
-        metadata.sort(key=lambda entry: entry['upload_time'], reverse=True)
-        return jsonify(metadata)
+        limit = request.args.get('limit', type=int)
+        after = request.args.get('after')
+        fields = parse_field_list(request.args.get('fields'))
+        exclude = parse_field_list(request.args.get('exclude'))
+        
+        if limit is not None and not 1 <= limit <= HISTORY_MAX_LIMIT:
+            return jsonify({'error': f'limit must be between 1 and {HISTORY_MAX_LIMIT}'}), 400
+        try:
+            after_key = decode_cursor(after) if after else None
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        
+        # The store version changes on every write, so it identifies this exact response
+        version = metadata_store.version()
+        # (thumbnail URLs are absolute, so the host is part of it too)
+        etag = hashlib.sha1(f"{version}|{request.host_url}|{request.query_string.decode()}".encode()).hexdigest()
+        last_modified = metadata_store.last_modified()
+        
+        if request.if_none_match.contains(etag):
+            response = app.response_class(status=304)
+        else:
+            if limit is None and after_key is None:
+                entries, next_cursor = metadata_store.list_entries(), None
+            else:
+                page_size = limit or HISTORY_MAX_LIMIT
+                entries = metadata_store.list_page(page_size + 1, after_key)
+                next_cursor = encode_cursor(entries[page_size - 1]) if len(entries) > page_size else None
+                entries = entries[:page_size]
+            
+            response = jsonify([history_entry(entry, fields, exclude) for entry in entries])
+            if next_cursor:
+                response.headers['X-Next-Cursor'] = next_cursor
+                next_args = request.args.to_dict()
+                next_args['after'] = next_cursor
+                response.headers['Link'] = f'<{request.base_url}?{urlencode(next_args)}>; rel="next"'
+        
+        response.set_etag(etag)
+        if last_modified is not None:
+            response.last_modified = datetime.fromtimestamp(last_modified, timezone.utc)
+        response.headers['Cache-Control'] = 'no-cache'
+        return response.make_conditional(request)
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+# path -> ((inode, mtime_ns, size), sha256) so each image is hashed once per version, least recently used first
+_image_digests = OrderedDict()
+_image_digests_lock = threading.Lock()
+
+def file_digest(path):
+    """SHA-256 of a file's contents, cached (up to IMAGE_DIGEST_CACHE_SIZE files) until the file is replaced"""
+    stat = os.stat(path)
+    key = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+    with _image_digests_lock:
+        cached = _image_digests.get(path)
+        if cached is not None and cached[0] == key:
+            _image_digests.move_to_end(path)
+            return cached[1]
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(chunk)
+    with _image_digests_lock:
+        _image_digests[path] = (key, digest.hexdigest())
+        _image_digests.move_to_end(path)
+        while len(_image_digests) > IMAGE_DIGEST_CACHE_SIZE:
+            _image_digests.popitem(last=False)
+    return digest.hexdigest()
+
 @app.route('/api/image/<filename>')
 def get_image(filename):
-    """Serve images from uploads folder"""
+    """
+    Serve images from uploads folder
+
+    The strong ETag is the SHA-256 of the file, so If-None-Match gets a 304
+    and Range requests get 206 via send_from_directory. Content-addressed
+    names (see image_store.py) are that hash, so they are served without
+    reading the file first and are always cached as immutable; for older
+    files the hash is computed once, and only a URL whose ?v= matches it is
+    immutable. The file itself goes out through the server's
+    wsgi.file_wrapper (sendfile under gunicorn), or as an X-Sendfile header
+    with USE_X_SENDFILE.
+    """
     try:
-        return send_from_directory(app.config['UPLOAD_FOLDER'], filename)
+        path = safe_join(app.config['UPLOAD_FOLDER'], filename)
+        if path is None or not os.path.isfile(path):
+            return jsonify({'error': 'Image not found'}), 404
+        digest = content_digest(filename)
+        if digest is not None:
+            pinned = True
+        else:
+            digest = file_digest(path)
+            version = request.args.get('v')
+            pinned = bool(version) and digest.startswith(version)
+        response = send_from_directory(
+            app.config['UPLOAD_FOLDER'], filename, etag=digest,
+            max_age=IMAGE_IMMUTABLE_MAX_AGE if pinned else None
+        )
+        if pinned:
+            response.cache_control.immutable = True
+        return response
     except Exception as e:
         return jsonify({'error': str(e)}), 404
 
+@app.route('/api/annotated/<image_id>')
+def get_annotated_image(image_id):
+    """
+    Serve an entry's current annotated image, rendering it on first request
+
+    The strong ETag is the annotation version, so revalidation (If-None-Match)
+    is answered from metadata alone without rendering.
+    """
+    try:
+        entry = metadata_store.get(image_id)
+        if entry is None:
+            return jsonify({'error': 'Image not found'}), 404
+        version = annotation_version(entry)
+        if version in request.if_none_match:
+            response = app.response_class(status=304)
+            response.set_etag(version)
+            return cache_image_response(response, version)
+
+        annotated = load_annotated_image(entry)
+        if annotated is None:
+            return jsonify({'error': 'Image not found'}), 404
+        response = app.response_class(annotated.data, mimetype=annotated.mime_type)
+        response.set_etag(version)
+        cache_image_response(response, version)
+        return response.make_conditional(request, accept_ranges=True)
+    except FileNotFoundError:
+        return jsonify({'error': 'Image not found'}), 404
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/annotated/<image_id>/<size>')
+def get_thumbnail(image_id, size):
+    """
+    Serve a thumbnail of an entry's current annotated image (size is 'small' or 'medium')
+
+    Thumbnails are normally written in the background after upload or render;
+    one that does not exist yet (e.g. right after an edit) is generated here.
+    """
+    try:
+        entry = metadata_store.get(image_id)
+        if entry is None or size not in DERIVATIVE_SIZES:
+            return jsonify({'error': 'Image not found'}), 404
+        version = annotation_version(entry)
+        etag = f"{version}-{size}"
+        if etag in request.if_none_match:
+            response = app.response_class(status=304)
+            response.set_etag(etag)
+            return cache_image_response(response, version)
+
+        name = derivative_name(image_id, version, size)
+        if not os.path.isfile(os.path.join(DERIVATIVES_FOLDER, name)):
+            annotated = load_annotated_image(entry)
+            if annotated is None:
+                return jsonify({'error': 'Image not found'}), 404
+            image = cv2.imdecode(np.frombuffer(annotated.data, np.uint8), cv2.IMREAD_COLOR)
+            store_derivatives(image_id, version, image)
+
+        response = send_from_directory(DERIVATIVES_FOLDER, name, etag=etag)
+        return cache_image_response(response, version)
+    except FileNotFoundError:
+        return jsonify({'error': 'Image not found'}), 404
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
 @app.route('/api/update-shots/<image_id>', methods=['POST'])
+@profiled
 def update_shots(image_id):
     """Update shots with manual selections and recalculate MOA"""
     try:
@@ -179,31 +761,17 @@ def update_shots(image_id):
         manual_shots = data.get('manual_shots', [])
         print(f"Manual shots: {manual_shots}")
         
-        # Load current metadata
-        metadata = load_metadata()
-        print(f"Loaded metadata with {len(metadata)} entries")
-        
         # Find the image entry
-        image_entry = None
-        for entry in metadata:
-            if entry['id'] == image_id:
-                image_entry = entry
-                break
+        image_entry = metadata_store.get(image_id)
         
         if not image_entry:
             print(f"Image entry not found for id: {image_id}")
-            available_ids = [entry['id'] for entry in metadata]
+            available_ids = [entry['id'] for entry in metadata_store.list_entries()]
             print(f"Available IDs: {available_ids}")
             return jsonify({'error': f'Image not found. Available IDs: {available_ids}'}), 404
         
         print(f"Found image entry: {image_entry['filename']}")
         
-        # Load the original image
-        original_filepath = os.path.join(app.config['UPLOAD_FOLDER'], image_entry['filename'])
-        image = cv2.imread(original_filepath)
-        if image is None:
-            return jsonify({'error': 'Could not load original image'}), 400
-        
         # Combine auto-detected shots with manual shots
         auto_shots = np.array(image_entry['shots']) if image_entry['shots'] else np.array([])
         manual_shots_array = np.array(manual_shots) if manual_shots else np.array([])
@@ -234,20 +802,6 @@ def update_shots(image_id):
         
         print(f"Combined shots shape: {all_shots.shape if len(all_shots) > 0 else 'empty'}")
         
-        # Create new annotated image with all shots
-        annotated_image = image.copy()
-        if len(all_shots) > 0:
-            for shot in all_shots:
-                x, y, radius = int(shot[0]), int(shot[1]), int(shot[2])
-                # Draw circle around detected shot
-                cv2.circle(annotated_image, (x, y), radius, (0, 255, 0), 2)
-                # Draw center point
-                cv2.circle(annotated_image, (x, y), 2, (0, 0, 255), -1)
-        
-        # Add 1-inch reference scale to the updated image (use calibrated scale if available)
-        scale_pixels_per_inch = image_entry['calibration']['pixels_per_inch'] if 'calibration' in image_entry else None
-        annotated_image = add_reference_scale(annotated_image, scale_pixels_per_inch)
-        
         # Recalculate MOA with all shots using calibration if available
         moa_value = None
         if len(all_shots) > 0:
@@ -260,30 +814,24 @@ def update_shots(image_id):
                 # Use default calibration
                 moa_value = moa_calculator.calculate_moa(all_shots)
         
-        # Save updated annotated image
-        annotated_filepath = os.path.join(app.config['UPLOAD_FOLDER'], image_entry['annotated_filename'])
-        cv2.imwrite(annotated_filepath, annotated_image)
-        
-        # Convert annotated image to base64
-        _, buffer = cv2.imencode('.jpg', annotated_image)
-        img_base64 = base64.b64encode(buffer).decode('utf-8')
-        
-        # Update metadata entry
-        image_entry['shot_count'] = len(all_shots)
-        image_entry['moa_value'] = moa_value
-        image_entry['shots'] = all_shots.tolist() if len(all_shots) > 0 else []
-        image_entry['manual_shots'] = manual_shots
-        image_entry['last_updated'] = datetime.now().isoformat()
-        
-        # Save updated metadata
-        save_metadata(metadata)
+        # Update metadata entry; the annotated image is rendered from it when requested
+        updated_entry = metadata_store.update(image_id, {
+            'shot_count': len(all_shots),
+            'moa_value': moa_value,
+            'shots': all_shots.tolist() if len(all_shots) > 0 else [],
+            'manual_shots': manual_shots,
+            'last_updated': datetime.now().isoformat(),
+            'rendered_annotations': True
+        })
+        if updated_entry is None:
+            return jsonify({'error': 'Image not found'}), 404
         
         return jsonify({
             'success': True,
             'id': image_id,
             'shot_count': len(all_shots),
             'moa_value': moa_value,
-            'annotated_image': f"data:image/jpeg;base64,{img_base64}",
+            **annotated_image_fields(updated_entry),
             'shots': all_shots.tolist() if len(all_shots) > 0 else [],
             'manual_shots': manual_shots
         })
@@ -292,6 +840,7 @@ def update_shots(image_id):
         return jsonify({'error': str(e)}), 500
 
 @app.route('/api/calibrate/<image_id>', methods=['POST'])
+@profiled
 def calibrate_scale(image_id):
     """Calibrate the scale for an image using two reference points"""
     try:
@@ -312,15 +861,8 @@ def calibrate_scale(image_id):
         # Calculate pixels per inch
         pixels_per_inch = pixel_distance / distance_inches
         
-        # Load current metadata
-        metadata = load_metadata()
-        
         # Find the image entry
-        image_entry = None
-        for entry in metadata:
-            if entry['id'] == image_id:
-                image_entry = entry
-                break
+        image_entry = metadata_store.get(image_id)
         
         if not image_entry:
             return jsonify({'error': 'Image not found'}), 404
@@ -343,41 +885,24 @@ def calibrate_scale(image_id):
             if len(shots_array) > 0:
                 image_entry['moa_value'] = temp_calculator.calculate_moa(shots_array)
         
-        # Regenerate annotated image with new calibrated reference scale
-        original_filepath = os.path.join(app.config['UPLOAD_FOLDER'], image_entry['filename'])
-        image = cv2.imread(original_filepath)
-        if image is not None:
-            # Create new annotated image with existing shots
-            annotated_image = image.copy()
-            if image_entry['shots']:
-                shots_array = np.array(image_entry['shots'])
-                # Ensure shots have radius values
-                if len(shots_array) > 0:
-                    if shots_array.shape[1] == 2:  # Only x, y - add default radius
-                        shots_array = np.column_stack([shots_array, np.full(len(shots_array), 10)])
-                    
-                    for shot in shots_array:
-                        x, y, radius = int(shot[0]), int(shot[1]), int(shot[2])
-                        # Draw circle around detected shot
-                        cv2.circle(annotated_image, (x, y), radius, (0, 255, 0), 2)
-                        # Draw center point
-                        cv2.circle(annotated_image, (x, y), 2, (0, 0, 255), -1)
-            
-            # Add reference scale with new calibrated pixels_per_inch
-            annotated_image = add_reference_scale(annotated_image, pixels_per_inch)
-            
-            # Save updated annotated image
-            annotated_filepath = os.path.join(app.config['UPLOAD_FOLDER'], image_entry['annotated_filename'])
-            cv2.imwrite(annotated_filepath, annotated_image)
-        
-        # Save updated metadata
-        save_metadata(metadata)
+        # Save updated metadata; the annotated image (with the new scale) is rendered when requested
+        updated_entry = metadata_store.update(image_id, {
+            'calibration': image_entry['calibration'],
+            'moa_value': image_entry.get('moa_value'),
+            'rendered_annotations': True
+        })
+        if updated_entry is None:
+            return jsonify({'error': 'Image not found'}), 404
         
-        return jsonify({
+        result = {
             'success': True,
             'pixels_per_inch': pixels_per_inch,
             'moa_value': image_entry.get('moa_value')
-        })
+        }
+        # Only URL mode returns the annotated image, which costs nothing until it is fetched
+        if request.args.get('response') == 'url':
+            result.update(annotated_image_fields(updated_entry))
+        return jsonify(result)
         
     except Exception as e:
         return jsonify({'error': str(e)}), 500
@@ -386,44 +911,34 @@ def calibrate_scale(image_id):
 def delete_target(image_id):
     """Delete a target and its associated files"""
     try:
-        # Load current metadata
-        metadata = load_metadata()
-        
-        # Find the image entry
-        image_entry = None
-        entry_index = None
-        for i, entry in enumerate(metadata):
-            if entry['id'] == image_id:
-                image_entry = entry
-                entry_index = i
-                break
-        
-        if not image_entry:
+        # Remove the entry; image files other entries share stay
+        if targets.delete(image_id) is None:
             return jsonify({'error': 'Image not found'}), 404
-        
-        # Delete the actual image files
-        original_filepath = os.path.join(app.config['UPLOAD_FOLDER'], image_entry['filename'])
-        annotated_filepath = os.path.join(app.config['UPLOAD_FOLDER'], image_entry['annotated_filename'])
-        
-        # Remove files if they exist
-        if os.path.exists(original_filepath):
-            os.remove(original_filepath)
-        if os.path.exists(annotated_filepath):
-            os.remove(annotated_filepath)
-        
-        # Remove entry from metadata
-        metadata.pop(entry_index)
-        save_metadata(metadata)
+        remove_derivatives(image_id)
         
         return jsonify({'success': True, 'message': 'Target deleted successfully'})
         
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+@app.route('/api/metrics', methods=['GET'])
+def get_metrics():
+    """Request, upload and detection metrics of this worker in the Prometheus text format"""
+    return Response(metrics.REGISTRY.render(), content_type=metrics.CONTENT_TYPE)
+
 @app.route('/api/health', methods=['GET'])
 def health_check():
     """Health check endpoint"""
     return jsonify({'status': 'healthy', 'service': 'photoMOA backend'})
 
+# Uploads queued with ?mode=async (including ones left unfinished by a previous run).
+# The workers start with the first request a process serves, so importing the
+# app (tests, the gunicorn --preload master) spawns no threads to fork
+job_queue = JobQueue(JOBS_FOLDER, run_analysis_job, workers=ANALYSIS_WORKERS, abandon=abandon_analysis_job)
+
+@app.before_request
+def start_job_workers():
+    job_queue.start()
+
 if __name__ == '__main__':
     app.run(debug=True, host='0.0.0.0', port=5001)
@@ -0,0 +1,392 @@
+#!/usr/bin/env python3
+"""
+Load test for the Flask API
+
+Drives upload, update-shots, calibrate, history and delete requests, in a
+configurable mix and concurrency, against a locally started app (or any
+running one with --url), using synthetic target images. Reports throughput,
+latency percentiles and error rates per operation, and the server's
+resident memory.
+
+By default the app is started in a subprocess with the Flask development
+server and a throwaway upload folder and metadata store; pass --server-cmd
+to start it some other way (e.g. under gunicorn to size workers). Edits,
+calibrations and deletes work on targets uploaded during the run, after a
+few seeded ones; a delete with nothing left to delete uploads instead.
+
+Usage:
+    python bench_load.py                                    # 30 s, 8 clients, default mix
+    python bench_load.py --concurrency 32 --duration 60
+    python bench_load.py --mix upload=1,history=10 --requests 2000
+    python bench_load.py --server-cmd "gunicorn -w 4 -b 127.0.0.1:{port} app:app"
+    python bench_load.py --url http://localhost:5001       # an app that is already running
+    python bench_load.py --min-throughput 20 --max-p95-ms 2000 --max-error-rate 0.01  # fail on regressions
+"""
+import argparse
+import json
+import math
+import os
+import random
+import shlex
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+import requests
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+OPERATIONS = ('upload', 'update', 'calibrate', 'history', 'delete')
+DEFAULT_MIX = 'upload=2,update=3,calibrate=1,history=4,delete=1'
+
+
+def parse_mix(text):
+    """'upload=2,history=4' -> {'upload': 2.0, 'history': 4.0}"""
+    mix = {}
+    for part in text.split(','):
+        name, _, weight = part.partition('=')
+        name = name.strip()
+        if name not in OPERATIONS:
+            raise ValueError(f"Unknown operation '{name}' (expected one of {', '.join(OPERATIONS)})")
+        mix[name] = float(weight or 1)
+    if not any(mix.values()):
+        raise ValueError('The mix needs at least one operation with a positive weight')
+    return mix
+
+
+def synthetic_targets(count, width=1200, height=900, seed=0):
+    """JPEG bytes of distinct target-like images (dark holes on a light, noisy background)"""
+    import cv2
+    import numpy as np
+
+    rng = np.random.default_rng(seed)
+    images = []
+    for _ in range(count):
+        # Distinct bytes, so content-addressed storage does not deduplicate them
+        image = rng.integers(225, 255, (height, width, 3), dtype=np.uint8)
+        cv2.circle(image, (width // 2, height // 2), min(width, height) // 3, (40, 40, 40), 3)
+        for _ in range(int(rng.integers(3, 10))):
+            center = (int(rng.integers(50, width - 50)), int(rng.integers(50, height - 50)))
+            cv2.circle(image, center, int(rng.integers(6, 14)), (0, 0, 0), -1)
+        images.append(cv2.imencode('.jpg', image, [cv2.IMWRITE_JPEG_QUALITY, 90])[1].tobytes())
+    return images
+
+
+def percentile(sorted_values, fraction):
+    """Nearest-rank percentile of an already sorted list"""
+    if not sorted_values:
+        return None
+    rank = math.ceil(fraction * len(sorted_values))
+    return sorted_values[min(max(rank, 1), len(sorted_values)) - 1]
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def process_rss_bytes(pid):
+    """(current, peak) resident memory of a local process from /proc, or (None, None) off Linux"""
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            fields = dict(line.split(':', 1) for line in f if ':' in line)
+    except OSError:
+        return None, None
+
+    def value(name):
+        # Reported in kB
+        return int(fields[name].split()[0]) * 1024 if name in fields else None
+    return value('VmRSS'), value('VmHWM')
+
+
+def scraped_peak_rss_bytes(url):
+    """Peak RSS the app reports at /api/metrics (one worker's, under a multi-process server)"""
+    try:
+        text = requests.get(f"{url}/api/metrics", timeout=10).text
+    except requests.RequestException:
+        return None
+    for line in text.splitlines():
+        if line.startswith('photomoa_process_peak_rss_bytes '):
+            return int(float(line.split()[1]))
+    return None
+
+
+class Server:
+    """The app in a subprocess, with its own upload folder and metadata store"""
+
+    def __init__(self, command=None, env=None):
+        self.port = free_port()
+        self.url = f"http://127.0.0.1:{self.port}"
+        self.folder = tempfile.mkdtemp(prefix='photomoa-load-')
+        if command is None:
+            code = ("import app; from werkzeug.serving import run_simple; "
+                    f"run_simple('127.0.0.1', {self.port}, app.app, threaded=True)")
+            self.command = [sys.executable, '-c', code]
+        else:
+            self.command = shlex.split(command.format(port=self.port))
+        self.env = {
+            **os.environ,
+            'UPLOAD_FOLDER': os.path.join(self.folder, 'uploads'),
+            'METADATA_FILE': os.path.join(self.folder, 'metadata.json'),
+            'METADATA_DB': os.path.join(self.folder, 'metadata.db'),
+            'METADATA_JOURNAL': os.path.join(self.folder, 'metadata.journal'),
+            **(env or {})
+        }
+        self.process = None
+
+    def start(self, timeout=60):
+        self.process = subprocess.Popen(self.command, cwd=HERE, env=self.env,
+                                        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            if self.process.poll() is not None:
+                raise RuntimeError(f"Server exited with status {self.process.returncode}")
+            try:
+                if requests.get(f"{self.url}/api/health", timeout=1).ok:
+                    return self
+            except requests.RequestException:
+                time.sleep(0.2)
+        self.stop()
+        raise RuntimeError(f"Server did not answer /api/health within {timeout} s")
+
+    def rss(self):
+        return process_rss_bytes(self.process.pid)
+
+    def stop(self):
+        if self.process is not None and self.process.poll() is None:
+            self.process.terminate()
+            try:
+                self.process.wait(10)
+            except subprocess.TimeoutExpired:
+                self.process.kill()
+                self.process.wait()
+        shutil.rmtree(self.folder, ignore_errors=True)
+
+
+class LoadTest:
+    def __init__(self, url, mix, images, concurrency=8, duration=30.0, max_requests=None, seed=0):
+        """
+        Args:
+            url: Base URL of the app
+            mix: {operation: weight}
+            images: Image bytes uploads cycle through
+            concurrency: Client threads, each with its own keep-alive connection
+            duration: Seconds to run (unless max_requests is reached first)
+            max_requests: Total requests to send, or None for no limit
+            seed: Seed for the operation mix and request contents
+        """
+        self.url = url
+        self.operations = list(mix)
+        self.weights = [mix[name] for name in self.operations]
+        self.images = images
+        self.concurrency = concurrency
+        self.duration = duration
+        self.max_requests = max_requests
+        self.seed = seed
+        self.ids = []  # Targets uploaded by the run and not being edited, available to edit or delete
+        self.results = {}  # operation -> list of (seconds, status or None)
+        self._lock = threading.Lock()
+        self._sent = 0
+        self._uploads = 0
+
+    def _next_image(self):
+        with self._lock:
+            self._uploads += 1
+            return self.images[self._uploads % len(self.images)]
+
+    def _take_request(self):
+        with self._lock:
+            if self.max_requests is not None and self._sent >= self.max_requests:
+                return False
+            self._sent += 1
+            return True
+
+    def _take_id(self, rng):
+        # Taken out of the pool while in use, so a target is never deleted mid-edit
+        with self._lock:
+            if not self.ids:
+                return None
+            return self.ids.pop(rng.randrange(len(self.ids)))
+
+    def _return_id(self, image_id):
+        with self._lock:
+            self.ids.append(image_id)
+
+    def upload(self, session, rng):
+        files = {'image': ('target.jpg', self._next_image(), 'image/jpeg')}
+        response = session.post(f"{self.url}/api/upload", files=files, timeout=120)
+        if response.ok:
+            with self._lock:
+                self.ids.append(response.json()['id'])
+        return response
+
+    def request(self, operation, session, rng):
+        """Send one request of an operation; returns (operation actually sent, response)"""
+        if operation == 'history':
+            return operation, session.get(f"{self.url}/api/history", params={'limit': 20}, timeout=60)
+        image_id = None if operation == 'upload' else self._take_id(rng)
+        if image_id is None:
+            return 'upload', self.upload(session, rng)
+        if operation == 'delete':
+            return operation, session.delete(f"{self.url}/api/delete/{image_id}", timeout=60)
+        try:
+            if operation == 'update':
+                shots = [[rng.randint(0, 1000), rng.randint(0, 800)] for _ in range(rng.randint(1, 3))]
+                return operation, session.post(f"{self.url}/api/update-shots/{image_id}",
+                                               json={'manual_shots': shots}, timeout=60)
+            x, y = rng.randint(0, 800), rng.randint(0, 600)
+            body = {'point1': [x, y], 'point2': [x + rng.randint(50, 200), y], 'distance_inches': 1.0}
+            return operation, session.post(f"{self.url}/api/calibrate/{image_id}", json=body, timeout=60)
+        finally:
+            self._return_id(image_id)
+
+    def _client(self, index, deadline):
+        rng = random.Random(self.seed * 1000 + index)
+        session = requests.Session()
+        results = {name: [] for name in OPERATIONS}
+        while time.monotonic() < deadline and self._take_request():
+            operation = rng.choices(self.operations, self.weights)[0]
+            started = time.perf_counter()
+            try:
+                operation, response = self.request(operation, session, rng)
+                status = response.status_code
+            except requests.RequestException:
+                status = None
+            results[operation].append((time.perf_counter() - started, status))
+        with self._lock:
+            for name, samples in results.items():
+                self.results.setdefault(name, []).extend(samples)
+
+    def seed_targets(self, count):
+        """Upload targets for the first edits and deletes to work on (not measured)"""
+        session = requests.Session()
+        rng = random.Random(self.seed)
+        for _ in range(count):
+            self.upload(session, rng).raise_for_status()
+
+    def run(self):
+        """Run the load; returns the elapsed seconds"""
+        deadline = time.monotonic() + self.duration
+        threads = [threading.Thread(target=self._client, args=(i, deadline), daemon=True)
+                   for i in range(self.concurrency)]
+        started = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return time.perf_counter() - started
+
+
+def summarize(results, elapsed):
+    """{operation or 'total': {requests, throughput, errors, error_rate, rejected, p50_ms, p95_ms, p99_ms, max_ms}}"""
+    summary = {}
+    every = []
+    for name in OPERATIONS + ('total',):
+        samples = every if name == 'total' else results.get(name, [])
+        if name != 'total':
+            every.extend(samples)
+        if not samples:
+            continue
+        latencies = sorted(seconds * 1000 for seconds, _ in samples)
+        # 429s are admission control turning work away, reported apart from failures
+        rejected = sum(1 for _, status in samples if status == 429)
+        errors = sum(1 for _, status in samples if status is None or (status >= 400 and status != 429))
+        summary[name] = {
+            'requests': len(samples),
+            'throughput': len(samples) / elapsed if elapsed else 0.0,
+            'errors': errors,
+            'error_rate': errors / len(samples),
+            'rejected': rejected,
+            'p50_ms': percentile(latencies, 0.50),
+            'p95_ms': percentile(latencies, 0.95),
+            'p99_ms': percentile(latencies, 0.99),
+            'max_ms': latencies[-1]
+        }
+    return summary
+
+
+def format_mb(value):
+    return f"{value / (1024 * 1024):.1f} MB" if value is not None else 'n/a'
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--url', help='Load an app that is already running instead of starting one')
+    parser.add_argument('--server-cmd', help='Command starting the app, with {port} for the port to listen on')
+    parser.add_argument('--mix', default=DEFAULT_MIX, help=f"Operation weights (default {DEFAULT_MIX})")
+    parser.add_argument('--concurrency', type=int, default=8, help='Concurrent clients')
+    parser.add_argument('--duration', type=float, default=30, help='Seconds to run')
+    parser.add_argument('--requests', type=int, help='Stop after this many requests')
+    parser.add_argument('--seed-targets', type=int, default=10, help='Targets uploaded before the run starts')
+    parser.add_argument('--images', type=int, default=16, help='Distinct synthetic images to cycle through')
+    parser.add_argument('--image-size', default='1200x900', help='Synthetic image size, WIDTHxHEIGHT')
+    parser.add_argument('--seed', type=int, default=0, help='Random seed for images and the request mix')
+    parser.add_argument('--json', help='Also write the results to this file')
+    parser.add_argument('--min-throughput', type=float, help='Fail if total requests/s falls below this')
+    parser.add_argument('--max-p95-ms', type=float, help='Fail if the total p95 latency exceeds this')
+    parser.add_argument('--max-error-rate', type=float, help='Fail if the total error rate exceeds this')
+    args = parser.parse_args()
+
+    mix = parse_mix(args.mix)
+    width, height = (int(value) for value in args.image_size.lower().split('x'))
+    images = synthetic_targets(args.images, width, height, args.seed)
+
+    server = None
+    if args.url:
+        url = args.url.rstrip('/')
+    else:
+        server = Server(args.server_cmd).start()
+        url = server.url
+    try:
+        load = LoadTest(url, mix, images, args.concurrency, args.duration, args.requests, args.seed)
+        load.seed_targets(args.seed_targets)
+        rss_before = server.rss()[0] if server else None
+        elapsed = load.run()
+        rss_after, rss_peak = server.rss() if server else (None, None)
+        if rss_peak is None:
+            rss_peak = scraped_peak_rss_bytes(url)
+    finally:
+        if server is not None:
+            server.stop()
+
+    summary = summarize(load.results, elapsed)
+    print(f"{args.concurrency} clients for {elapsed:.1f} s against {url} ({width}x{height} images)")
+    print(f"\n  {'operation':<10} {'requests':>8} {'req/s':>8} {'errors':>7} {'429':>5} "
+          f"{'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'max ms':>8}")
+    for name, row in summary.items():
+        print(f"  {name:<10} {row['requests']:>8} {row['throughput']:>8.1f} {row['errors']:>7} {row['rejected']:>5} "
+              f"{row['p50_ms']:>8.1f} {row['p95_ms']:>8.1f} {row['p99_ms']:>8.1f} {row['max_ms']:>8.1f}")
+    print(f"\nServer RSS: {format_mb(rss_before)} before, {format_mb(rss_after)} after, {format_mb(rss_peak)} peak")
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({'url': url, 'concurrency': args.concurrency, 'elapsed_seconds': elapsed, 'mix': mix,
+                       'image_size': [width, height], 'operations': summary,
+                       'server_rss_bytes': {'before': rss_before, 'after': rss_after, 'peak': rss_peak}}, f, indent=2)
+
+    failures = []
+    total = summary.get('total')
+    if total is None:
+        failures.append('No requests were sent')
+    else:
+        if args.min_throughput is not None and total['throughput'] < args.min_throughput:
+            failures.append(f"Throughput {total['throughput']:.1f} req/s (minimum {args.min_throughput})")
+        if args.max_p95_ms is not None and total['p95_ms'] > args.max_p95_ms:
+            failures.append(f"p95 latency {total['p95_ms']:.1f} ms (budget {args.max_p95_ms} ms)")
+        if args.max_error_rate is not None and total['error_rate'] > args.max_error_rate:
+            failures.append(f"Error rate {total['error_rate']:.2%} (budget {args.max_error_rate:.2%})")
+
+    for failure in failures:
+        print(f"\n✗ {failure}")
+    if failures:
+        sys.exit(1)
+    print("\n✓ Load test finished within budget")
+
+
+if __name__ == '__main__':
+    main()
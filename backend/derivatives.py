@@ -0,0 +1,37 @@
+"""
+Thumbnail derivatives of annotated images for the history view
+
+Each annotated image version gets small and medium WebP copies. They are
+named by the entry id, the annotation version and the size, so a name
+always refers to the same bytes and can be cached forever. An edit
+produces a new version and therefore new names.
+"""
+from image_encoding import encode_image
+
+# Longest side in pixels; images already smaller are not upscaled
+DERIVATIVE_SIZES = {'small': 160, 'medium': 480}
+DERIVATIVE_FORMAT = 'webp'
+DERIVATIVE_EXTENSION = '.webp'
+
+
+def derivative_name(image_id, version, size):
+    """Path of one derivative of an annotated image version, relative to the derivatives folder/prefix"""
+    return f"{image_id}/{version[:16]}_{size}{DERIVATIVE_EXTENSION}"
+
+
+def make_derivative(image, size, quality=80):
+    """Resize a BGR image to fit DERIVATIVE_SIZES[size] and encode it as WebP (an EncodedImage)"""
+    import cv2
+
+    longest = DERIVATIVE_SIZES[size]
+    height, width = image.shape[:2]
+    scale = longest / max(height, width)
+    if scale < 1:
+        image = cv2.resize(image, (max(1, round(width * scale)), max(1, round(height * scale))),
+                           interpolation=cv2.INTER_AREA)
+    return encode_image(image, DERIVATIVE_FORMAT, quality)
+
+
+def make_derivatives(image, quality=80):
+    """All derivatives of a BGR image, as {size: EncodedImage}"""
+    return {size: make_derivative(image, size, quality) for size in DERIVATIVE_SIZES}
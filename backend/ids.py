@@ -0,0 +1,52 @@
+"""
+Upload ids
+
+Ids used to be the upload second ('20250101_120000'), so two uploads in the
+same second collided. New ids keep that prefix and add milliseconds and a
+random suffix:
+
+    20250101_120000_123_4k7x2m9q0d
+
+They sort by creation time like ULIDs (within one process they are strictly
+increasing, even for several ids in the same millisecond or if the clock
+steps back), sort after the legacy id of the same second, and are safe to
+use in file and Storage object names.
+"""
+import secrets
+import threading
+import time
+from datetime import datetime
+
+# Crockford base32, lowercase (no i, l, o or u)
+ALPHABET = '0123456789abcdefghjkmnpqrstvwxyz'
+SUFFIX_LENGTH = 10
+SUFFIX_SPACE = len(ALPHABET) ** SUFFIX_LENGTH
+
+_lock = threading.Lock()
+_last_ms = 0
+_last_suffix = 0
+
+
+def _encode(value):
+    chars = []
+    for _ in range(SUFFIX_LENGTH):
+        value, digit = divmod(value, len(ALPHABET))
+        chars.append(ALPHABET[digit])
+    return ''.join(reversed(chars))
+
+
+def new_id():
+    """A unique, time-sortable upload id"""
+    global _last_ms, _last_suffix
+    with _lock:
+        now_ms = time.time_ns() // 1_000_000
+        if now_ms > _last_ms:
+            _last_ms, _last_suffix = now_ms, secrets.randbelow(SUFFIX_SPACE // 2)
+        else:
+            # Same millisecond (or the clock went back): count up from the last id
+            _last_suffix += 1
+            if _last_suffix >= SUFFIX_SPACE:
+                _last_ms, _last_suffix = _last_ms + 1, secrets.randbelow(SUFFIX_SPACE // 2)
+        ms, suffix = _last_ms, _last_suffix
+    stamp = datetime.fromtimestamp(ms // 1000).strftime('%Y%m%d_%H%M%S')
+    return f"{stamp}_{ms % 1000:03d}_{_encode(suffix)}"
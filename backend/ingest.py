@@ -0,0 +1,85 @@
+"""
+In-memory upload ingestion
+
+Werkzeug spools uploaded files over 500 KB to temporary files, so every
+upload used to be written to disk by the form parser, copied to the upload
+folder and then read back for decoding. Requests of InMemoryUploadRequest
+keep uploaded files in a memory buffer instead: the body is capped by
+max_content_length (checked against Content-Length before anything is read,
+and while reading otherwise), and each file's first bytes must carry a
+known image signature, so anything else is refused as soon as the parser
+starts writing it. The buffer's bytes are then decoded in place with
+np.frombuffer/cv2.imdecode and written to the upload folder in the background.
+"""
+import io
+
+from flask import Request, current_app
+from werkzeug.exceptions import UnsupportedMediaType
+
+# Leading bytes of the formats OpenCV decodes for us
+IMAGE_SIGNATURES = (
+    b'\xff\xd8\xff',          # JPEG
+    b'\x89PNG\r\n\x1a\n',     # PNG
+    b'BM',                    # BMP
+    b'II*\x00', b'MM\x00*',   # TIFF
+)
+ZIP_SIGNATURE = b'PK\x03\x04'
+SNIFF_LENGTH = 12
+
+
+def has_image_signature(head):
+    """Whether the first bytes of a file look like a supported image"""
+    if head[:4] == b'RIFF' and head[8:12] == b'WEBP':
+        return True
+    return head.startswith(IMAGE_SIGNATURES)
+
+
+class UploadBuffer(io.BytesIO):
+    """Memory buffer for one uploaded file that refuses non-image content as soon as it starts arriving"""
+
+    def __init__(self, allow_zip=False):
+        super().__init__()
+        self.allow_zip = allow_zip
+        self._checked = False
+
+    def write(self, data):
+        written = super().write(data)
+        if not self._checked and self.tell() >= SNIFF_LENGTH:
+            self._checked = True
+            with self.getbuffer() as view:
+                head = bytes(view[:SNIFF_LENGTH])
+            if not (has_image_signature(head) or (self.allow_zip and head.startswith(ZIP_SIGNATURE))):
+                raise UnsupportedMediaType('Uploaded file is not a supported image')
+        return written
+
+
+class InMemoryUploadRequest(Request):
+    """
+    Request that buffers uploaded files in memory
+
+    The body limit is UPLOAD_MAX_BYTES, or BATCH_MAX_BYTES for endpoints
+    listed in BATCH_ENDPOINTS (which also accept zip archives).
+    """
+
+    @property
+    def max_content_length(self):
+        config = current_app.config
+        if self.endpoint in config.get('BATCH_ENDPOINTS', ()):
+            return config.get('BATCH_MAX_BYTES')
+        return config.get('UPLOAD_MAX_BYTES')
+
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        return UploadBuffer(allow_zip=self.endpoint in current_app.config.get('BATCH_ENDPOINTS', ()))
+
+
+def buffer_bytes(file):
+    """
+    Contents of an uploaded file as bytes
+
+    For an in-memory buffer this is the buffer itself (BytesIO.getvalue()
+    hands over its bytes object without copying when nothing else holds a view).
+    """
+    if isinstance(file.stream, io.BytesIO):
+        return file.stream.getvalue()
+    file.stream.seek(0)
+    return file.stream.read()
@@ -0,0 +1,204 @@
+"""
+Durable on-disk job queue processed by a local worker pool
+
+Each job is one JSON file in the queue directory, written atomically:
+
+    {"id", "state", "payload", "result", "error", "attempts", "created_at", "updated_at"}
+
+with state one of 'queued', 'running', 'done' or 'failed'. No broker is
+involved: the files are the queue. On startup every job left 'queued' or
+'running' (the process died mid-job) is picked up again, so handlers must be
+safe to re-run. A worker holds an exclusive flock on <id>.lock while it runs
+a job, so several processes sharing the directory never run the same job
+twice, and a crashed worker's lock is released by the OS.
+"""
+import fcntl
+import json
+import os
+import queue
+import threading
+import time
+import uuid
+
+from metadata_store import write_json_atomic
+
+PENDING_STATES = ('queued', 'running')
+FINISHED_STATES = ('done', 'failed')
+
+
+class JobQueue:
+    def __init__(self, directory, handler, workers=2, max_attempts=3, retention=24 * 3600, prune_interval=3600,
+                 abandon=None):
+        """
+        Args:
+            directory: Where job files live (created if missing)
+            handler: Called as handler(payload) on a worker thread; returns a
+                JSON-serializable result, or raises to fail the job
+            workers: Size of the worker pool
+            max_attempts: Jobs interrupted this many times (e.g. by crashes) are failed
+            retention: Seconds finished jobs are kept before prune() removes them
+            prune_interval: Least seconds between the prunes workers run after finishing jobs
+            abandon: Optional callable(payload) run when a job is failed for
+                being interrupted too often, to give back what its payload holds
+        """
+        self.directory = directory
+        self.handler = handler
+        self.workers = workers
+        self.max_attempts = max_attempts
+        self.retention = retention
+        self.prune_interval = prune_interval
+        self.abandon = abandon
+        self._last_prune = time.monotonic()
+        self._prune_lock = threading.Lock()
+        self._queue = queue.Queue()
+        self._changed = threading.Condition()
+        self._threads = []
+        self._stopping = False
+        self._start_lock = threading.Lock()
+        self._started = False
+        os.makedirs(directory, exist_ok=True)
+
+    def start(self):
+        """Re-enqueue unfinished jobs, remove expired ones and start the workers (later calls do nothing)"""
+        with self._start_lock:
+            if self._started:
+                return
+            self._started = True
+            self.prune()
+            for job in self._list_jobs():
+                if job['state'] in PENDING_STATES:
+                    self._queue.put(job['id'])
+            for i in range(self.workers):
+                thread = threading.Thread(target=self._work, name=f"job-worker-{i}", daemon=True)
+                thread.start()
+                self._threads.append(thread)
+
+    def close(self):
+        """Stop the workers once they finish their current job (queued jobs stay on disk)"""
+        self._stopping = True
+        for _ in self._threads:
+            self._queue.put(None)
+        for thread in self._threads:
+            thread.join()
+        self._threads = []
+
+    def submit(self, payload):
+        """Persist a new job and queue it; returns the job record"""
+        now = time.time()
+        job = {
+            'id': uuid.uuid4().hex,
+            'state': 'queued',
+            'payload': payload,
+            'result': None,
+            'error': None,
+            'attempts': 0,
+            'created_at': now,
+            'updated_at': now,
+        }
+        self._save(job)
+        self._queue.put(job['id'])
+        return job
+
+    def get(self, job_id):
+        """Current record of a job (from disk, so jobs of other processes are visible), or None"""
+        if not job_id or not all(c in '0123456789abcdef' for c in job_id):
+            return None
+        try:
+            with open(self._path(job_id)) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+
+    def wait(self, job_id, timeout):
+        """Block until a job of this process changes state, or timeout; returns the current record"""
+        with self._changed:
+            self._changed.wait(timeout)
+        return self.get(job_id)
+
+    def pending(self):
+        """Number of jobs waiting for a worker in this process"""
+        return self._queue.qsize()
+
+    def prune(self):
+        """Delete finished jobs older than the retention period"""
+        cutoff = time.time() - self.retention
+        for job in self._list_jobs():
+            if job['state'] in FINISHED_STATES and job['updated_at'] < cutoff:
+                for path in (self._path(job['id']), self._lock_path(job['id'])):
+                    try:
+                        os.remove(path)
+                    except FileNotFoundError:
+                        pass
+
+    def _path(self, job_id):
+        return os.path.join(self.directory, f"{job_id}.json")
+
+    def _lock_path(self, job_id):
+        return os.path.join(self.directory, f"{job_id}.lock")
+
+    def _list_jobs(self):
+        jobs = []
+        for name in os.listdir(self.directory):
+            if name.endswith('.json'):
+                job = self.get(name[:-len('.json')])
+                if job is not None:
+                    jobs.append(job)
+        return jobs
+
+    def _save(self, job):
+        job['updated_at'] = time.time()
+        write_json_atomic(self._path(job['id']), job)
+        with self._changed:
+            self._changed.notify_all()
+
+    def _work(self):
+        while True:
+            job_id = self._queue.get()
+            if job_id is None or self._stopping:
+                return
+            try:
+                self._run(job_id)
+                self._prune_if_due()
+            except Exception as e:
+                print(f"Error running job {job_id}: {e}")
+
+    def _prune_if_due(self):
+        # Long-running workers would otherwise only prune on the next start()
+        if time.monotonic() - self._last_prune < self.prune_interval:
+            return
+        if not self._prune_lock.acquire(blocking=False):
+            return  # Another worker is pruning
+        try:
+            self._last_prune = time.monotonic()
+            self.prune()
+        finally:
+            self._prune_lock.release()
+
+    def _run(self, job_id):
+        fd = os.open(self._lock_path(job_id), os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                return  # Another process is running it
+            # Re-read under the lock: another process may have finished it meanwhile
+            job = self.get(job_id)
+            if job is None or job['state'] in FINISHED_STATES:
+                return
+            if job['attempts'] >= self.max_attempts:
+                job.update(state='failed', error='Job was interrupted too many times')
+                self._save(job)
+                if self.abandon is not None:
+                    self.abandon(job['payload'])
+                return
+
+            job.update(state='running', attempts=job['attempts'] + 1)
+            self._save(job)
+            try:
+                job.update(state='done', result=self.handler(job['payload']))
+            except Exception as e:
+                job.update(state='failed', error=str(e))
+            self._save(job)
+        finally:
+            fcntl.flock(fd, fcntl.LOCK_UN)
+            os.close(fd)
@@ -0,0 +1,136 @@
+"""
+Opt-in profiling of single requests
+
+A request asks for a profile with an X-Profile header or a ?profile= query
+parameter, and gets one only where the deployment enables profiling (and,
+if it sets a token, only when the value is that token). The handler then
+runs under two profilers at once:
+    cProfile, deterministic, saved as profile.prof (open with pstats or
+        snakeviz) and summarized in profile.txt
+    a sampler thread that records the handler thread's stack every few
+        milliseconds, saved as stacks.collapsed, one "frame;frame;frame
+        count" line per distinct stack (flamegraph.pl, speedscope or
+        inferno draw it as a flamegraph)
+Both only see the handler thread. Samples also land while OpenCV holds the
+thread in C code, so detection time shows up under the Python call that
+started it.
+
+params.json records what is needed to reproduce the request offline: the
+request, the entry and stored image it ran on and the detector parameters.
+The entry points save a copy of that image next to it.
+
+This module is shared by the Flask backend and the Cloud Function.
+"""
+import cProfile
+import io
+import json
+import marshal
+import os
+import pstats
+import sys
+import threading
+import time
+from collections import Counter
+
+PROFILE_HEADER = 'X-Profile'
+PROFILE_PARAM = 'profile'
+
+
+def profile_requested(request, enabled, token=None):
+    """Whether a request asked for a profile and may have one"""
+    if not enabled:
+        return False
+    value = request.headers.get(PROFILE_HEADER) or request.args.get(PROFILE_PARAM)
+    if not value:
+        return False
+    if token:
+        return value == token
+    return value.lower() in ('1', 'true', 'yes')
+
+
+def _frame_name(code):
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+class RequestProfiler:
+    """Context manager profiling the thread that enters it"""
+
+    def __init__(self, interval=0.005):
+        """
+        Args:
+            interval: Seconds between stack samples
+        """
+        self.interval = interval
+        self.samples = Counter()
+        self.elapsed = None
+        self._profile = cProfile.Profile()
+        self._stop = threading.Event()
+        self._sampler = None
+
+    def _sample(self, thread_id):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(thread_id)
+            stack = []
+            while frame is not None:
+                stack.append(_frame_name(frame.f_code))
+                frame = frame.f_back
+            if stack:
+                self.samples[';'.join(reversed(stack))] += 1
+
+    def __enter__(self):
+        self._started = time.perf_counter()
+        self._sampler = threading.Thread(target=self._sample, args=(threading.get_ident(),),
+                                         name='profile-sampler', daemon=True)
+        self._sampler.start()
+        self._profile.enable()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._profile.disable()
+        self._stop.set()
+        self._sampler.join()
+        self.elapsed = time.perf_counter() - self._started
+        return False
+
+    def collapsed(self):
+        """Stack samples in the collapsed format flamegraph tools read"""
+        return ''.join(f"{stack} {count}\n" for stack, count in sorted(self.samples.items()))
+
+    def summary(self, limit=40):
+        """The most expensive functions by cumulative time, as pstats prints them"""
+        out = io.StringIO()
+        pstats.Stats(self._profile, stream=out).sort_stats('cumulative').print_stats(limit)
+        return out.getvalue()
+
+    def files(self, params):
+        """{file name: bytes} of the profile, with params recorded alongside"""
+        self._profile.create_stats()
+        params = {**params, 'elapsed_seconds': self.elapsed, 'sample_interval_seconds': self.interval,
+                  'samples': sum(self.samples.values())}
+        return {
+            # The format pstats.Stats(path) loads, as dump_stats writes it
+            'profile.prof': marshal.dumps(self._profile.stats),
+            'profile.txt': self.summary().encode(),
+            'stacks.collapsed': self.collapsed().encode(),
+            'params.json': json.dumps(params, indent=2, default=str).encode()
+        }
+
+
+def detector_parameters(detector, calculator=None):
+    """Settings of a ShotDetector (and MOACalculator) that decide what is detected"""
+    params = {}
+    for name, value in vars(detector).items():
+        if name.startswith('blob_params_'):
+            # SimpleBlobDetector_Params exposes its settings as attributes
+            value = {key: getattr(value, key) for key in dir(value)
+                     if not key.startswith('_') and isinstance(getattr(value, key), (bool, int, float))}
+        elif not isinstance(value, (bool, int, float, str)):
+            continue
+        params[name] = value
+    result = {'detector': params}
+    if calculator is not None:
+        result['moa_calculator'] = {
+            'pixels_per_inch': calculator.pixels_per_inch,
+            'target_distance_yards': calculator.target_distance_yards
+        }
+    return result
@@ -1,6 +1,7 @@
 import cv2
 import numpy as np
 from typing import Tuple, List
+from metrics import DETECTION_STAGE_SECONDS
 
 class ShotDetector:
     def __init__(self):
@@ -53,29 +54,35 @@ class ShotDetector:
         annotated_image = image.copy()
         
         # Convert to grayscale
-        gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+        with DETECTION_STAGE_SECONDS.time('grayscale'):
+            gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
         
         # Get all candidate shots from different methods
         all_shots = []
         
         # Method 1: Blob detection (best for circular dark spots)
-        blob_shots = self._detect_shots_blob(gray)
+        with DETECTION_STAGE_SECONDS.time('blob'):
+            blob_shots = self._detect_shots_blob(gray)
         all_shots.extend(blob_shots)
         
         # Method 2: Contour-based detection with improved filtering
-        contour_shots = self._detect_shots_contour(gray)
+        with DETECTION_STAGE_SECONDS.time('contour'):
+            contour_shots = self._detect_shots_contour(gray)
         all_shots.extend(contour_shots)
         
         # Method 3: Hough Circle detection
-        hough_shots = self._detect_shots_hough(gray)
+        with DETECTION_STAGE_SECONDS.time('hough'):
+            hough_shots = self._detect_shots_hough(gray)
         all_shots.extend(hough_shots)
         
         # Method 4: Template matching for typical bullet holes
-        template_shots = self._detect_shots_template(gray)
+        with DETECTION_STAGE_SECONDS.time('template'):
+            template_shots = self._detect_shots_template(gray)
         all_shots.extend(template_shots)
         
         # Filter and validate all candidates
-        shot_positions = self._validate_and_filter_shots(gray, all_shots)
+        with DETECTION_STAGE_SECONDS.time('validate'):
+            shot_positions = self._validate_and_filter_shots(gray, all_shots)
         
         # Draw annotations
         for i, (x, y) in enumerate(shot_positions):
@@ -0,0 +1,215 @@
+"""
+Upload and delete core shared by the Flask backend and the Cloud Function
+
+The hot paths are written once, against the ImageStore and MetadataStore
+interfaces (see image_store.py and metadata_store.py). Each entry point
+builds a TargetService from its own stores (local files and SQLite, or
+Cloud Storage and Firestore) and keeps only HTTP parsing and responses.
+With MemoryImageStore and MemoryMetadataStore the same code runs
+in-process, so it can be tested and load-tested without either backend.
+
+OpenCV and NumPy are imported on first use, to keep cold starts light.
+"""
+import io
+import time
+from concurrent.futures import Future, wait
+from datetime import datetime
+
+from image_encoding import encode_image
+from image_probe import DEFAULT_MAX_PIXELS, probe_image
+from image_store import StoredImage, content_name
+from metrics import UPLOAD_BYTES, UPLOAD_MEGAPIXELS, UPLOAD_STAGE_SECONDS
+
+
+class TargetService:
+    def __init__(self, images, metadata, get_detector, get_moa_calculator, add_reference_scale, admission,
+                 annotated_format='jpeg', annotated_quality=90, max_image_pixels=DEFAULT_MAX_PIXELS,
+                 executor=None, on_annotated=None, on_original=None):
+        """
+        Args:
+            images: ImageStore for originals and annotated images
+            metadata: MetadataStore for the entries
+            get_detector: Callable returning the ShotDetector
+            get_moa_calculator: Callable returning the MOACalculator
+            add_reference_scale: Callable drawing the 1-inch scale on an annotated image
+            admission: AdmissionController detection runs under
+            annotated_format: 'jpeg' or 'webp' for annotated images
+            annotated_quality: 0-100
+            max_image_pixels: Larger images are refused from their header
+            executor: Thread pool images are stored on while detection runs
+                (stored inline without one)
+            on_annotated: Optional callable(image_id, annotated EncodedImage, BGR image)
+                returning futures the upload should wait for (e.g. thumbnails)
+            on_original: Optional callable(StoredImage, bytes, BGR image) run
+                once the original is stored (e.g. to cache it)
+        """
+        self.images = images
+        self.metadata = metadata
+        self.get_detector = get_detector
+        self.get_moa_calculator = get_moa_calculator
+        self.add_reference_scale = add_reference_scale
+        self.admission = admission
+        self.annotated_format = annotated_format
+        self.annotated_quality = annotated_quality
+        self.max_image_pixels = max_image_pixels
+        self.executor = executor
+        self.on_annotated = on_annotated
+        self.on_original = on_original
+
+    def _submit(self, function, *args):
+        if self.executor is not None:
+            return self.executor.submit(function, *args)
+        future = Future()
+        try:
+            future.set_result(function(*args))
+        except Exception as e:
+            future.set_exception(e)
+        return future
+
+    def analyze(self, image_id, original_name, data, content_type=None, admission_timeout=10.0,
+                stored_original=None):
+        """
+        Detect shots in uploaded image bytes and store the original and annotated images
+
+        The bytes are decoded in place, and the original is stored while
+        detection runs (unless it is already stored as stored_original, whose
+        reference the entry takes over). Both images are stored under their
+        content hash, so the entry holds one reference to each. If analysis
+        fails, both references are given back before the error is raised;
+        once it returns, they belong to the caller, who saves the entry or
+        discards it.
+
+        Returns:
+            (metadata_entry, annotated EncodedImage, pending futures); the
+            entry is not saved, and both its images are stored. The pending
+            futures are what on_annotated started (e.g. thumbnails)
+
+        Raises:
+            InvalidImage (a ValueError): If the header shows an unreadable,
+                unsupported or oversized image
+            AdmissionRejected: If detection capacity does not free up within
+                admission_timeout seconds (None waits)
+        """
+        original = None
+        annotated_write = None
+        pending = []
+        try:
+            # Validate and size the work from the header before anything is decoded
+            with UPLOAD_STAGE_SECONDS.time('probe'):
+                info = probe_image(io.BytesIO(data), self.max_image_pixels)
+            UPLOAD_BYTES.observe(len(data))
+            UPLOAD_MEGAPIXELS.observe(info.pixels / 1_000_000)
+
+            import cv2
+            import numpy as np
+            shot_detector = self.get_detector()
+            waiting = time.perf_counter()
+            with self.admission.admit(info.width, info.height, timeout=admission_timeout):
+                UPLOAD_STAGE_SECONDS.observe(time.perf_counter() - waiting, 'admission_wait')
+
+                # Decode straight from the upload buffer
+                with UPLOAD_STAGE_SECONDS.time('decode'):
+                    image = cv2.imdecode(np.frombuffer(data, np.uint8), cv2.IMREAD_COLOR)
+                if image is None:
+                    raise ValueError('Invalid image file')
+
+                # Store the original while detection runs
+                if stored_original is None:
+                    original = self._submit(self.images.put, data, info.extension, content_type)
+
+                # Detect shots in the image
+                with UPLOAD_STAGE_SECONDS.time('detect'):
+                    shots, annotated_image = shot_detector.detect_shots(image)
+
+                # Add 1-inch reference scale to the image
+                with UPLOAD_STAGE_SECONDS.time('scale'):
+                    annotated_image = self.add_reference_scale(annotated_image)
+
+                # Calculate MOA if shots are detected
+                moa_value = None
+                if len(shots) > 0:
+                    with UPLOAD_STAGE_SECONDS.time('moa'):
+                        moa_value = self.get_moa_calculator().calculate_moa(shots)
+
+                # Encode the annotated image once; the same bytes are stored and returned
+                with UPLOAD_STAGE_SECONDS.time('encode'):
+                    annotated = encode_image(annotated_image, self.annotated_format, self.annotated_quality)
+                annotated_write = self._submit(self.images.put, annotated.data, annotated.extension,
+                                               annotated.mime_type, annotated.digest)
+                if self.on_annotated is not None:
+                    pending.extend(self.on_annotated(image_id, annotated, annotated_image))
+
+            # The entry records the original's name and generation, so wait for that write
+            if original is not None:
+                with UPLOAD_STAGE_SECONDS.time('store_original'):
+                    stored = original.result()
+            else:
+                stored = StoredImage(stored_original, None)
+            with UPLOAD_STAGE_SECONDS.time('store_annotated'):
+                annotated_write.result()
+            if self.on_original is not None:
+                self.on_original(stored, data, image)
+        except Exception:
+            # No entry will point at the images, so give back the references taken
+            # (after the writes settle, so none lands after its release)
+            wait([future for future in (original, annotated_write) if future is not None] + pending)
+            names = [future.result().name for future in (original, annotated_write)
+                     if future is not None and future.exception() is None]
+            if stored_original is not None:
+                names.append(stored_original)
+            self.images.release_many(names)
+            raise
+
+        metadata_entry = {
+            'id': image_id,
+            'filename': stored.name,
+            'original_name': original_name,
+            'annotated_filename': content_name(annotated.digest, annotated.extension),
+            'upload_time': datetime.now().isoformat(),
+            'shot_count': len(shots),
+            'moa_value': moa_value,
+            'shots': shots.tolist() if shots is not None else [],
+            'original_generation': stored.generation,
+            'annotated_hash': annotated.digest
+        }
+        return metadata_entry, annotated, pending
+
+    def save(self, entry):
+        """Save one analyzed entry; if that fails, its image references are given back"""
+        try:
+            self.metadata.insert(entry)
+        except Exception:
+            self.discard([entry])
+            raise
+
+    def save_many(self, entries):
+        """Save the entries of a batch in one write; if that fails, their image references are given back"""
+        try:
+            self.metadata.insert_many(entries)
+        except Exception:
+            self.discard(entries)
+            raise
+
+    def discard(self, entries):
+        """
+        Give back the image references of analyzed entries that will not be saved
+
+        Images other entries share stay.
+        """
+        self.images.release_many([name for entry in entries
+                                  for name in (entry['filename'], entry['annotated_filename'])])
+
+    def delete(self, image_id):
+        """
+        Remove an entry and drop its references to its images
+
+        Images other entries share stay. Returns the removed entry, or None if
+        there was none.
+        """
+        # Only the delete that actually removed the entry releases its
+        # references, so racing deletes of one id cannot release them twice
+        entry = self.metadata.delete(image_id)
+        if entry is None:
+            return None
+        self.images.release_many([entry['filename'], entry['annotated_filename']])
+        return entry
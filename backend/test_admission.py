@@ -0,0 +1,99 @@
+import io
+import os
+import tempfile
+import threading
+
+import cv2
+import numpy as np
+
+# Point the app at a throwaway upload folder and metadata store before importing it
+_tmp = tempfile.mkdtemp()
+os.environ.setdefault('UPLOAD_FOLDER', os.path.join(_tmp, 'uploads'))
+os.environ.setdefault('METADATA_FILE', os.path.join(_tmp, 'metadata.json'))
+os.environ.setdefault('METADATA_DB', os.path.join(_tmp, 'metadata.db'))
+os.environ.setdefault('METADATA_JOURNAL', os.path.join(_tmp, 'metadata.journal'))
+
+import app as backend
+from admission import AdmissionController, AdmissionRejected
+
+
+def test_limits():
+    controller = AdmissionController(max_in_flight=2, max_memory_bytes=1000, max_waiting=1, bytes_per_pixel=1)
+
+    # The in-flight limit holds even when memory is available
+    with controller.admit(10, 10), controller.admit(10, 10):
+        try:
+            with controller.admit(10, 10, timeout=0.05):
+                assert False, 'third detection admitted'
+        except AdmissionRejected as e:
+            assert e.retry_after >= 1
+
+    # So does the memory budget, but an image over the whole budget still runs alone
+    with controller.admit(30, 30):
+        try:
+            with controller.admit(10, 20, timeout=0.05):
+                assert False, 'over budget'
+        except AdmissionRejected:
+            pass
+    with controller.admit(100, 100):
+        assert controller.in_flight == 1
+
+    # Waiting requests are admitted as capacity frees up; past max_waiting they are turned away
+    release = threading.Event()
+    admitted = []
+
+    def hold():
+        with controller.admit(30, 30):
+            release.wait()
+
+    def wait_for_turn():
+        with controller.admit(30, 30, timeout=5):
+            admitted.append(True)
+
+    holder = threading.Thread(target=hold)
+    holder.start()
+    while controller.in_flight == 0:
+        pass
+    waiter = threading.Thread(target=wait_for_turn)
+    waiter.start()
+    while controller.waiting == 0:
+        pass
+    try:
+        with controller.admit(30, 30, timeout=5):
+            assert False, 'queue overflow admitted'
+    except AdmissionRejected:
+        pass
+    release.set()
+    holder.join()
+    waiter.join()
+    assert admitted == [True]
+    assert controller.in_flight == 0 and controller.memory_bytes == 0
+    assert controller.rejected == 3
+    print("✓ Admission limits")
+
+
+def test_upload_rejected_when_busy():
+    client = backend.app.test_client()
+    image = np.full((400, 400, 3), 255, np.uint8)
+    data = {'image': (io.BytesIO(cv2.imencode('.jpg', image)[1].tobytes()), 'target.jpg')}
+
+    original = backend.targets.admission
+    backend.targets.admission = AdmissionController(max_in_flight=1, max_waiting=0)
+    try:
+        with backend.targets.admission.admit(400, 400):
+            response = client.post('/api/upload', data=data, content_type='multipart/form-data')
+    finally:
+        backend.targets.admission = original
+    assert response.status_code == 429
+    assert int(response.headers['Retry-After']) >= 1
+    assert response.get_json()['retry_after'] == int(response.headers['Retry-After'])
+
+    # A JPEG signature with no image behind it is refused before detection
+    data = {'image': (io.BytesIO(b'\xff\xd8\xff' + b'\x00' * 64), 'target.jpg')}
+    assert client.post('/api/upload', data=data, content_type='multipart/form-data').status_code == 400
+    print("✓ Busy uploads get 429 with Retry-After")
+
+
+if __name__ == "__main__":
+    test_limits()
+    test_upload_rejected_when_busy()
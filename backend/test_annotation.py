@@ -0,0 +1,117 @@
+import io
+import os
+import tempfile
+
+import cv2
+import numpy as np
+
+# Point the app at a throwaway upload folder and metadata store before importing it
+_tmp = tempfile.mkdtemp()
+os.environ.setdefault('UPLOAD_FOLDER', os.path.join(_tmp, 'uploads'))
+os.environ.setdefault('METADATA_FILE', os.path.join(_tmp, 'metadata.json'))
+os.environ.setdefault('METADATA_DB', os.path.join(_tmp, 'metadata.db'))
+os.environ.setdefault('METADATA_JOURNAL', os.path.join(_tmp, 'metadata.journal'))
+
+import app as backend
+from annotation import RenderCache, render_key
+from image_encoding import EncodedImage
+
+
+def upload_target(client):
+    image = np.full((400, 400, 3), 255, np.uint8)
+    for center in [(100, 100), (200, 150), (150, 250)]:
+        cv2.circle(image, center, 8, (0, 0, 0), -1)
+    data = {'image': (io.BytesIO(cv2.imencode('.jpg', image)[1].tobytes()), 'target.jpg')}
+    return client.post('/api/upload?response=url', data=data, content_type='multipart/form-data').get_json()
+
+
+def test_render_key_covers_inputs():
+    entry = {'filename': 'target_1.jpg', 'shots': [[1, 2]]}
+    key = render_key(entry, 100.0, 'jpeg', 90)
+    assert render_key(dict(entry), 100.0, 'jpeg', 90) == key
+    assert render_key({**entry, 'shots': [[1, 3]]}, 100.0, 'jpeg', 90) != key
+    assert render_key(entry, 50.0, 'jpeg', 90) != key
+    assert render_key(entry, 100.0, 'webp', 90) != key
+    assert render_key(entry, 100.0, 'jpeg', 80) != key
+    print("✓ Render key")
+
+
+def test_render_cache_is_bounded_lru():
+    cache = RenderCache(max_bytes=10)
+    render = lambda data: (lambda: EncodedImage(data, 'jpeg'))
+    cache.get_or_render('a', render(b'aaaa'))
+    cache.get_or_render('b', render(b'bbbb'))
+    cache.get_or_render('a', render(b'xxxx'))  # Hit: refreshes 'a'
+    cache.get_or_render('c', render(b'cccc'))  # Evicts 'b', the least recently used
+    assert cache.get_or_render('a', render(b'xxxx')).data == b'aaaa'
+    assert cache.get_or_render('b', render(b'BBBB')).data == b'BBBB'
+    assert cache.get_or_render('missing', lambda: None) is None
+    print("✓ Render cache LRU")
+
+
+def test_edits_render_on_read():
+    client = backend.app.test_client()
+    backend.render_cache = RenderCache()
+    result = upload_target(client)
+    image_id = result['id']
+    entry = backend.metadata_store.get(image_id)
+    annotated_path = os.path.join(backend.app.config['UPLOAD_FOLDER'], entry['annotated_filename'])
+    upload_mtime = os.stat(annotated_path).st_mtime_ns
+
+    # Before any edit the upload's own annotation is served
+    with open(annotated_path, 'rb') as f:
+        assert client.get(result['annotated_url']).data == f.read()
+
+    # Edits only write metadata: no file is rewritten and nothing is rendered
+    update = client.post(f"/api/update-shots/{image_id}?response=url", json={'manual_shots': [[300, 300]]}).get_json()
+    calibrate = client.post(f"/api/calibrate/{image_id}?response=url",
+                            json={'point1': [0, 0], 'point2': [0, 50], 'distance_inches': 1}).get_json()
+    assert os.stat(annotated_path).st_mtime_ns == upload_mtime
+    assert backend.render_cache.misses == 0
+    assert update['annotated_url'] != calibrate['annotated_url'] != result['annotated_url']
+
+    # The first fetch renders; later fetches and revalidation do not
+    response = client.get(calibrate['annotated_url'])
+    assert response.status_code == 200 and response.mimetype == 'image/jpeg'
+    assert 'immutable' in response.headers['Cache-Control']
+    rendered = cv2.imdecode(np.frombuffer(response.data, np.uint8), cv2.IMREAD_COLOR)
+    assert tuple(rendered[300, 300]) != (255, 255, 255)  # The manual shot is drawn
+    etag = response.headers['ETag']
+    assert client.get(calibrate['annotated_url'], headers={'If-None-Match': etag}).status_code == 304
+    assert client.get(f"/api/annotated/{image_id}").data == response.data
+    assert backend.render_cache.misses == 1 and backend.render_cache.hits == 1
+
+    # Inline responses still work and come from the same cache
+    inline = client.post(f"/api/update-shots/{image_id}", json={'manual_shots': []}).get_json()
+    assert inline['annotated_image'].startswith('data:image/jpeg;base64,')
+    assert client.get('/api/annotated/missing').status_code == 404
+    print("✓ Render-on-read annotated images")
+
+
+def test_legacy_entries_are_not_hashed():
+    """Entries from before annotated_hash are versioned from the file's size and mtime, not its bytes"""
+    client = backend.app.test_client()
+    legacy = 'annotated_target_20240101_legacy.jpg'
+    path = os.path.join(backend.app.config['UPLOAD_FOLDER'], legacy)
+    with open(path, 'wb') as f:
+        f.write(cv2.imencode('.jpg', np.full((40, 40, 3), 255, np.uint8))[1].tobytes())
+    entry = {'id': 'legacy', 'filename': 'target_20240101_legacy.jpg', 'annotated_filename': legacy}
+
+    file_digest = backend.file_digest
+    backend.file_digest = None  # Hashing the file would fail
+    try:
+        version = backend.annotation_version(entry)
+        assert backend.annotation_version(entry) == version
+        with open(path, 'ab') as f:
+            f.write(b'\0')
+        assert backend.annotation_version(entry) != version
+    finally:
+        backend.file_digest = file_digest
+    print("✓ Legacy annotation versions")
+
+
+if __name__ == "__main__":
+    test_render_key_covers_inputs()
+    test_render_cache_is_bounded_lru()
+    test_edits_render_on_read()
+    test_legacy_entries_are_not_hashed()
@@ -0,0 +1,131 @@
+import io
+import json
+import os
+import tempfile
+import threading
+import time
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+
+import cv2
+import numpy as np
+
+# Point the app at a throwaway upload folder and metadata store before importing it
+_tmp = tempfile.mkdtemp()
+os.environ.setdefault('UPLOAD_FOLDER', os.path.join(_tmp, 'uploads'))
+os.environ.setdefault('METADATA_FILE', os.path.join(_tmp, 'metadata.json'))
+os.environ.setdefault('METADATA_DB', os.path.join(_tmp, 'metadata.db'))
+os.environ.setdefault('METADATA_JOURNAL', os.path.join(_tmp, 'metadata.journal'))
+
+import app as backend
+from batch_upload import BoundedBatch, expand_batch
+
+
+def target_image(shots):
+    image = np.full((400, 400, 3), 255, np.uint8)
+    for center in [(100, 100), (200, 150), (150, 250)][:shots]:
+        cv2.circle(image, center, 8, (0, 0, 0), -1)
+    return cv2.imencode('.jpg', image)[1].tobytes()
+
+
+def zip_archive(members, compression=zipfile.ZIP_STORED):
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, 'w', compression) as archive:
+        for name, data in members.items():
+            archive.writestr(name, data)
+    return buffer.getvalue()
+
+
+def test_expand_batch():
+    archive = zip_archive({'range/a.jpg': b'a', '__MACOSX/range/._a.jpg': b'x', '.DS_Store': b'x', 'b.jpg': b'bb'})
+    items = expand_batch([('one.jpg', b'1'), ('season.zip', archive), ('bad.zip', b'not a zip')], max_item_bytes=1)
+    assert [(name, read and read(), error) for name, read, error in items] == [
+        ('one.jpg', b'1', None),
+        ('a.jpg', b'a', None),
+        ('b.jpg', None, 'Image is larger than 0 MB'),
+        ('bad.zip', None, 'Invalid zip archive'),
+    ]
+    try:
+        expand_batch([('season.zip', archive)], max_items=1)
+        assert False, 'batch over the limit accepted'
+    except ValueError:
+        pass
+
+    # The total is checked from the archive directory, before any member is inflated
+    big = zip_archive({f"{i}.jpg": bytes(1024 * 1024) for i in range(3)}, zipfile.ZIP_DEFLATED)
+    assert len(big) < 1024 * 1024
+    try:
+        expand_batch([('big.zip', big)], max_total_bytes=2 * 1024 * 1024)
+        assert False, 'batch over the total size accepted'
+    except ValueError as e:
+        assert 'at most 2 MB' in str(e)
+    print("✓ Batch expansion")
+
+
+def test_bounded_batch_window():
+    """No more than the window of items is submitted, and so read, at once"""
+    running, peak, reads = [0], [0], []
+    lock = threading.Lock()
+
+    def analyze(name, read):
+        with lock:
+            running[0] += 1
+            peak[0] = max(peak[0], running[0])
+        data = read()
+        time.sleep(0.01)
+        with lock:
+            running[0] -= 1
+        return name, data
+
+    def reader(i):
+        return lambda: reads.append(i) or bytes([i])
+
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        batch = BoundedBatch(executor, analyze, [(i, f"{i}.jpg", reader(i)) for i in range(20)], window=3)
+        results = sorted(future.result() for _, _, future in batch)
+        assert len(results) == 20 and peak[0] <= 3 and len(batch.finish()) == 20
+
+        # A batch abandoned part way finishes what is running and starts nothing else
+        reads.clear()
+        batch = BoundedBatch(executor, analyze, [(i, f"{i}.jpg", reader(i)) for i in range(20)], window=2)
+        next(iter(batch))
+        finished = batch.finish()
+        assert len(finished) == len(reads) <= 4
+    print("✓ Bounded batch window")
+
+
+def test_batch_upload_streams_results():
+    client = backend.app.test_client()
+
+    writes = []
+    insert_many = backend.metadata_store.insert_many
+    backend.metadata_store.insert_many = lambda entries: (writes.append(len(entries)), insert_many(entries))
+    try:
+        archive = zip_archive({'targets/two.jpg': target_image(2), 'targets/notes.txt': b'not an image'})
+        data = {'images': [(io.BytesIO(target_image(3)), 'three.jpg'), (io.BytesIO(archive), 'season.zip')]}
+        response = client.post('/api/upload/batch?response=url', data=data, content_type='multipart/form-data')
+        assert response.mimetype == 'application/x-ndjson'
+        lines = [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+    finally:
+        backend.metadata_store.insert_many = insert_many
+
+    results = {line['filename']: line for line in lines[:-1]}
+    assert len(results) == 3
+    assert results['three.jpg']['shot_count'] == 3 and 'annotated_url' in results['three.jpg']
+    assert results['two.jpg']['shot_count'] == 2
+    assert results['notes.txt']['error'] == 'Invalid image file'
+
+    # The metadata is saved in one write once every image is done
+    summary = lines[-1]
+    assert summary['done'] and summary['saved'] == 2 and summary['failed'] == 1
+    assert writes == [2]
+    assert {backend.metadata_store.get(image_id)['shot_count'] for image_id in summary['ids']} == {2, 3}
+
+    assert client.post('/api/upload/batch').status_code == 400
+    print("✓ Batch upload with streamed results")
+
+
+if __name__ == "__main__":
+    test_expand_batch()
+    test_bounded_batch_window()
+    test_batch_upload_streams_results()
@@ -0,0 +1,34 @@
+from bench_load import LoadTest, Server, parse_mix, percentile, summarize, synthetic_targets
+
+
+def test_percentiles():
+    values = list(range(1, 101))
+    assert percentile(values, 0.5) == 50 and percentile(values, 0.95) == 95 and percentile(values, 0.99) == 99
+    assert percentile([7], 0.99) == 7 and percentile([], 0.5) is None
+    summary = summarize({'upload': [(0.1, 200), (0.2, 429), (0.3, None)], 'history': [(0.01, 500)]}, 2.0)
+    assert summary['upload']['errors'] == 1 and summary['upload']['rejected'] == 1
+    assert summary['total']['requests'] == 4 and summary['total']['throughput'] == 2.0
+    assert summary['total']['error_rate'] == 0.5
+    print("✓ Load test statistics")
+
+
+def test_load_against_local_app():
+    """Every operation of the mix runs against a freshly started app"""
+    server = Server().start()
+    try:
+        load = LoadTest(server.url, parse_mix('upload=1,update=1,calibrate=1,history=1,delete=1'),
+                        synthetic_targets(3, 400, 300), concurrency=3, duration=60, max_requests=30)
+        load.seed_targets(3)
+        load.run()
+        assert server.rss()[0] is None or server.rss()[0] > 0
+    finally:
+        server.stop()
+    summary = summarize(load.results, 1.0)
+    assert summary['total']['requests'] == 30 and summary['total']['errors'] == 0
+    assert 'upload' in summary and set(summary) <= {'upload', 'update', 'calibrate', 'history', 'delete', 'total'}
+    print("✓ Load test against a local app")
+
+
+if __name__ == "__main__":
+    test_percentiles()
+    test_load_against_local_app()
@@ -0,0 +1,178 @@
+import hashlib
+import io
+import multiprocessing
+import os
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import cv2
+import numpy as np
+
+# Point the app at a throwaway upload folder and metadata store before importing it
+_tmp = tempfile.mkdtemp()
+os.environ.setdefault('UPLOAD_FOLDER', os.path.join(_tmp, 'uploads'))
+os.environ.setdefault('METADATA_FILE', os.path.join(_tmp, 'metadata.json'))
+os.environ.setdefault('METADATA_DB', os.path.join(_tmp, 'metadata.db'))
+os.environ.setdefault('METADATA_JOURNAL', os.path.join(_tmp, 'metadata.journal'))
+
+import app as backend
+import ids
+from metadata_store import create_metadata_store
+
+from image_store import LocalImageStore
+
+PROCESSES = 8
+UPLOADS_PER_PROCESS = 10
+
+
+def open_store(backend, tmp):
+    return create_metadata_store(
+        backend,
+        os.path.join(tmp, 'metadata.json'),
+        os.path.join(tmp, 'metadata.db'),
+        journal_path=os.path.join(tmp, 'metadata.journal'),
+        compact_interval=0.05
+    )
+
+
+def target_bytes():
+    image = np.full((200, 200, 3), 255, np.uint8)
+    cv2.circle(image, (100, 100), 8, (0, 0, 0), -1)
+    return cv2.imencode('.jpg', image)[1].tobytes()
+
+
+def manual_shot(original_name):
+    # Deterministic per target, so the parent knows which edit each one should carry
+    worker, i = int(original_name[1:3]), int(original_name[4:7])
+    return [20 + worker, 20 + i]
+
+
+def hammer(backend_kind, tmp, worker, barrier):
+    """One worker process: upload through /api/upload, then edit another worker's targets through /api/update-shots"""
+    # Each process opens its own stores on the shared files, like a gunicorn worker
+    backend.metadata_store = backend.targets.metadata = open_store(backend_kind, tmp)
+    backend.image_store = backend.targets.images = LocalImageStore(
+        os.path.join(tmp, 'uploads'), os.path.join(tmp, 'refs.db'))
+    backend.app.config['UPLOAD_FOLDER'] = os.path.join(tmp, 'uploads')
+    client = backend.app.test_client()
+    image_bytes = target_bytes()
+
+    for i in range(UPLOADS_PER_PROCESS):
+        data = {'image': (io.BytesIO(image_bytes), f"w{worker:02d}_{i:03d}.jpg")}
+        response = client.post('/api/upload?response=url', data=data, content_type='multipart/form-data')
+        assert response.status_code == 200, response.get_json()
+
+    # Edit while the other workers are editing too
+    barrier.wait(timeout=120)
+    neighbour = f"w{(worker + 1) % PROCESSES:02d}_"
+    entries = [entry for entry in backend.metadata_store.list_entries()
+               if entry.get('original_name', '').startswith(neighbour)]
+    assert len(entries) == UPLOADS_PER_PROCESS
+    for entry in entries:
+        response = client.post(f"/api/update-shots/{entry['id']}?response=url",
+                               json={'manual_shots': [manual_shot(entry['original_name'])]})
+        assert response.status_code == 200, response.get_json()
+
+    backend.metadata_store.close()
+
+
+def check_backend(backend_kind):
+    with tempfile.TemporaryDirectory() as tmp:
+        ctx = multiprocessing.get_context('fork')
+        barrier = ctx.Barrier(PROCESSES)
+        workers = [ctx.Process(target=hammer, args=(backend_kind, tmp, w, barrier)) for w in range(PROCESSES)]
+        for p in workers:
+            p.start()
+        for p in workers:
+            p.join()
+            assert p.exitcode == 0, f"{backend_kind} worker exited with {p.exitcode}"
+
+        store = open_store(backend_kind, tmp)
+        entries = store.list_entries()
+        store.close()
+
+        # No upload may be lost or stored twice
+        names = sorted(entry['original_name'] for entry in entries)
+        expected_names = sorted(f"w{w:02d}_{i:03d}.jpg" for w in range(PROCESSES) for i in range(UPLOADS_PER_PROCESS))
+        assert names == expected_names, f"{backend_kind}: lost {len(set(expected_names) - set(names))} uploads"
+        assert len({entry['id'] for entry in entries}) == len(entries)
+
+        # No edit may be lost
+        lost = [entry['original_name'] for entry in entries
+                if entry.get('manual_shots') != [manual_shot(entry['original_name'])]]
+        assert not lost, f"{backend_kind}: lost {len(lost)} manual_shots edits"
+
+        # Every upload holds a reference on the one shared original
+        images = LocalImageStore(os.path.join(tmp, 'uploads'), os.path.join(tmp, 'refs.db'))
+        assert {entry['filename'] for entry in entries} == {hashlib.sha256(target_bytes()).hexdigest() + '.jpg'}
+        assert images.refs(entries[0]['filename']) == len(expected_names)
+    print(f"✓ {backend_kind}: {PROCESSES} processes, no lost uploads or edits")
+
+
+def test_sqlite_concurrent_writers():
+    check_backend('sqlite')
+
+
+def test_journal_concurrent_writers():
+    check_backend('journal')
+
+
+def test_json_concurrent_writers():
+    check_backend('json')
+
+
+def test_ids_are_unique_and_sortable():
+    # Many threads in the same millisecond still get distinct, increasing ids
+    generated = []
+    lock = threading.Lock()
+
+    def generate():
+        batch = [ids.new_id() for _ in range(2000)]
+        assert batch == sorted(batch)
+        with lock:
+            generated.extend(batch)
+
+    threads = [threading.Thread(target=generate) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(set(generated)) == len(generated)
+
+    image_id = ids.new_id()
+    legacy_id = image_id[:len('20250101_120000')]
+    assert legacy_id < image_id < ids.new_id()
+    assert all(c.isalnum() or c == '_' for c in image_id)
+    print("✓ Unique, sortable ids")
+
+
+def test_concurrent_uploads():
+    """Uploads through /api/upload at once: none may collide or be lost, and identical photos share one file"""
+    image_bytes = target_bytes()
+    client = backend.app.test_client()
+
+    def upload(i):
+        data = {'image': (io.BytesIO(image_bytes), 'target.jpg')}
+        response = client.post('/api/upload?response=url', data=data, content_type='multipart/form-data')
+        assert response.status_code == 200, response.get_json()
+        return response.get_json()['id']
+
+    original = hashlib.sha256(image_bytes).hexdigest() + '.jpg'
+    refs_before = backend.image_store.refs(original)
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        uploaded = list(pool.map(upload, range(32)))
+    assert len(set(uploaded)) == len(uploaded)
+    stored = {entry['id']: entry for entry in backend.metadata_store.list_entries()}
+    assert set(uploaded) <= set(stored)
+    assert {stored[image_id]['filename'] for image_id in uploaded} == {original}
+    assert backend.image_store.refs(original) == refs_before + len(uploaded)
+    print(f"✓ {len(uploaded)} concurrent uploads, no collisions, one shared original")
+
+
+if __name__ == "__main__":
+    test_sqlite_concurrent_writers()
+    test_journal_concurrent_writers()
+    test_json_concurrent_writers()
+    test_ids_are_unique_and_sortable()
+    test_concurrent_uploads()
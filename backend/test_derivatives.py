@@ -0,0 +1,78 @@
+import io
+import os
+import tempfile
+
+import cv2
+import numpy as np
+
+# Point the app at a throwaway upload folder and metadata store before importing it
+_tmp = tempfile.mkdtemp()
+os.environ.setdefault('UPLOAD_FOLDER', os.path.join(_tmp, 'uploads'))
+os.environ.setdefault('METADATA_FILE', os.path.join(_tmp, 'metadata.json'))
+os.environ.setdefault('METADATA_DB', os.path.join(_tmp, 'metadata.db'))
+os.environ.setdefault('METADATA_JOURNAL', os.path.join(_tmp, 'metadata.journal'))
+
+import app as backend
+from derivatives import make_derivative
+
+
+def wait_for_background_work():
+    backend.derivative_executor.submit(lambda: None).result()
+
+
+def upload_target(client):
+    image = np.full((900, 1200, 3), 255, np.uint8)
+    for center in [(300, 300), (600, 450), (450, 600)]:
+        cv2.circle(image, center, 12, (0, 0, 0), -1)
+    data = {'image': (io.BytesIO(cv2.imencode('.jpg', image)[1].tobytes()), 'target.jpg')}
+    return client.post('/api/upload', data=data, content_type='multipart/form-data').get_json()
+
+
+def decode(data):
+    return cv2.imdecode(np.frombuffer(data, np.uint8), cv2.IMREAD_COLOR)
+
+
+def test_make_derivative_keeps_aspect_ratio():
+    image = np.zeros((900, 1200, 3), np.uint8)
+    assert decode(make_derivative(image, 'small').data).shape == (120, 160, 3)
+    assert decode(make_derivative(image, 'medium').data).shape == (360, 480, 3)
+    # Never upscaled
+    assert decode(make_derivative(np.zeros((90, 120, 3), np.uint8), 'medium').data).shape == (90, 120, 3)
+    print("✓ Thumbnail sizes")
+
+
+def test_history_thumbnails():
+    client = backend.app.test_client()
+    image_id = upload_target(client)['id']
+    wait_for_background_work()
+    folder = os.path.join(backend.DERIVATIVES_FOLDER, image_id)
+    assert len(os.listdir(folder)) == 2
+
+    entry = client.get('/api/history').get_json()[0]
+    response = client.get(entry['thumbnails']['small'])
+    assert response.status_code == 200 and response.mimetype == 'image/webp'
+    assert 'immutable' in response.headers['Cache-Control']
+    assert decode(response.data).shape == (120, 160, 3)
+    assert client.get(entry['thumbnails']['small'], headers={'If-None-Match': response.headers['ETag']}).status_code == 304
+
+    # Thumbnails are a field like any other
+    assert 'thumbnails' not in client.get('/api/history?limit=1&fields=moa_value').get_json()[0]
+    assert 'thumbnails' not in client.get('/api/history?limit=1&exclude=thumbnails').get_json()[0]
+
+    # After an edit the URLs change; a thumbnail not generated yet is made on request
+    client.post(f"/api/update-shots/{image_id}", json={'manual_shots': [[100, 100]]})
+    wait_for_background_work()
+    edited = client.get('/api/history?limit=1').get_json()[0]['thumbnails']
+    assert edited['medium'] != entry['thumbnails']['medium']
+    assert client.get(edited['medium']).status_code == 200
+    assert len(os.listdir(folder)) == 2  # The previous version's files are gone
+
+    client.delete(f"/api/delete/{image_id}")
+    assert not os.listdir(folder)
+    assert client.get(f"/api/annotated/{image_id}/small").status_code == 404
+    print("✓ History thumbnails")
+
+
+if __name__ == "__main__":
+    test_make_derivative_keeps_aspect_ratio()
+    test_history_thumbnails()
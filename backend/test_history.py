@@ -0,0 +1,76 @@
+import os
+import tempfile
+
+# Point the app at a throwaway metadata store before importing it
+_tmp = tempfile.mkdtemp()
+os.environ.setdefault('UPLOAD_FOLDER', os.path.join(_tmp, 'uploads'))
+os.environ.setdefault('METADATA_FILE', os.path.join(_tmp, 'metadata.json'))
+os.environ.setdefault('METADATA_DB', os.path.join(_tmp, 'metadata.db'))
+os.environ.setdefault('METADATA_JOURNAL', os.path.join(_tmp, 'metadata.journal'))
+
+import app as backend
+
+
+def seed_history(count):
+    for entry in backend.metadata_store.list_entries():
+        backend.metadata_store.delete(entry['id'])
+    for i in range(count):
+        backend.metadata_store.insert({
+            'id': f"20250101_1200{i:02d}",
+            'filename': f"target_{i}.jpg",
+            'annotated_filename': f"annotated_target_{i}.jpg",
+            'upload_time': f"2025-01-01T12:00:{i:02d}",
+            'shot_count': 1,
+            'moa_value': None,
+            'shots': [[i, i]]
+        })
+
+
+def test_history_pagination():
+    seed_history(5)
+    client = backend.app.test_client()
+
+    seen = []
+    url = '/api/history?limit=2&exclude=shots'
+    while url:
+        response = client.get(url)
+        assert response.status_code == 200
+        page = response.get_json()
+        assert all('shots' not in entry for entry in page)
+        seen.extend(entry['id'] for entry in page)
+        cursor = response.headers.get('X-Next-Cursor')
+        url = f"/api/history?limit=2&exclude=shots&after={cursor}" if cursor else None
+
+    assert seen == [f"20250101_1200{i:02d}" for i in reversed(range(5))]
+
+    # Unparameterised requests still return the whole list
+    assert len(client.get('/api/history').get_json()) == 5
+
+    projected = client.get('/api/history?limit=1&fields=moa_value').get_json()
+    assert projected == [{'id': '20250101_120004', 'moa_value': None}]
+
+    assert client.get('/api/history?limit=0').status_code == 400
+    assert client.get('/api/history?limit=2&after=not-a-cursor').status_code == 400
+    print("✓ History pagination and projection")
+
+
+def test_history_conditional_get():
+    seed_history(2)
+    client = backend.app.test_client()
+
+    response = client.get('/api/history?limit=10')
+    etag = response.headers['ETag']
+    assert response.headers.get('Last-Modified')
+    assert client.get('/api/history?limit=10', headers={'If-None-Match': etag}).status_code == 304
+
+    # Any write changes the ETag
+    backend.metadata_store.update('20250101_120000', {'moa_value': 1.5})
+    response = client.get('/api/history?limit=10', headers={'If-None-Match': etag})
+    assert response.status_code == 200
+    assert response.headers['ETag'] != etag
+    print("✓ History ETag / 304")
+
+
+if __name__ == "__main__":
+    test_history_pagination()
+    test_history_conditional_get()
@@ -0,0 +1,112 @@
+import base64
+import io
+import os
+import tempfile
+
+import cv2
+import numpy as np
+
+# Point the app at a throwaway upload folder and metadata store before importing it
+_tmp = tempfile.mkdtemp()
+os.environ.setdefault('UPLOAD_FOLDER', os.path.join(_tmp, 'uploads'))
+os.environ.setdefault('METADATA_FILE', os.path.join(_tmp, 'metadata.json'))
+os.environ.setdefault('METADATA_DB', os.path.join(_tmp, 'metadata.db'))
+os.environ.setdefault('METADATA_JOURNAL', os.path.join(_tmp, 'metadata.journal'))
+
+import app as backend
+from image_encoding import encode_image, format_for_filename
+
+
+def target_image():
+    image = np.full((400, 400, 3), 255, np.uint8)
+    for center in [(100, 100), (200, 150), (150, 250)]:
+        cv2.circle(image, center, 8, (0, 0, 0), -1)
+    return image
+
+
+def upload(client, image_bytes, filename, query=''):
+    data = {'image': (io.BytesIO(image_bytes), filename)}
+    return client.post(f"/api/upload{query}", data=data, content_type='multipart/form-data')
+
+
+def test_encode_formats():
+    image = target_image()
+    jpeg = encode_image(image, 'jpeg', 90)
+    webp = encode_image(image, 'webp', 90)
+    assert jpeg.data[:2] == b'\xff\xd8' and jpeg.mime_type == 'image/jpeg'
+    assert webp.data[8:12] == b'WEBP' and webp.mime_type == 'image/webp'
+    assert len(encode_image(image, 'jpeg', 40).data) < len(jpeg.data)
+    assert cv2.imdecode(np.frombuffer(webp.data, np.uint8), cv2.IMREAD_COLOR).shape == image.shape
+    assert webp.data_url().startswith('data:image/webp;base64,')
+
+    assert format_for_filename('annotated_target_1_a.PNG') == 'png'
+    print("✓ Annotated image encoding")
+
+
+def test_saved_and_returned_bytes_match():
+    client = backend.app.test_client()
+    response = upload(client, encode_image(target_image(), 'png').data, 'target.png')
+    assert response.status_code == 200, response.get_json()
+    result = response.get_json()
+
+    entry = backend.metadata_store.get(result['id'])
+    assert entry['annotated_filename'].endswith('.jpg')
+    with open(os.path.join(backend.app.config['UPLOAD_FOLDER'], entry['annotated_filename']), 'rb') as f:
+        saved = f.read()
+    prefix = 'data:image/jpeg;base64,'
+    assert result['annotated_image'].startswith(prefix)
+    assert base64.b64decode(result['annotated_image'][len(prefix):]) == saved
+    print("✓ Encoded once for storage and response")
+
+
+def test_image_caching():
+    client = backend.app.test_client()
+    result = upload(client, encode_image(target_image(), 'jpeg').data, 'target.jpg').get_json()
+    entry = backend.metadata_store.get(result['id'])
+    url = f"/api/image/{entry['annotated_filename']}?v={entry['annotated_hash'][:16]}"
+
+    # A URL pinned to the content hash is immutable, with a strong ETag over the bytes
+    response = client.get(url)
+    assert response.status_code == 200
+    etag = response.headers['ETag']
+    assert not etag.startswith('W/')
+    assert 'immutable' in response.headers['Cache-Control']
+    assert etag.strip('"') == entry['annotated_hash']
+
+    # Conditional and ranged requests
+    assert client.get(url, headers={'If-None-Match': etag}).status_code == 304
+    assert client.get(url, headers={'Range': 'bytes=0-1'}).data == b'\xff\xd8'
+
+    # Content-addressed names are their own version, so even unversioned URLs are immutable
+    plain = url.split('?')[0]
+    assert 'immutable' in client.get(plain).headers['Cache-Control']
+    assert client.get(plain, headers={'If-None-Match': etag}).status_code == 304
+
+    # Files stored before content addressing: unversioned (or outdated) URLs must revalidate
+    legacy = 'annotated_target_1_legacy.jpg'
+    with open(os.path.join(backend.UPLOAD_FOLDER, legacy), 'wb') as f:
+        f.write(encode_image(target_image(), 'jpeg').data)
+    assert client.get(f"/api/image/{legacy}").headers['Cache-Control'] == 'no-cache'
+    assert 'immutable' not in client.get(f"/api/image/{legacy}?v=0000").headers['Cache-Control']
+    assert client.get('/api/image/missing.jpg').status_code == 404
+
+    # Their hashes are remembered for a bounded number of files, least recently used out first
+    size = backend.IMAGE_DIGEST_CACHE_SIZE
+    backend.IMAGE_DIGEST_CACHE_SIZE = 2
+    try:
+        paths = []
+        for i in range(3):
+            paths.append(os.path.join(backend.UPLOAD_FOLDER, f"annotated_target_{i}_legacy.jpg"))
+            with open(paths[-1], 'wb') as f:
+                f.write(bytes([i]))
+            backend.file_digest(paths[-1])
+        assert list(backend._image_digests) == paths[1:]
+    finally:
+        backend.IMAGE_DIGEST_CACHE_SIZE = size
+    print("✓ /api/image caching")
+
+
+if __name__ == "__main__":
+    test_encode_formats()
+    test_saved_and_returned_bytes_match()
+    test_image_caching()
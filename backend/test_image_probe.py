@@ -0,0 +1,87 @@
+import io
+import os
+import tempfile
+import time
+import zlib
+
+import cv2
+import numpy as np
+from PIL import Image
+
+# Point the app at a throwaway upload folder and metadata store before importing it
+_tmp = tempfile.mkdtemp()
+os.environ.setdefault('UPLOAD_FOLDER', os.path.join(_tmp, 'uploads'))
+os.environ.setdefault('METADATA_FILE', os.path.join(_tmp, 'metadata.json'))
+os.environ.setdefault('METADATA_DB', os.path.join(_tmp, 'metadata.db'))
+os.environ.setdefault('METADATA_JOURNAL', os.path.join(_tmp, 'metadata.journal'))
+
+import app as backend
+from image_probe import ImageTooLarge, InvalidImage, UnsupportedImage, probe_image
+
+
+def png_header(width, height):
+    """A PNG whose header claims width x height (the pixel data is never read)"""
+    buffer = io.BytesIO()
+    Image.new('L', (1, 1)).save(buffer, 'PNG')
+    data = bytearray(buffer.getvalue())
+    data[16:24] = width.to_bytes(4, 'big') + height.to_bytes(4, 'big')
+    data[29:33] = zlib.crc32(bytes(data[12:29])).to_bytes(4, 'big')
+    return bytes(data)
+
+
+def test_probe_formats_and_orientation():
+    image = np.zeros((30, 50, 3), np.uint8)
+    for extension, image_format in (('.jpg', 'jpeg'), ('.png', 'png'), ('.webp', 'webp'), ('.bmp', 'bmp')):
+        source = io.BytesIO(cv2.imencode(extension, image)[1].tobytes())
+        source.seek(2)
+        info = probe_image(source)
+        assert (info.format, info.width, info.height) == (image_format, 50, 30)
+        assert source.tell() == 2
+
+    # A portrait photo stored landscape with EXIF orientation 6 decodes as 30x50
+    buffer = io.BytesIO()
+    exif = Image.Exif()
+    exif[0x0112] = 6
+    Image.new('RGB', (50, 30)).save(buffer, 'JPEG', exif=exif)
+    info = probe_image(io.BytesIO(buffer.getvalue()))
+    assert (info.orientation, info.width, info.height) == (6, 30, 50)
+    decoded = cv2.imdecode(np.frombuffer(buffer.getvalue(), np.uint8), cv2.IMREAD_COLOR)
+    assert decoded.shape[:2] == (info.height, info.width)
+
+    for data, error in ((b'not an image', InvalidImage), (b'GIF89a' + b'\x00' * 64, InvalidImage)):
+        try:
+            probe_image(io.BytesIO(data))
+            assert False, data
+        except error:
+            pass
+    gif = io.BytesIO()
+    Image.new('L', (4, 4)).save(gif, 'GIF')
+    try:
+        probe_image(io.BytesIO(gif.getvalue()))
+        assert False, 'GIF accepted'
+    except UnsupportedImage as e:
+        assert e.status_code == 415
+    print("✓ Header probe")
+
+
+def test_decompression_bomb_rejected_from_header():
+    bomb = png_header(40000, 40000)
+    started = time.perf_counter()
+    try:
+        probe_image(io.BytesIO(bomb), max_pixels=50_000_000)
+        assert False, 'bomb accepted'
+    except ImageTooLarge as e:
+        assert e.status_code == 413
+    assert time.perf_counter() - started < 0.05
+
+    client = backend.app.test_client()
+    for query in ('', '?mode=async'):
+        response = client.post(f"/api/upload{query}", data={'image': (io.BytesIO(bomb), 'bomb.png')},
+                               content_type='multipart/form-data')
+        assert response.status_code == 413, response.get_json()
+    print("✓ Decompression bombs refused before decoding")
+
+
+if __name__ == "__main__":
+    test_probe_formats_and_orientation()
+    test_decompression_bomb_rejected_from_header()
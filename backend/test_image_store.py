@@ -0,0 +1,86 @@
+import io
+import os
+import tempfile
+
+import cv2
+import numpy as np
+
+# Point the app at a throwaway upload folder and metadata store before importing it
+_tmp = tempfile.mkdtemp()
+os.environ.setdefault('UPLOAD_FOLDER', os.path.join(_tmp, 'uploads'))
+os.environ.setdefault('METADATA_FILE', os.path.join(_tmp, 'metadata.json'))
+os.environ.setdefault('METADATA_DB', os.path.join(_tmp, 'metadata.db'))
+os.environ.setdefault('METADATA_JOURNAL', os.path.join(_tmp, 'metadata.journal'))
+
+import app as backend
+from image_store import LocalImageStore, MemoryImageStore
+
+
+def check_reference_counting(store):
+    # The same bytes are stored once, whatever they were uploaded as
+    name = store.put(b'same bytes', '.jpg').name
+    assert store.put(b'same bytes', '.jpg').name == name
+    assert store.put(b'other bytes', '.jpg').name != name
+    assert store.refs(name) == 2
+
+    # The image goes with its last reference, and comes back if stored again
+    assert not store.release(name)
+    assert store.get(name) == b'same bytes'
+    assert store.release(name)
+    assert store.get(name) is None and store.refs(name) == 0
+    assert store.put(b'same bytes', '.jpg').name == name
+
+    # Batched calls
+    stored = store.put_many([(b'one', '.png', 'image/png'), (b'two', '.png', 'image/png'), (b'one', '.png', 'image/png')])
+    assert stored[0].name == stored[2].name and store.refs(stored[0].name) == 2
+    assert store.get_many([item.name for item in stored] + ['missing.png']) == {stored[0].name: b'one', stored[1].name: b'two'}
+    assert store.release_many([item.name for item in stored]) == 2
+
+
+def test_reference_counting():
+    folder = tempfile.mkdtemp()
+    local = LocalImageStore(folder, os.path.join(folder, 'refs', 'blobs.db'))
+    check_reference_counting(local)
+    check_reference_counting(MemoryImageStore())
+    assert len([f for f in os.listdir(folder) if not f.startswith('refs')]) == 2
+
+    # Files from before content addressing count as singly referenced
+    with open(os.path.join(folder, 'target_1_a.jpg'), 'wb') as f:
+        f.write(b'legacy')
+    assert local.refs('target_1_a.jpg') == 1
+    assert local.release('target_1_a.jpg')
+    assert not os.path.exists(os.path.join(folder, 'target_1_a.jpg'))
+    print("✓ Image store reference counting")
+
+
+def test_duplicate_uploads_share_files():
+    image = np.full((300, 300, 3), 255, np.uint8)
+    cv2.circle(image, (120, 140), 9, (0, 0, 0), -1)
+    cv2.circle(image, (170, 150), 9, (0, 0, 0), -1)
+    image_bytes = cv2.imencode('.jpg', image)[1].tobytes()
+    client = backend.app.test_client()
+
+    def upload(name):
+        data = {'image': (io.BytesIO(image_bytes), name)}
+        response = client.post('/api/upload?response=url', data=data, content_type='multipart/form-data')
+        assert response.status_code == 200
+        return backend.metadata_store.get(response.get_json()['id'])
+
+    first, second = upload('monday.jpg'), upload('tuesday.jpg')
+    assert first['filename'] == second['filename']
+    assert first['annotated_filename'] == second['annotated_filename']
+    assert (first['original_name'], second['original_name']) == ('monday.jpg', 'tuesday.jpg')
+
+    # Deleting one target leaves the other's images in place
+    paths = [os.path.join(backend.UPLOAD_FOLDER, first[key]) for key in ('filename', 'annotated_filename')]
+    assert client.delete(f"/api/delete/{first['id']}").status_code == 200
+    assert all(os.path.exists(path) for path in paths)
+    assert client.get(f"/api/image/{second['filename']}").status_code == 200
+    assert client.delete(f"/api/delete/{second['id']}").status_code == 200
+    assert not any(os.path.exists(path) for path in paths)
+    print("✓ Duplicate uploads share files until the last is deleted")
+
+
+if __name__ == "__main__":
+    test_reference_counting()
+    test_duplicate_uploads_share_files()
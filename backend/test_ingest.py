@@ -0,0 +1,86 @@
+import io
+import os
+import tempfile
+
+import cv2
+import numpy as np
+
+# Point the app at a throwaway upload folder and metadata store before importing it
+_tmp = tempfile.mkdtemp()
+os.environ.setdefault('UPLOAD_FOLDER', os.path.join(_tmp, 'uploads'))
+os.environ.setdefault('METADATA_FILE', os.path.join(_tmp, 'metadata.json'))
+os.environ.setdefault('METADATA_DB', os.path.join(_tmp, 'metadata.db'))
+os.environ.setdefault('METADATA_JOURNAL', os.path.join(_tmp, 'metadata.journal'))
+
+import app as backend
+from ingest import UploadBuffer, has_image_signature
+
+
+def target_bytes():
+    image = np.full((400, 400, 3), 255, np.uint8)
+    for center in [(100, 100), (200, 150), (150, 250)]:
+        cv2.circle(image, center, 8, (0, 0, 0), -1)
+    return cv2.imencode('.jpg', image)[1].tobytes()
+
+
+def post(client, data, path='/api/upload', field='image', name='target.jpg'):
+    return client.post(path, data={field: (io.BytesIO(data), name)}, content_type='multipart/form-data')
+
+
+def test_signatures():
+    image = np.zeros((8, 8, 3), np.uint8)
+    for extension in ('.jpg', '.png', '.webp', '.bmp', '.tiff'):
+        assert has_image_signature(cv2.imencode(extension, image)[1].tobytes()[:12]), extension
+    assert not has_image_signature(b'<html><body>')
+
+    buffer = UploadBuffer()
+    buffer.write(b'\xff\xd8')
+    buffer.write(b'\xff' + b'\x00' * 20)
+    try:
+        UploadBuffer().write(b'PK\x03\x04' + b'\x00' * 20)
+        assert False, 'zip accepted as an image'
+    except Exception as e:
+        assert getattr(e, 'code', None) == 415
+    UploadBuffer(allow_zip=True).write(b'PK\x03\x04' + b'\x00' * 20)
+    print("✓ Image signatures")
+
+
+def test_upload_from_memory():
+    client = backend.app.test_client()
+    data = target_bytes()
+    response = post(client, data)
+    assert response.status_code == 200, response.get_json()
+
+    # The original is written from the request buffer before the entry is saved
+    entry = backend.metadata_store.get(response.get_json()['id'])
+    with open(os.path.join(backend.UPLOAD_FOLDER, entry['filename']), 'rb') as f:
+        assert f.read() == data
+    assert not [name for name in os.listdir(backend.UPLOAD_FOLDER) if name.endswith('.tmp')]
+    print("✓ Uploads decoded from memory")
+
+
+def test_rejected_while_reading():
+    client = backend.app.test_client()
+
+    # Not an image: refused from the first bytes, nothing is stored
+    before = set(os.listdir(backend.UPLOAD_FOLDER))
+    response = post(client, b'<html><body>' + b'x' * 1024, name='target.html')
+    assert response.status_code == 415 and 'error' in response.get_json()
+    assert set(os.listdir(backend.UPLOAD_FOLDER)) == before
+
+    # Over the size cap
+    limit = backend.app.config['UPLOAD_MAX_BYTES']
+    backend.app.config['UPLOAD_MAX_BYTES'] = 1024
+    try:
+        assert post(client, target_bytes()).status_code == 413
+        # Batches have their own cap
+        assert post(client, target_bytes(), '/api/upload/batch', 'images').status_code == 200
+    finally:
+        backend.app.config['UPLOAD_MAX_BYTES'] = limit
+    print("✓ Oversized and non-image uploads refused")
+
+
+if __name__ == "__main__":
+    test_signatures()
+    test_upload_from_memory()
+    test_rejected_while_reading()
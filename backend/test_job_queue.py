@@ -0,0 +1,184 @@
+import io
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+import cv2
+import numpy as np
+
+# Point the app at a throwaway upload folder and metadata store before importing it
+_tmp = tempfile.mkdtemp()
+os.environ.setdefault('UPLOAD_FOLDER', os.path.join(_tmp, 'uploads'))
+os.environ.setdefault('METADATA_FILE', os.path.join(_tmp, 'metadata.json'))
+os.environ.setdefault('METADATA_DB', os.path.join(_tmp, 'metadata.db'))
+os.environ.setdefault('METADATA_JOURNAL', os.path.join(_tmp, 'metadata.journal'))
+
+import app as backend
+from job_queue import JobQueue
+
+
+def target_image():
+    image = np.full((400, 400, 3), 255, np.uint8)
+    for center in [(100, 100), (200, 150), (150, 250)]:
+        cv2.circle(image, center, 8, (0, 0, 0), -1)
+    return cv2.imencode('.jpg', image)[1].tobytes()
+
+
+def wait_until_finished(queue, job_id, timeout=10):
+    deadline = time.monotonic() + timeout
+    job = queue.get(job_id)
+    while job['state'] not in ('done', 'failed') and time.monotonic() < deadline:
+        job = queue.wait(job_id, timeout=0.5)
+    return job
+
+
+def test_jobs_survive_restart():
+    directory = tempfile.mkdtemp()
+
+    # A process that dies leaves one job queued and one mid-run
+    crashed = JobQueue(directory, lambda payload: None)
+    queued = crashed.submit({'n': 1})
+    interrupted = crashed.submit({'n': 2})
+    record = crashed.get(interrupted['id'])
+    record.update(state='running', attempts=1)
+    with open(os.path.join(directory, f"{interrupted['id']}.json"), 'w') as f:
+        json.dump(record, f)
+
+    # The next process picks both up from disk
+    restarted = JobQueue(directory, lambda payload: payload['n'] * 10, workers=1)
+    restarted.start()
+    try:
+        assert wait_until_finished(restarted, queued['id'])['result'] == 10
+        done = wait_until_finished(restarted, interrupted['id'])
+        assert done['state'] == 'done' and done['result'] == 20 and done['attempts'] == 2
+    finally:
+        restarted.close()
+
+    # Failures are recorded, and jobs interrupted too often are not retried forever
+    failing = JobQueue(tempfile.mkdtemp(), lambda payload: 1 / 0, workers=1, max_attempts=1)
+    failing.start()
+    try:
+        failed = wait_until_finished(failing, failing.submit({})['id'])
+        assert failed['state'] == 'failed' and 'division' in failed['error']
+    finally:
+        failing.close()
+    assert failing.get('../metadata') is None
+
+    # A job given up on hands its payload back, so whatever it holds can be released
+    directory = tempfile.mkdtemp()
+    stuck = JobQueue(directory, lambda payload: None).submit({'filename': 'upload.jpg'})
+    stuck.update(state='running', attempts=1)
+    with open(os.path.join(directory, f"{stuck['id']}.json"), 'w') as f:
+        json.dump(stuck, f)
+    abandoned = []
+    giving_up = JobQueue(directory, lambda payload: None, workers=1, max_attempts=1, abandon=abandoned.append)
+    giving_up.start()
+    try:
+        assert 'interrupted' in wait_until_finished(giving_up, stuck['id'])['error']
+    finally:
+        giving_up.close()
+    assert abandoned == [{'filename': 'upload.jpg'}]
+
+    # Workers prune finished jobs as they go, not only when they start
+    directory = tempfile.mkdtemp()
+    pruning = JobQueue(directory, lambda payload: None, workers=1, retention=0, prune_interval=0)
+    pruning.start()
+    try:
+        pruning.submit({})
+        last = pruning.submit({})
+        deadline = time.monotonic() + 10
+        while os.listdir(directory) and time.monotonic() < deadline:
+            time.sleep(0.05)
+        assert os.listdir(directory) == [] and pruning.get(last['id']) is None
+    finally:
+        pruning.close()
+    print("✓ Durable job queue")
+
+
+def test_async_upload():
+    client = backend.app.test_client()
+    data = {'image': (io.BytesIO(target_image()), 'target.jpg')}
+    response = client.post('/api/upload?mode=async', data=data, content_type='multipart/form-data')
+    assert response.status_code == 202, response.get_json()
+    accepted = response.get_json()
+    assert response.headers['Location'] == f"/api/jobs/{accepted['job_id']}"
+    assert accepted['status'] in ('queued', 'running', 'done')
+
+    # The event stream reports each state change and ends once the job finishes
+    events = client.get(f"/api/jobs/{accepted['job_id']}/events")
+    assert events.mimetype == 'text/event-stream'
+    blocks = [block for block in events.get_data(as_text=True).split('\n\n') if block.startswith('event:')]
+    assert blocks[-1].startswith('event: done')
+    final = json.loads(blocks[-1].split('data: ', 1)[1])
+
+    # Polling returns the same body a synchronous upload would
+    status = client.get(f"/api/jobs/{accepted['job_id']}?response=url").get_json()
+    assert status['status'] == 'done'
+    assert status['result']['id'] == final['result']['id']
+    assert status['result']['shot_count'] == 3 and 'annotated_url' in status['result']
+    assert backend.metadata_store.get(status['result']['id']) is not None
+
+    assert client.get('/api/jobs/0123abcd').status_code == 404
+    print("✓ Asynchronous upload jobs")
+
+
+class FailingDetector:
+    def detect_shots(self, image):
+        raise RuntimeError('detector failed')
+
+
+def test_failed_job_releases_original():
+    """A queued upload that fails gives back the reference its stored original took"""
+    client = backend.app.test_client()
+    image = np.full((300, 500, 3), 255, np.uint8)
+    cv2.circle(image, (123, 45), 9, (0, 0, 0), -1)
+    data = {'image': (io.BytesIO(cv2.imencode('.jpg', image)[1].tobytes()), 'failing.jpg')}
+
+    detector = backend.shot_detector
+    backend.shot_detector = FailingDetector()
+    try:
+        accepted = client.post('/api/upload?mode=async', data=data, content_type='multipart/form-data').get_json()
+        job = wait_until_finished(backend.job_queue, accepted['job_id'])
+    finally:
+        backend.shot_detector = detector
+    assert job['state'] == 'failed' and 'detector failed' in job['error']
+    filename = job['payload']['filename']
+    assert backend.image_store.refs(filename) == 0
+    assert not os.path.exists(os.path.join(backend.UPLOAD_FOLDER, filename))
+
+    # So does one given up on after too many interruptions, unless an attempt saved its entry
+    filename = backend.image_store.put(b'abandoned upload', '.jpg').name
+    backend.abandon_analysis_job({'image_id': 'never-saved', 'filename': filename})
+    assert backend.image_store.refs(filename) == 0
+    print("✓ Failed jobs release their original")
+
+
+def test_workers_start_with_first_request():
+    """Importing the app spawns no job workers (gunicorn --preload forks after import); the first request does"""
+    tmp = tempfile.mkdtemp()
+    env = dict(os.environ, UPLOAD_FOLDER=os.path.join(tmp, 'uploads'), JOBS_FOLDER=os.path.join(tmp, 'jobs'),
+               METADATA_FILE=os.path.join(tmp, 'metadata.json'), METADATA_DB=os.path.join(tmp, 'metadata.db'),
+               METADATA_JOURNAL=os.path.join(tmp, 'metadata.journal'), ANALYSIS_WORKERS='2')
+    script = (
+        "import threading, app\n"
+        "workers = lambda: [t for t in threading.enumerate() if t.name.startswith('job-worker')]\n"
+        "assert workers() == [], workers()\n"
+        "client = app.app.test_client()\n"
+        "client.get('/api/health')\n"
+        "client.get('/api/health')\n"
+        "assert len(workers()) == 2, workers()\n"
+    )
+    backend_dir = os.path.dirname(os.path.abspath(__file__))
+    result = subprocess.run([sys.executable, '-c', script], cwd=backend_dir, env=env, capture_output=True, text=True)
+    assert result.returncode == 0, result.stderr
+    print("✓ Job workers start lazily")
+
+
+if __name__ == "__main__":
+    test_jobs_survive_restart()
+    test_async_upload()
+    test_failed_job_releases_original()
+    test_workers_start_with_first_request()
@@ -0,0 +1,200 @@
+import json
+import os
+import tempfile
+
+from metadata_store import (
+    CachedMetadataStore, JournaledMetadataStore, JSONMetadataStore, MemoryMetadataStore, SQLiteMetadataStore,
+    import_json_metadata
+)
+
+
+def make_entry(image_id, upload_time, shots=None):
+    return {
+        'id': image_id,
+        'filename': f"target_{image_id}_test.jpg",
+        'annotated_filename': f"annotated_target_{image_id}_test.jpg",
+        'upload_time': upload_time,
+        'shot_count': len(shots or []),
+        'moa_value': None,
+        'shots': shots or []
+    }
+
+
+def check_store(store):
+    store.insert(make_entry('20250101_120000', '2025-01-01T12:00:00'))
+    store.insert(make_entry('20250102_120000', '2025-01-02T12:00:00', [[10, 20]]))
+
+    assert [entry['id'] for entry in store.list_entries()] == ['20250102_120000', '20250101_120000']
+    assert store.get('20250102_120000')['shots'] == [[10, 20]]
+    assert store.get('missing') is None
+    found = store.get_many(['20250101_120000', '20250102_120000', 'missing'])
+    assert sorted(found) == ['20250101_120000', '20250102_120000'] and found['20250102_120000']['shot_count'] == 1
+
+    updated = store.update('20250101_120000', {'shot_count': 2, 'shots': [[1, 2], [3, 4]]})
+    assert updated['shot_count'] == 2
+    assert store.get('20250101_120000')['shots'] == [[1, 2], [3, 4]]
+    assert store.update('missing', {'shot_count': 1}) is None
+
+    deleted = store.delete('20250102_120000')
+    assert deleted['id'] == '20250102_120000'
+    assert store.delete('20250102_120000') is None
+    assert [entry['id'] for entry in store.list_entries()] == ['20250101_120000']
+
+
+def test_json_store():
+    with tempfile.TemporaryDirectory() as tmp:
+        check_store(JSONMetadataStore(os.path.join(tmp, 'metadata.json')))
+    print("✓ JSON metadata store")
+
+
+def test_sqlite_store():
+    with tempfile.TemporaryDirectory() as tmp:
+        check_store(SQLiteMetadataStore(os.path.join(tmp, 'metadata.db')))
+    print("✓ SQLite metadata store")
+
+
+def test_memory_store():
+    check_store(MemoryMetadataStore())
+    print("✓ Memory metadata store")
+
+
+def test_cached_store():
+    with tempfile.TemporaryDirectory() as tmp:
+        check_store(CachedMetadataStore(SQLiteMetadataStore(os.path.join(tmp, 'metadata.db'))))
+        check_store(CachedMetadataStore(JSONMetadataStore(os.path.join(tmp, 'metadata.json'))))
+    print("✓ Cached metadata store")
+
+
+def test_cached_store_sees_other_writers():
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'metadata.db')
+        cached = CachedMetadataStore(SQLiteMetadataStore(path))
+        other = SQLiteMetadataStore(path)
+
+        cached.insert(make_entry('20250101_120000', '2025-01-01T12:00:00'))
+        assert len(cached.list_entries()) == 1
+
+        # A write from another connection (e.g. another worker) invalidates the index
+        other.insert(make_entry('20250102_120000', '2025-01-02T12:00:00'))
+        assert [entry['id'] for entry in cached.list_entries()] == ['20250102_120000', '20250101_120000']
+
+        other.update('20250101_120000', {'shot_count': 5})
+        assert cached.get('20250101_120000')['shot_count'] == 5
+    print("✓ Cached metadata store invalidation")
+
+
+def test_cached_store_catches_up_incrementally():
+    """Other writers' changes are applied to the index without re-listing every entry"""
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'metadata.db')
+        snapshot, journal = os.path.join(tmp, 'metadata.json'), os.path.join(tmp, 'metadata.journal')
+        stores = [
+            (SQLiteMetadataStore(path), SQLiteMetadataStore(path)),
+            (JournaledMetadataStore(snapshot, journal, compact_interval=0),
+             JournaledMetadataStore(snapshot, journal, compact_interval=0))
+        ]
+        for store, other in stores:
+            cached = CachedMetadataStore(store)
+            cached.insert(make_entry('20250101_120000', '2025-01-01T12:00:00'))
+            cached.insert(make_entry('20250102_120000', '2025-01-02T12:00:00'))
+            assert len(cached.list_entries()) == 2
+
+            reloads = []
+            store.list_entries = lambda: reloads.append(True)
+            other.insert(make_entry('20250103_120000', '2025-01-03T12:00:00'))
+            other.update('20250101_120000', {'upload_time': '2025-01-04T12:00:00', 'shot_count': 5})
+            other.delete('20250102_120000')
+            assert [entry['id'] for entry in cached.list_entries()] == ['20250101_120000', '20250103_120000']
+            assert cached.get('20250101_120000')['shot_count'] == 5 and cached.get('20250102_120000') is None
+
+            # Our own writes interleaved with theirs are caught up the same way
+            other.insert(make_entry('20250105_120000', '2025-01-05T12:00:00'))
+            cached.delete('20250103_120000')
+            assert [entry['id'] for entry in cached.list_entries()] == ['20250105_120000', '20250101_120000']
+            assert reloads == []
+            other.close()
+            store.close()
+
+        # A cache older than the tombstones kept reloads instead of missing a delete
+        store, other = SQLiteMetadataStore(path), SQLiteMetadataStore(path)
+        cached = CachedMetadataStore(store)
+        assert len(cached.list_entries()) == 2
+        other.MAX_TOMBSTONES = 1
+        other.delete('20250105_120000')
+        other.insert(make_entry('20250106_120000', '2025-01-06T12:00:00'))
+        other.delete('20250106_120000')
+        assert store.changes_since(cached._version) is None
+        assert [entry['id'] for entry in cached.list_entries()] == ['20250101_120000']
+    print("✓ Cached metadata store catches up incrementally")
+
+
+def test_journaled_store():
+    with tempfile.TemporaryDirectory() as tmp:
+        snapshot = os.path.join(tmp, 'metadata.json')
+        journal = os.path.join(tmp, 'metadata.journal')
+        store = JournaledMetadataStore(snapshot, journal, compact_interval=0)
+        check_store(store)
+        store.close()
+
+        # Replaying the journal on startup restores the same state
+        reopened = JournaledMetadataStore(snapshot, journal, compact_interval=0)
+        assert [entry['id'] for entry in reopened.list_entries()] == ['20250101_120000']
+        assert reopened.get('20250101_120000')['shot_count'] == 2
+
+        # Compaction folds the journal into the snapshot
+        assert reopened.compact()
+        assert os.path.getsize(journal) == 0
+        with open(snapshot) as f:
+            assert [entry['id'] for entry in json.load(f)] == ['20250101_120000']
+        reopened.close()
+    print("✓ Journaled metadata store")
+
+
+def test_journal_survives_torn_write():
+    with tempfile.TemporaryDirectory() as tmp:
+        snapshot = os.path.join(tmp, 'metadata.json')
+        journal = os.path.join(tmp, 'metadata.journal')
+        store = JournaledMetadataStore(snapshot, journal, compact_interval=0)
+        store.insert(make_entry('20250101_120000', '2025-01-01T12:00:00'))
+        store.close()
+
+        # Simulate a crash half way through appending a record
+        with open(journal, 'ab') as f:
+            f.write(b'{"op": "insert", "entry": {"id": "2025')
+
+        store = JournaledMetadataStore(snapshot, journal, compact_interval=0)
+        assert [entry['id'] for entry in store.list_entries()] == ['20250101_120000']
+        store.insert(make_entry('20250102_120000', '2025-01-02T12:00:00'))
+        store.close()
+
+        store = JournaledMetadataStore(snapshot, journal, compact_interval=0)
+        assert len(store.list_entries()) == 2
+        store.close()
+    print("✓ Journal recovery after torn write")
+
+
+def test_import_json_metadata():
+    with tempfile.TemporaryDirectory() as tmp:
+        json_path = os.path.join(tmp, 'metadata.json')
+        with open(json_path, 'w') as f:
+            json.dump([make_entry('20250101_120000', '2025-01-01T12:00:00')], f)
+
+        store = SQLiteMetadataStore(os.path.join(tmp, 'metadata.db'))
+        assert import_json_metadata(json_path, store) == 1
+        # Importing again is a no-op, even after the entry has been deleted
+        store.delete('20250101_120000')
+        assert import_json_metadata(json_path, store) == 0
+        assert store.list_entries() == []
+    print("✓ metadata.json import")
+
+
+if __name__ == "__main__":
+    test_json_store()
+    test_sqlite_store()
+    test_memory_store()
+    test_cached_store()
+    test_cached_store_sees_other_writers()
+    test_cached_store_catches_up_incrementally()
+    test_journaled_store()
+    test_journal_survives_torn_write()
+    test_import_json_metadata()
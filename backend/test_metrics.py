@@ -0,0 +1,98 @@
+import io
+import os
+import tempfile
+import threading
+
+import cv2
+import numpy as np
+
+# Point the app at a throwaway upload folder and metadata store before importing it
+_tmp = tempfile.mkdtemp()
+os.environ.setdefault('UPLOAD_FOLDER', os.path.join(_tmp, 'uploads'))
+os.environ.setdefault('METADATA_FILE', os.path.join(_tmp, 'metadata.json'))
+os.environ.setdefault('METADATA_DB', os.path.join(_tmp, 'metadata.db'))
+os.environ.setdefault('METADATA_JOURNAL', os.path.join(_tmp, 'metadata.journal'))
+
+import app as backend
+from metrics import Registry
+
+
+def test_registry_across_threads():
+    """Samples recorded on many threads, including ones that have exited, add up"""
+    registry = Registry()
+    requests = registry.counter('requests_total', 'Requests', ('route',))
+    latency = registry.histogram('latency_seconds', 'Latency', buckets=(0.1, 1))
+    registry.gauge_callback('depth', 'Depth', lambda: 3)
+    registry.gauge_callback('broken', 'Broken', lambda: 1 / 0)
+
+    def record():
+        for _ in range(100):
+            requests.inc('/a')
+            latency.observe(0.05)
+        latency.observe(0.5)
+        latency.observe(5)
+
+    threads = [threading.Thread(target=record) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    requests.inc('/b', amount=2)
+
+    text = registry.render()
+    assert 'requests_total{route="/a"} 800' in text
+    assert 'requests_total{route="/b"} 2' in text
+    assert 'latency_seconds_bucket{le="0.1"} 800' in text
+    assert 'latency_seconds_bucket{le="1.0"} 808' in text
+    assert 'latency_seconds_bucket{le="+Inf"} 816' in text
+    assert 'latency_seconds_count 816' in text
+    assert 'depth 3' in text and 'broken' not in text
+
+    # Exited threads' shards were folded in, and scraping again does not count them twice
+    assert len(registry._shards) == 1
+    assert registry.render() == text
+    print("✓ Metrics aggregate across threads")
+
+
+def test_registry_without_scrapes():
+    """Shards of exited threads are folded in as new threads record, even if nothing scrapes"""
+    registry = Registry()
+    requests = registry.counter('requests_total', 'Requests')
+    for _ in range(50):
+        thread = threading.Thread(target=requests.inc)
+        thread.start()
+        thread.join()
+    assert len(registry._shards) <= 1
+    assert 'requests_total 50' in registry.render()
+    print("✓ Metrics shards stay bounded without scrapes")
+
+
+def test_metrics_endpoint():
+    client = backend.app.test_client()
+    image = np.full((400, 400, 3), 255, np.uint8)
+    cv2.circle(image, (200, 200), 8, (0, 0, 0), -1)
+    data = cv2.imencode('.jpg', image)[1].tobytes()
+    upload = {'image': (io.BytesIO(data), 'target.jpg')}
+    assert client.post('/api/upload', data=upload, content_type='multipart/form-data').status_code == 200
+    client.get('/api/history')
+
+    response = client.get('/api/metrics')
+    assert response.status_code == 200
+    assert response.mimetype == 'text/plain'
+    text = response.get_data(as_text=True)
+    assert 'photomoa_http_requests_total{route="/api/upload",method="POST",status="200"}' in text
+    assert 'photomoa_http_request_duration_seconds_count{route="/api/history"}' in text
+    for stage in ('probe', 'admission_wait', 'decode', 'detect', 'encode', 'store_original'):
+        assert f'photomoa_upload_stage_seconds_count{{stage="{stage}"}}' in text
+    assert 'photomoa_detection_stage_seconds_count{stage="hough"}' in text
+    assert 'photomoa_upload_megapixels_count' in text
+    assert 'photomoa_detections_in_flight 0' in text
+    assert 'photomoa_render_cache_hits_total' in text and 'photomoa_jobs_pending' in text
+    assert 'photomoa_process_peak_rss_bytes' in text
+    print("✓ Metrics endpoint")
+
+
+if __name__ == "__main__":
+    test_registry_across_threads()
+    test_registry_without_scrapes()
+    test_metrics_endpoint()
@@ -0,0 +1,75 @@
+import io
+import json
+import os
+import pstats
+import tempfile
+
+import cv2
+import numpy as np
+
+# Point the app at a throwaway upload folder and metadata store before importing it
+_tmp = tempfile.mkdtemp()
+os.environ.setdefault('UPLOAD_FOLDER', os.path.join(_tmp, 'uploads'))
+os.environ.setdefault('METADATA_FILE', os.path.join(_tmp, 'metadata.json'))
+os.environ.setdefault('METADATA_DB', os.path.join(_tmp, 'metadata.db'))
+os.environ.setdefault('METADATA_JOURNAL', os.path.join(_tmp, 'metadata.journal'))
+
+import app as backend
+
+
+def upload(client, **kwargs):
+    image = np.full((600, 600, 3), 255, np.uint8)
+    for center in [(200, 200), (300, 250), (250, 350)]:
+        cv2.circle(image, center, 10, (0, 0, 0), -1)
+    data = {'image': (io.BytesIO(cv2.imencode('.jpg', image)[1].tobytes()), 'slow.jpg')}
+    return client.post('/api/upload', data=data, content_type='multipart/form-data', **kwargs)
+
+
+def test_profiled_upload():
+    client = backend.app.test_client()
+    backend.PROFILING = True
+    try:
+        response = upload(client, headers={'X-Profile': '1'})
+        assert response.status_code == 200
+        profile_id = response.headers['X-Profile-Id']
+
+        # Not asked for, no profile
+        assert 'X-Profile-Id' not in upload(client).headers
+
+        # A token limits profiling to whoever knows it
+        backend.PROFILING_TOKEN = 'secret'
+        assert 'X-Profile-Id' not in upload(client, headers={'X-Profile': '1'}).headers
+        image_id = response.get_json()['id']
+        edited = client.post(f"/api/update-shots/{image_id}?profile=secret", json={'manual_shots': [[50, 50]]})
+        assert edited.status_code == 200 and 'X-Profile-Id' in edited.headers
+    finally:
+        backend.PROFILING = False
+        backend.PROFILING_TOKEN = None
+    assert 'X-Profile-Id' not in upload(client, headers={'X-Profile': '1'}).headers
+
+    folder = os.path.join(backend.PROFILES_FOLDER, profile_id)
+    with open(os.path.join(folder, 'params.json')) as f:
+        params = json.load(f)
+    assert params['route'] == '/api/upload' and params['image_id'] == image_id
+    assert params['image']['original_name'] == 'slow.jpg'
+    assert params['detector']['min_distance_between_shots'] == 50
+    assert params['detector']['blob_params_dark']['minArea'] == 100
+    assert params['samples'] > 0
+
+    # The stored original is copied next to the profile
+    with open(os.path.join(folder, 'original.jpg'), 'rb') as f:
+        assert f.read() == backend.image_store.get(params['image']['filename'])
+
+    # Collapsed stacks run from the view down, one "stack count" line each
+    with open(os.path.join(folder, 'stacks.collapsed')) as f:
+        lines = f.read().splitlines()
+    assert lines and all(line.rsplit(' ', 1)[1].isdigit() for line in lines)
+    assert any('wrapper (app.py' in line and 'upload_target (app.py' in line for line in lines)
+
+    stats = pstats.Stats(os.path.join(folder, 'profile.prof'))
+    assert any(function == 'detect_shots' for _, _, function in stats.stats)
+    print("✓ Profiled upload")
+
+
+if __name__ == "__main__":
+    test_profiled_upload()
@@ -0,0 +1,141 @@
+import threading
+
+import cv2
+import numpy as np
+
+from admission import AdmissionController
+from annotation import draw_reference_scale
+from image_store import MemoryImageStore
+from metadata_store import MemoryMetadataStore
+from moa_calculator import MOACalculator
+from shot_detector import ShotDetector
+from targets import TargetService
+
+
+def target_image():
+    image = np.full((400, 400, 3), 255, np.uint8)
+    for center in [(100, 100), (200, 150), (150, 250)]:
+        cv2.circle(image, center, 8, (0, 0, 0), -1)
+    return cv2.imencode('.jpg', image)[1].tobytes()
+
+
+def test_service_on_memory_stores():
+    """The shared upload and delete paths, run without a backend"""
+    images, metadata = MemoryImageStore(), MemoryMetadataStore()
+    detector, calculator = ShotDetector(), MOACalculator()
+    targets = TargetService(
+        images, metadata, lambda: detector, lambda: calculator,
+        lambda image: draw_reference_scale(image, calculator.pixels_per_inch), AdmissionController()
+    )
+
+    first, annotated, pending = targets.analyze('1', 'monday.jpg', target_image(), 'image/jpeg')
+    assert first['shot_count'] == 3 and first['original_name'] == 'monday.jpg'
+    assert all(future.done() for future in pending)
+    assert images.get(first['annotated_filename']) == annotated.data
+    assert first['original_generation'] is not None
+
+    second, _, _ = targets.analyze('2', 'tuesday.jpg', target_image(), 'image/jpeg')
+    targets.save_many([first, second])
+    assert sorted(metadata.get_many(['1', '2', '3'])) == ['1', '2']
+    assert images.refs(first['filename']) == 2
+
+    # Images go with the last entry that uses them
+    assert targets.delete('1')['id'] == '1'
+    assert images.get(first['filename']) is not None
+    assert targets.delete('2') is not None and targets.delete('2') is None
+    assert images.images == {} and metadata.list_entries() == []
+
+    # A failed upload gives back the reference it took on its original
+    detector.detect_shots = lambda image: (_ for _ in ()).throw(RuntimeError('detector failed'))
+    try:
+        targets.analyze('3', 'broken.jpg', target_image())
+        assert False, 'expected the detector error'
+    except RuntimeError:
+        pass
+    assert images.images == {}
+    print("✓ Target service on in-memory stores")
+
+
+def test_failed_saves_release_references():
+    """Entries that are never saved leave no image references behind"""
+    images, metadata = MemoryImageStore(), MemoryMetadataStore()
+    detector, calculator = ShotDetector(), MOACalculator()
+    targets = TargetService(
+        images, metadata, lambda: detector, lambda: calculator,
+        lambda image: draw_reference_scale(image, calculator.pixels_per_inch), AdmissionController()
+    )
+
+    # The annotated image's write fails after the original was stored
+    put = images.put
+
+    def put_original_only(data, extension, content_type=None, digest=None):
+        if digest is not None:
+            raise OSError('disk full')
+        return put(data, extension, content_type)
+    images.put = put_original_only
+    try:
+        targets.analyze('1', 'a.jpg', target_image())
+        assert False, 'expected the write error'
+    except OSError:
+        pass
+    images.put = put
+    assert images.images == {}
+
+    # The metadata write fails after both images were stored
+    def fail(*args):
+        raise RuntimeError('metadata write failed')
+    metadata.insert = metadata.insert_many = fail
+    for save, entries in ((targets.save, 'one'), (targets.save_many, 'many')):
+        entry, _, _ = targets.analyze('2', 'b.jpg', target_image())
+        assert images.refs(entry['filename']) == 1
+        try:
+            save(entry) if entries == 'one' else save([entry])
+            assert False, 'expected the metadata error'
+        except RuntimeError:
+            pass
+        assert images.images == {}
+    print("✓ Failed saves release image references")
+
+
+def test_concurrent_deletes_release_once():
+    """Racing deletes of one entry drop its references once, not once per request"""
+    images, metadata = MemoryImageStore(), MemoryMetadataStore()
+    detector, calculator = ShotDetector(), MOACalculator()
+    targets = TargetService(
+        images, metadata, lambda: detector, lambda: calculator,
+        lambda image: draw_reference_scale(image, calculator.pixels_per_inch), AdmissionController()
+    )
+    first, _, _ = targets.analyze('1', 'a.jpg', target_image())
+    second, _, _ = targets.analyze('2', 'b.jpg', target_image())
+    targets.save_many([first, second])
+    assert images.refs(first['filename']) == 2
+
+    # Every delete reads the entry before any of them removes it
+    threads = 8
+    barrier = threading.Barrier(threads, timeout=1)
+    for name in ('get', 'delete'):
+        method = getattr(metadata, name)
+
+        def synchronized(image_id, method=method):
+            try:
+                barrier.wait()
+            except threading.BrokenBarrierError:
+                pass
+            return method(image_id)
+        setattr(metadata, name, synchronized)
+
+    results = []
+    workers = [threading.Thread(target=lambda: results.append(targets.delete('1'))) for _ in range(threads)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    assert sum(1 for result in results if result is not None) == 1
+    assert images.refs(first['filename']) == 1 and images.get(first['filename']) is not None
+    print("✓ Concurrent deletes release references once")
+
+
+if __name__ == "__main__":
+    test_service_on_memory_stores()
+    test_failed_saves_release_references()
+    test_concurrent_deletes_release_once()
@@ -6,17 +6,26 @@ import HistoryComponent from './components/HistoryComponent';
 import { AnalysisResult, HistoryEntry } from './types';
 import { config } from './config';
 
+const HISTORY_PAGE_SIZE = 20;
+
 function App() {
   const [currentResult, setCurrentResult] = useState<AnalysisResult | null>(null);
   const [history, setHistory] = useState<HistoryEntry[]>([]);
+  const [historyCursor, setHistoryCursor] = useState<string | null>(null);
   const [activeTab, setActiveTab] = useState<'upload' | 'history'>('upload');
 
-  const fetchHistory = async () => {
+  // Fetch the first history page, or the page after `after` when loading more
+  const fetchHistory = async (after?: string) => {
     try {
-      const response = await fetch(`${config.apiBaseUrl}/history`);
+      const params = new URLSearchParams({ limit: String(HISTORY_PAGE_SIZE) });
+      if (after) {
+        params.set('after', after);
+      }
+      const response = await fetch(`${config.apiBaseUrl}/history?${params}`);
       if (response.ok) {
         const data = await response.json();
-        setHistory(data);
+        setHistory(prev => (after ? [...prev, ...data] : data));
+        setHistoryCursor(response.headers.get('X-Next-Cursor'));
       }
     } catch (error) {
       console.error('Error fetching history:', error);
@@ -89,7 +98,12 @@ function App() {
           </div>
         ) : (
           <div className="px-4 py-6 sm:px-0">
-            <HistoryComponent history={history} onHistoryUpdate={fetchHistory} />
+            <HistoryComponent
+              history={history}
+              onHistoryUpdate={() => fetchHistory()}
+              hasMore={historyCursor !== null}
+              onLoadMore={() => historyCursor && fetchHistory(historyCursor)}
+            />
           </div>
         )}
       </main>
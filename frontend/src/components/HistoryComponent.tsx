@@ -5,9 +5,11 @@ import { config } from '../config';
 interface HistoryComponentProps {
   history: HistoryEntry[];
   onHistoryUpdate: () => void;
+  hasMore?: boolean;
+  onLoadMore?: () => void;
 }
 
-const HistoryComponent: React.FC<HistoryComponentProps> = ({ history, onHistoryUpdate }) => {
+const HistoryComponent: React.FC<HistoryComponentProps> = ({ history, onHistoryUpdate, hasMore, onLoadMore }) => {
   const formatDate = (dateString: string) => {
     return new Date(dateString).toLocaleDateString('en-US', {
       year: 'numeric',
@@ -55,7 +57,7 @@ const HistoryComponent: React.FC<HistoryComponentProps> = ({ history, onHistoryU
           >
             <div className="flex justify-between items-start mb-2">
               <div>
-                <h3 className="font-medium text-gray-900">{entry.filename}</h3>
+                <h3 className="font-medium text-gray-900">{entry.original_name ?? entry.filename}</h3>
                 <p className="text-sm text-gray-500">{formatDate(entry.upload_time)}</p>
               </div>
             <div className="text-right">
@@ -89,7 +91,10 @@ const HistoryComponent: React.FC<HistoryComponentProps> = ({ history, onHistoryU
             {/* Thumbnail */}
             <div className="mt-3">
               <img
-                src={`${config.apiBaseUrl}/image/${entry.annotated_filename}`}
+                src={entry.thumbnails?.medium ?? `${config.apiBaseUrl}/annotated/${entry.id}`}
+                srcSet={entry.thumbnails && `${entry.thumbnails.small} 160w, ${entry.thumbnails.medium} 480w`}
+                sizes="(max-width: 640px) 100vw, 320px"
+                loading="lazy"
                 alt="Target analysis"
                 className="w-full h-48 object-contain border border-gray-200 rounded bg-gray-50"
                 onError={(e) => {
@@ -117,6 +122,17 @@ const HistoryComponent: React.FC<HistoryComponentProps> = ({ history, onHistoryU
           </div>
         ))}
       </div>
+
+      {hasMore && onLoadMore && (
+        <div className="mt-4 text-center">
+          <button
+            className="px-4 py-2 text-sm font-medium text-blue-600 border border-blue-600 rounded hover:bg-blue-50"
+            onClick={onLoadMore}
+          >
+            Load more
+          </button>
+        </div>
+      )}
     </div>
   );
 };
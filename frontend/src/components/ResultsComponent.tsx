@@ -103,7 +103,7 @@ const ResultsComponent: React.FC<ResultsComponentProps> = ({ result, onResultUpd
       : parseFloat(calibrationDistance);
 
     try {
-      const response = await fetch(`${config.apiBaseUrl}/calibrate/${result.id}`, {
+      const response = await fetch(`${config.apiBaseUrl}/calibrate/${result.id}?response=url`, {
         method: 'POST',
         headers: {
           'Content-Type': 'application/json',
@@ -117,10 +117,11 @@ const ResultsComponent: React.FC<ResultsComponentProps> = ({ result, onResultUpd
 
       if (response.ok) {
         const updatedResult = await response.json();
-        // Update the current result with the new MOA value
+        // Update the current result with the new MOA value and re-rendered image
         const newResult = {
           ...result,
-          moa_value: updatedResult.moa_value
+          moa_value: updatedResult.moa_value,
+          annotated_url: updatedResult.annotated_url ?? result.annotated_url
         };
         if (onResultUpdate) {
           onResultUpdate(newResult);
@@ -141,7 +142,7 @@ const ResultsComponent: React.FC<ResultsComponentProps> = ({ result, onResultUpd
     if (!result || !result.id) return;
 
     try {
-      const response = await fetch(`${config.apiBaseUrl}/update-shots/${result.id}`, {
+      const response = await fetch(`${config.apiBaseUrl}/update-shots/${result.id}?response=url`, {
         method: 'POST',
         headers: {
           'Content-Type': 'application/json',
@@ -313,7 +314,7 @@ const ResultsComponent: React.FC<ResultsComponentProps> = ({ result, onResultUpd
           onMouseLeave={handleMouseUp}
         >
           <img
-            src={result.annotated_image}
+            src={result.annotated_url ?? result.annotated_image}
             ref={imageRef}
             alt="Annotated target with detected shots"
             className="w-full h-auto"
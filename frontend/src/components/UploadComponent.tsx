@@ -7,9 +7,51 @@ interface UploadComponentProps {
   onUploadComplete: (result: AnalysisResult) => void;
 }
 
+// Several photos (or a zip of them) go up in one request; results stream
+// back one NDJSON line per target as each finishes
+const uploadBatch = async (files: File[], onProgress: (analyzed: number, failed: number) => void) => {
+  const formData = new FormData();
+  files.forEach(file => formData.append('images', file));
+
+  const response = await fetch(`${config.apiBaseUrl}/upload/batch?response=url`, {
+    method: 'POST',
+    body: formData,
+  });
+  if (!response.ok || !response.body) {
+    throw new Error('Upload failed');
+  }
+
+  const reader = response.body.getReader();
+  const decoder = new TextDecoder();
+  let buffered = '';
+  let lastResult: AnalysisResult | null = null;
+  let analyzed = 0;
+  let failed = 0;
+  for (;;) {
+    const { done, value } = await reader.read();
+    if (done) break;
+    buffered += decoder.decode(value, { stream: true });
+    const lines = buffered.split('\n');
+    buffered = lines.pop() ?? '';
+    for (const line of lines.filter(Boolean)) {
+      const item = JSON.parse(line);
+      if (item.done) continue;
+      if (item.error) {
+        failed += 1;
+      } else {
+        analyzed += 1;
+        lastResult = item;
+      }
+      onProgress(analyzed, failed);
+    }
+  }
+  return { lastResult, failed };
+};
+
 const UploadComponent: React.FC<UploadComponentProps> = ({ onUploadComplete }) => {
   const [isUploading, setIsUploading] = useState(false);
   const [error, setError] = useState<string | null>(null);
+  const [batchProgress, setBatchProgress] = useState<string | null>(null);
 
   const onDrop = useCallback(async (acceptedFiles: File[]) => {
     if (acceptedFiles.length === 0) return;
@@ -17,12 +59,27 @@ const UploadComponent: React.FC<UploadComponentProps> = ({ onUploadComplete }) =
     const file = acceptedFiles[0];
     setIsUploading(true);
     setError(null);
+    setBatchProgress(null);
 
     try {
+      if (acceptedFiles.length > 1 || file.name.toLowerCase().endsWith('.zip')) {
+        const { lastResult, failed } = await uploadBatch(acceptedFiles, (analyzed, failed) => {
+          setBatchProgress(`Analyzed ${analyzed} target${analyzed === 1 ? '' : 's'}${failed ? `, ${failed} failed` : ''}`);
+        });
+        // History is refreshed once for the whole batch
+        if (lastResult) {
+          onUploadComplete(lastResult);
+        }
+        if (failed) {
+          setError(`${failed} file${failed === 1 ? '' : 's'} could not be analyzed`);
+        }
+        return;
+      }
+
       const formData = new FormData();
       formData.append('image', file);
 
-      const response = await fetch(`${config.apiBaseUrl}/upload`, {
+      const response = await fetch(`${config.apiBaseUrl}/upload?response=url`, {
         method: 'POST',
         body: formData,
       });
@@ -43,9 +100,10 @@ const UploadComponent: React.FC<UploadComponentProps> = ({ onUploadComplete }) =
   const { getRootProps, getInputProps, isDragActive } = useDropzone({
     onDrop,
     accept: {
-      'image/*': ['.jpeg', '.jpg', '.png', '.gif', '.bmp']
+      'image/*': ['.jpeg', '.jpg', '.png', '.webp', '.bmp', '.tif', '.tiff'],
+      'application/zip': ['.zip']
     },
-    multiple: false,
+    multiple: true,
   });
 
   return (
@@ -65,7 +123,7 @@ const UploadComponent: React.FC<UploadComponentProps> = ({ onUploadComplete }) =
         {isUploading ? (
           <div className="flex flex-col items-center">
             <div className="animate-spin rounded-full h-8 w-8 border-b-2 border-blue-600 mb-4"></div>
-            <p className="text-gray-600">Analyzing target...</p>
+            <p className="text-gray-600">{batchProgress ?? 'Analyzing target...'}</p>
           </div>
         ) : (
           <div className="flex flex-col items-center">
@@ -86,8 +144,8 @@ const UploadComponent: React.FC<UploadComponentProps> = ({ onUploadComplete }) =
               <p className="text-gray-600">Drop the target photo here...</p>
             ) : (
               <div>
-                <p className="text-gray-600 mb-1">Drag and drop a target photo here</p>
-                <p className="text-sm text-gray-500">or click to select a file</p>
+                <p className="text-gray-600 mb-1">Drag and drop target photos here</p>
+                <p className="text-sm text-gray-500">or click to select files (several photos or a zip archive are analyzed together)</p>
               </div>
             )}
           </div>
@@ -103,7 +161,7 @@ const UploadComponent: React.FC<UploadComponentProps> = ({ onUploadComplete }) =
       <div className="mt-6 text-sm text-gray-500">
         <h3 className="font-medium mb-2">Supported formats:</h3>
         <ul className="list-disc list-inside space-y-1">
-          <li>JPEG, JPG, PNG, GIF, BMP</li>
+          <li>JPEG, PNG, WebP, BMP, TIFF, or a ZIP of them</li>
           <li>Clear photos of shooting targets</li>
           <li>Good lighting and contrast recommended</li>
         </ul>
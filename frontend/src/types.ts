@@ -3,7 +3,8 @@ export interface AnalysisResult {
   id: string;
   shot_count: number;
   moa_value: number | null;
-  annotated_image: string; // Base64 encoded image
+  annotated_image?: string; // Base64 data URL (default response mode)
+  annotated_url?: string; // Content-addressed image URL (?response=url)
   shots: number[][]; // Array of [x, y] coordinates
   error?: string;
 }
@@ -11,11 +12,13 @@ export interface AnalysisResult {
 export interface HistoryEntry {
   id: string;
   filename: string;
+  original_name?: string; // Name the photo was uploaded as (filename is its content hash)
   annotated_filename: string;
   upload_time: string;
   shot_count: number;
   moa_value: number | null;
   shots: number[][];
+  thumbnails?: { small: string; medium: string }; // Versioned WebP thumbnail URLs
 }
 
 export interface UploadResponse {
@@ -23,7 +26,8 @@ export interface UploadResponse {
   id: string;
   shot_count: number;
   moa_value: number | null;
-  annotated_image: string;
+  annotated_image?: string;
+  annotated_url?: string;
   shots: number[][];
   error?: string;
 }
@@ -0,0 +1,106 @@
+"""
+Admission control for shot detection
+
+Detection holds several full-size copies of an image (the decoded BGR
+array, the annotated copy, grayscale, blurred, thresholded and mask
+buffers), so a burst of large uploads can exhaust memory. Before an image
+is decoded its dimensions are read from the header (see image_probe.py)
+and turned into a memory estimate. Work is admitted while both the number
+of running detections and the estimated memory stay under their limits;
+otherwise the request waits briefly for capacity and is then rejected with
+a suggested retry delay.
+"""
+import math
+import threading
+import time
+from contextlib import contextmanager
+
+# Bytes held per pixel during detection: BGR image and annotated copy (3 + 3),
+# plus grayscale, blur, threshold and mask planes (1 each)
+DEFAULT_BYTES_PER_PIXEL = 16
+
+
+class AdmissionRejected(Exception):
+    """Raised when detection capacity stays exhausted; retry_after is in seconds"""
+
+    def __init__(self, retry_after):
+        super().__init__('Server is busy processing other images, please retry')
+        self.retry_after = retry_after
+
+
+class AdmissionController:
+    def __init__(self, max_in_flight=2, max_memory_bytes=1024 * 1024 * 1024,
+                 max_waiting=16, bytes_per_pixel=DEFAULT_BYTES_PER_PIXEL):
+        """
+        Args:
+            max_in_flight: Detections allowed to run at once
+            max_memory_bytes: Budget for the estimated memory of running detections.
+                An image over the whole budget is still admitted, but only alone.
+            max_waiting: Requests allowed to wait for capacity; more are rejected at once
+            bytes_per_pixel: Memory estimate per image pixel
+        """
+        self.max_in_flight = max_in_flight
+        self.max_memory_bytes = max_memory_bytes
+        self.max_waiting = max_waiting
+        self.bytes_per_pixel = bytes_per_pixel
+        self._changed = threading.Condition()
+        self.in_flight = 0
+        self.memory_bytes = 0
+        self.peak_memory_bytes = 0
+        self.waiting = 0
+        self.admitted = 0
+        self.rejected = 0
+        # Moving average of detection time, for Retry-After
+        self._average_seconds = 1.0
+
+    def estimate(self, width, height):
+        """Estimated memory in bytes for detecting shots in a width x height image"""
+        return width * height * self.bytes_per_pixel
+
+    def _fits(self, cost):
+        if self.in_flight == 0:
+            return True
+        return self.in_flight < self.max_in_flight and self.memory_bytes + cost <= self.max_memory_bytes
+
+    def retry_after(self):
+        """Seconds a rejected client should wait before retrying"""
+        backlog = (self.in_flight + self.waiting) / max(1, self.max_in_flight)
+        return max(1, math.ceil(self._average_seconds * backlog))
+
+    @contextmanager
+    def admit(self, width, height, timeout=10.0):
+        """
+        Hold capacity for one detection while the with-block runs
+
+        Waits up to timeout seconds (None waits indefinitely) and raises
+        AdmissionRejected if capacity does not free up in time or too many
+        requests are already waiting.
+        """
+        cost = self.estimate(width, height)
+        with self._changed:
+            if not self._fits(cost):
+                if self.waiting >= self.max_waiting and timeout is not None:
+                    self.rejected += 1
+                    raise AdmissionRejected(self.retry_after())
+                self.waiting += 1
+                try:
+                    admitted = self._changed.wait_for(lambda: self._fits(cost), timeout)
+                finally:
+                    self.waiting -= 1
+                if not admitted:
+                    self.rejected += 1
+                    raise AdmissionRejected(self.retry_after())
+            self.in_flight += 1
+            self.memory_bytes += cost
+            self.peak_memory_bytes = max(self.peak_memory_bytes, self.memory_bytes)
+            self.admitted += 1
+
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            with self._changed:
+                self.in_flight -= 1
+                self.memory_bytes -= cost
+                self._average_seconds += 0.2 * (time.monotonic() - started - self._average_seconds)
+                self._changed.notify_all()
@@ -0,0 +1,134 @@
+"""
+Expanding batch uploads into individual images
+
+A batch is any number of image files and/or zip archives of images. Each
+image becomes one item; anything that cannot be processed is still
+reported as an item with an error, so results line up with what was sent.
+
+Archive members are not extracted up front: each item carries a reader, and
+BoundedBatch submits only a few items at a time, so a batch never holds more
+than its window of decompressed images in memory. Sizes are checked from the
+archive's directory before anything is read (zipfile never inflates a member
+past the size its header declares).
+"""
+import io
+import os
+import zipfile
+from concurrent.futures import FIRST_COMPLETED, wait
+
+# Archive members that are never targets (macOS resource forks, hidden files)
+IGNORED_PREFIXES = ('__MACOSX/', '.')
+
+
+def is_zip(filename, data):
+    """Whether an uploaded file is a zip archive (by name or signature)"""
+    return filename.lower().endswith('.zip') or data[:4] == b'PK\x03\x04'
+
+
+def expand_batch(files, max_items=200, max_item_bytes=50 * 1024 * 1024, max_total_bytes=1024 * 1024 * 1024):
+    """
+    List the images in a batch upload
+
+    Args:
+        files: (filename, bytes) for each uploaded file
+        max_items: Largest number of images accepted in one batch
+        max_item_bytes: Largest image accepted (checked before extracting archive members)
+        max_total_bytes: Largest total size of the images, uncompressed
+
+    Returns:
+        List of (filename, read or None, error or None), where read() returns
+        the image bytes (extracting an archive member when called)
+
+    Raises:
+        ValueError: If the batch holds more than max_items images, or more
+            than max_total_bytes of them
+    """
+    items = []
+    total = 0
+
+    def add(filename, size, read):
+        nonlocal total
+        if len(items) >= max_items:
+            raise ValueError(f"A batch can contain at most {max_items} images")
+        if size > max_item_bytes:
+            items.append((filename, None, f"Image is larger than {max_item_bytes // (1024 * 1024)} MB"))
+            return
+        total += size
+        if total > max_total_bytes:
+            raise ValueError(f"A batch can contain at most {max_total_bytes // (1024 * 1024)} MB of images")
+        items.append((filename, read, None))
+
+    for filename, data in files:
+        if not is_zip(filename, data):
+            add(filename, len(data), lambda data=data: data)
+            continue
+        try:
+            archive = zipfile.ZipFile(io.BytesIO(data))
+        except zipfile.BadZipFile:
+            items.append((filename, None, 'Invalid zip archive'))
+            continue
+        # Left open for the readers; ZipFile reads of one archive are thread safe
+        for info in archive.infolist():
+            name = os.path.basename(info.filename)
+            if info.is_dir() or not name or info.filename.startswith(IGNORED_PREFIXES) or name.startswith('.'):
+                continue
+            add(name, info.file_size, lambda archive=archive, info=info: _extract(archive, info))
+    return items
+
+
+def _extract(archive, info):
+    try:
+        return archive.read(info)
+    except (zipfile.BadZipFile, OSError, RuntimeError) as e:
+        raise ValueError(f"Could not extract: {e}")
+
+
+class BoundedBatch:
+    """
+    Runs function(filename, read) over the items of a batch, at most `window` at a time
+
+    Iterating yields (index, filename, future) as items finish, submitting
+    the next item each time one does. finish() stops submitting, waits for
+    the items already running and returns every finished future, so a batch
+    whose client went away does no further work.
+    """
+
+    def __init__(self, executor, function, items, window):
+        """
+        Args:
+            executor: Pool the items run on
+            function: Called as function(filename, read) for each item
+            items: (index, filename, read) for the items to run
+            window: Most items submitted at once
+        """
+        self.executor = executor
+        self.function = function
+        self.window = max(1, window)
+        self.finished = []
+        self._items = iter(items)
+        self._pending = {}
+
+    def _fill(self):
+        while len(self._pending) < self.window:
+            item = next(self._items, None)
+            if item is None:
+                return
+            index, filename, read = item
+            self._pending[self.executor.submit(self.function, filename, read)] = (index, filename)
+
+    def __iter__(self):
+        self._fill()
+        while self._pending:
+            done, _ = wait(self._pending, return_when=FIRST_COMPLETED)
+            results = [(*self._pending.pop(future), future) for future in done]
+            self.finished.extend(future for _, _, future in results)
+            # Keep the window full while the results are sent
+            self._fill()
+            yield from results
+
+    def finish(self):
+        self._items = iter(())
+        wait(self._pending)
+        self.finished.extend(self._pending)
+        self._pending = {}
+        return self.finished
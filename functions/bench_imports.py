@@ -0,0 +1,144 @@
+#!/usr/bin/env python3
+"""
+Import-time benchmark for the Cloud Function entry point
+
+Each scenario runs in a fresh interpreter, so it measures what a cold
+instance pays before it can answer that route. `python -X importtime`
+gives the per-module breakdown for `import main`.
+
+Usage:
+    python bench_imports.py                     # report
+    python bench_imports.py --max-import-ms 300 # fail if `import main` got slower
+"""
+import argparse
+import os
+import subprocess
+import sys
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+# Answers /history for an edited, uncalibrated entry (whose thumbnail URLs are
+# versioned by its render key) from in-memory Firestore, after importing the
+# real client libraries so their cost is counted
+HISTORY_SETUP = """
+import firebase_admin; from firebase_admin import firestore, storage
+from flask import Flask
+from memory_firestore import MemoryFirestoreClient
+main.db, main.bucket = MemoryFirestoreClient(), object()
+main.db.collection('targets').document('1').set({
+    'filename': 'a.jpg', 'annotated_filename': 'b.jpg', 'upload_time': '2025-01-01T12:00:00',
+    'shots': [[10, 20, 5]], 'rendered_annotations': True
+})
+with Flask('bench').test_request_context('/history?limit=20'):
+    from flask import request
+    assert main.handle_history(request, {})[1] == 200
+"""
+
+# Code run after `import main` to reach the point where each route can do its work
+SCENARIOS = {
+    'health': "pass",
+    'history': HISTORY_SETUP,
+    'update/calibrate': "main.load_image_libraries(); main.get_moa_calculator()",
+    'upload': "main.get_shot_detector(); main.get_moa_calculator()",
+}
+
+# Modules that must not be loaded by `import main` alone
+# (firebase_admin itself is unavoidable: firebase_functions.https_fn imports it)
+HEAVY_MODULES = ['cv2', 'numpy', 'scipy', 'PIL', 'google.cloud.firestore', 'google.cloud.storage',
+                 'shot_detector', 'moa_calculator']
+
+# Modules that must not be loaded by answering /history either
+IMAGE_MODULES = ['cv2', 'numpy', 'scipy', 'PIL', 'shot_detector', 'moa_calculator']
+
+
+def run_python(code, *flags):
+    return subprocess.run(
+        [sys.executable, *flags, '-c', code],
+        cwd=HERE, capture_output=True, text=True, check=True
+    )
+
+
+def time_scenario(setup, repeats):
+    """Best-of-N wall time in ms for a fresh interpreter to import main and run setup"""
+    code = (
+        "import time; start = time.perf_counter()\n"
+        "import main\n"
+        f"{setup}\n"
+        "print((time.perf_counter() - start) * 1000)"
+    )
+    return min(float(run_python(code).stdout.strip()) for _ in range(repeats))
+
+
+def import_breakdown():
+    """Cumulative import cost in us of each module imported directly by main, from -X importtime"""
+    stderr = run_python("import main", '-X', 'importtime').stderr
+    children = {}
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        _, cumulative_us, name = line[len('import time:'):].split('|')
+        # Nesting is two extra spaces per level, and children are listed before
+        # their parent, so collect level-1 lines until the level-0 `main` line
+        level = (len(name) - len(name.lstrip()) - 1) // 2
+        if level == 1:
+            children[name.strip()] = int(cumulative_us)
+        elif level == 0:
+            if name.strip() == 'main':
+                return children
+            children = {}
+    return children
+
+
+def loaded_modules(setup, modules):
+    """Which of modules a fresh interpreter has loaded after importing main and running setup"""
+    code = f"import sys, main\n{setup}\nprint(','.join(m for m in {modules!r} if m in sys.modules))"
+    output = run_python(code).stdout.strip()
+    # The list is the last line (setup may print too); empty when nothing was loaded
+    return [m for m in output.splitlines()[-1].split(',') if m] if output else []
+
+
+def loaded_heavy_modules():
+    return loaded_modules('', HEAVY_MODULES)
+
+
+def history_image_modules():
+    return loaded_modules(HISTORY_SETUP, IMAGE_MODULES)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--repeats', type=int, default=3, help='Fresh interpreters per scenario (best is reported)')
+    parser.add_argument('--top', type=int, default=15, help='Number of modules to list')
+    parser.add_argument('--max-import-ms', type=float, help='Fail if `import main` takes longer than this')
+    args = parser.parse_args()
+
+    print("Cold start per route (fresh interpreter, best of %d)" % args.repeats)
+    results = {}
+    for route, setup in SCENARIOS.items():
+        results[route] = time_scenario(setup, args.repeats)
+        print(f"  {route:<18} {results[route]:8.1f} ms")
+
+    print("\nModules imported by main, by cumulative import time")
+    modules = import_breakdown()
+    for name, cumulative in sorted(modules.items(), key=lambda item: item[1], reverse=True)[:args.top]:
+        print(f"  {name:<40} {cumulative / 1000:8.1f} ms")
+
+    failures = []
+    heavy = loaded_heavy_modules()
+    if heavy:
+        failures.append(f"`import main` eagerly loads: {', '.join(heavy)}")
+    history = history_image_modules()
+    if history:
+        failures.append(f"/history loads: {', '.join(history)}")
+    if args.max_import_ms is not None and results['health'] > args.max_import_ms:
+        failures.append(f"`import main` took {results['health']:.1f} ms (budget {args.max_import_ms} ms)")
+
+    for failure in failures:
+        print(f"\n✗ {failure}")
+    if failures:
+        sys.exit(1)
+    print("\n✓ No heavy modules loaded at import time or by /history")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,173 @@
+"""
+Per-instance cache of original target images for repeated edits
+
+update-shots and calibrate both start from the original upload. A user
+usually edits the same target several times in a row, and a warm Cloud
+Functions instance serves those requests, so this keeps two things per
+image: the downloaded bytes and the decoded BGR array. Entries are keyed by
+filename and checked against the Storage object generation, so a replaced
+object is never served stale.
+
+Two tiers, both LRU and bounded by bytes:
+    memory - bytes plus the decoded array
+    disk   - bytes only, under /tmp (memory-backed on Cloud Functions, so keep it small)
+"""
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+
+
+class CachedImage:
+    """Original image bytes with a lazily decoded, read-only array"""
+
+    def __init__(self, filename, generation, data, image=None):
+        self.filename = filename
+        self.generation = generation
+        self.data = data
+        self._image = None
+        if image is not None:
+            # Already decoded by the caller (e.g. on upload); keep a read-only view
+            self._image = image.view()
+            self._image.flags.writeable = False
+
+    @property
+    def image(self):
+        """Decoded BGR array (None if the bytes are not a valid image)"""
+        if self._image is None:
+            import cv2
+            import numpy as np
+            image = cv2.imdecode(np.frombuffer(self.data, np.uint8), cv2.IMREAD_COLOR)
+            if image is not None:
+                image.flags.writeable = False
+            self._image = image
+        return self._image
+
+    @property
+    def size(self):
+        size = len(self.data)
+        if self._image is not None:
+            size += self._image.nbytes
+        return size
+
+
+class ImageCache:
+    def __init__(self, max_memory_bytes=128 * 1024 * 1024, disk_dir='/tmp/photomoa-image-cache',
+                 max_disk_bytes=256 * 1024 * 1024):
+        self.max_memory_bytes = max_memory_bytes
+        self.disk_dir = disk_dir
+        self.max_disk_bytes = max_disk_bytes
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        if max_disk_bytes > 0:
+            os.makedirs(disk_dir, exist_ok=True)
+
+    def get(self, blob, expected_generation=None, decode=True):
+        """
+        Return the CachedImage for a Storage blob, downloading only when needed
+
+        Args:
+            blob: google.cloud.storage Blob for the original image
+            expected_generation: Generation recorded in metadata at upload time.
+                When it matches the cached copy no request is made at all;
+                otherwise the download is conditional on the generation changing.
+            decode: Decode the image before caching so its size is accounted for
+
+        Returns:
+            CachedImage, or None if the object does not exist
+        """
+        from google.api_core.exceptions import NotFound, NotModified
+
+        with self._lock:
+            entry = self._entries.get(blob.name)
+
+        if entry is None:
+            entry = self._read_disk(blob.name, expected_generation)
+
+        try:
+            if entry is not None and expected_generation is not None and entry.generation == expected_generation:
+                data = None
+            elif entry is not None and expected_generation is None:
+                # Generation unknown: a conditional download returns 304 with no body if unchanged
+                data = blob.download_as_bytes(if_generation_not_match=entry.generation)
+            else:
+                data = blob.download_as_bytes()
+        except NotModified:
+            data = None
+        except NotFound:
+            return None
+
+        if data is None:
+            self.hits += 1
+        else:
+            self.misses += 1
+            entry = CachedImage(blob.name, blob.generation, data)
+            self._write_disk(entry)
+
+        if decode:
+            entry.image
+        self._remember(entry)
+        return entry
+
+    def put(self, entry):
+        """Add an entry to both tiers (used on upload so the first edit is already warm)"""
+        self._remember(entry)
+        self._write_disk(entry)
+
+    def _remember(self, entry):
+        with self._lock:
+            self._entries[entry.filename] = entry
+            self._entries.move_to_end(entry.filename)
+            total = sum(cached.size for cached in self._entries.values())
+            while total > self.max_memory_bytes and len(self._entries) > 1:
+                _, evicted = self._entries.popitem(last=False)
+                total -= evicted.size
+
+    # Disk tier
+
+    def _disk_path(self, filename, generation):
+        key = hashlib.sha256(filename.encode('utf-8')).hexdigest()[:32]
+        return os.path.join(self.disk_dir, f"{key}_{generation}")
+
+    def _read_disk(self, filename, generation):
+        if self.max_disk_bytes <= 0 or generation is None:
+            return None
+        path = self._disk_path(filename, generation)
+        try:
+            with open(path, 'rb') as f:
+                data = f.read()
+        except FileNotFoundError:
+            return None
+        os.utime(path)  # Mark as recently used
+        return CachedImage(filename, generation, data)
+
+    def _write_disk(self, entry):
+        if self.max_disk_bytes <= 0 or entry.generation is None or len(entry.data) > self.max_disk_bytes:
+            return
+        path = self._disk_path(entry.filename, entry.generation)
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(entry.data)
+        os.replace(tmp_path, path)
+        self._trim_disk()
+
+    def _trim_disk(self):
+        files = []
+        for name in os.listdir(self.disk_dir):
+            path = os.path.join(self.disk_dir, name)
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                continue
+            files.append((stat.st_mtime, stat.st_size, path))
+        total = sum(size for _, size, _ in files)
+        for _, size, path in sorted(files):
+            if total <= self.max_disk_bytes:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
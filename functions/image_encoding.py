@@ -0,0 +1,71 @@
+"""
+Encode-once stage for annotated images
+
+The annotated image is encoded a single time per request. The resulting
+bytes are written to storage and also returned to the frontend as a data
+URL, so the two never disagree and the encoder runs once.
+
+Formats:
+    jpeg - default, quality 0-100
+    webp - smaller files at the same quality, supported by all current browsers
+    png  - lossless; only used to re-encode annotated files saved as PNG
+"""
+import base64
+import hashlib
+import os
+
+FORMATS = {
+    'jpeg': {'extensions': ('.jpg', '.jpeg'), 'mime_type': 'image/jpeg', 'quality_flag': 'IMWRITE_JPEG_QUALITY'},
+    'webp': {'extensions': ('.webp',), 'mime_type': 'image/webp', 'quality_flag': 'IMWRITE_WEBP_QUALITY'},
+    'png': {'extensions': ('.png',), 'mime_type': 'image/png', 'quality_flag': None},
+}
+
+
+class EncodedImage:
+    """Encoded image bytes plus the MIME type they were encoded as"""
+
+    def __init__(self, data, image_format):
+        self.data = data
+        self.format = image_format
+        self.mime_type = FORMATS[image_format]['mime_type']
+        self.digest = hashlib.sha256(data).hexdigest()
+
+    @property
+    def extension(self):
+        return FORMATS[self.format]['extensions'][0]
+
+    def data_url(self):
+        return f"data:{self.mime_type};base64,{base64.b64encode(self.data).decode('ascii')}"
+
+
+def encode_image(image, image_format='jpeg', quality=90):
+    """
+    Encode a BGR image once
+
+    Args:
+        image: BGR array
+        image_format: 'jpeg', 'webp' or 'png'
+        quality: 0-100 for jpeg and webp (ignored for png)
+
+    Returns:
+        EncodedImage
+    """
+    import cv2
+
+    if image_format not in FORMATS:
+        raise ValueError(f"Unsupported image format: {image_format}")
+    spec = FORMATS[image_format]
+    params = [getattr(cv2, spec['quality_flag']), int(quality)] if spec['quality_flag'] is not None else []
+    ok, buffer = cv2.imencode(spec['extensions'][0], image, params)
+    if not ok:
+        raise ValueError(f"Could not encode image as {image_format}")
+    return EncodedImage(buffer.tobytes(), image_format)
+
+
+def format_for_filename(filename, default='jpeg'):
+    """Format implied by a filename's extension (so re-encoded files keep their type)"""
+    extension = os.path.splitext(filename)[1].lower()
+    for image_format, spec in FORMATS.items():
+        if extension in spec['extensions']:
+            return image_format
+    return default
@@ -0,0 +1,104 @@
+"""
+Header-only image validation
+
+Uploads are checked before anything is decoded: Pillow parses just the
+header (the first few KB, up to the JPEG frame header) to get the format,
+dimensions and EXIF orientation. Unsupported formats and images over the
+pixel limit are rejected there, so a bad upload or a decompression bomb
+costs microseconds instead of a full decode, and the dimensions feed the
+memory estimate used by admission control.
+"""
+
+# Pillow format names of what OpenCV decodes for us, and our names for them
+SUPPORTED_FORMATS = {'JPEG': 'jpeg', 'PNG': 'png', 'WEBP': 'webp', 'BMP': 'bmp', 'TIFF': 'tiff'}
+# File extension stored originals get for each of our format names
+EXTENSIONS = {'jpeg': '.jpg', 'png': '.png', 'webp': '.webp', 'bmp': '.bmp', 'tiff': '.tiff'}
+
+# cv2.imdecode applies the EXIF orientation of JPEGs; these rotate by 90 degrees
+ORIENTED_FORMATS = ('JPEG',)
+TRANSPOSED_ORIENTATIONS = (5, 6, 7, 8)
+EXIF_ORIENTATION = 0x0112
+
+DEFAULT_MAX_PIXELS = 50_000_000
+
+
+class InvalidImage(ValueError):
+    """Upload rejected before decoding; status_code is the HTTP status to answer with"""
+    status_code = 400
+
+
+class UnsupportedImage(InvalidImage):
+    status_code = 415
+
+
+class ImageTooLarge(InvalidImage):
+    status_code = 413
+
+
+class ImageInfo:
+    """Facts read from an image header"""
+
+    def __init__(self, image_format, width, height, orientation=1):
+        self.format = image_format
+        self.orientation = orientation
+        # Dimensions as decoded, i.e. after the EXIF orientation is applied
+        if orientation in TRANSPOSED_ORIENTATIONS:
+            width, height = height, width
+        self.width = width
+        self.height = height
+
+    @property
+    def pixels(self):
+        return self.width * self.height
+
+    @property
+    def extension(self):
+        return EXTENSIONS[self.format]
+
+
+def probe_image(source, max_pixels=DEFAULT_MAX_PIXELS):
+    """
+    Validate an image from its header without decoding the pixels
+
+    Args:
+        source: Path or binary file-like object (its position is restored)
+        max_pixels: Largest accepted width x height
+
+    Returns:
+        ImageInfo
+
+    Raises:
+        InvalidImage: If the header is not a readable image
+        UnsupportedImage: If it is an image OpenCV does not decode
+        ImageTooLarge: If it has more than max_pixels pixels
+    """
+    from PIL import Image, UnidentifiedImageError
+
+    position = source.tell() if hasattr(source, 'tell') else None
+    try:
+        with Image.open(source) as image:
+            image_format = image.format
+            width, height = image.size
+            orientation = 1
+            if image_format in ORIENTED_FORMATS:
+                # Read from the APP1 segment already parsed with the header
+                # (for some formats getexif() would decode the whole image)
+                try:
+                    orientation = int(image.getexif().get(EXIF_ORIENTATION, 1))
+                except Exception:
+                    pass
+    except Image.DecompressionBombError:
+        raise ImageTooLarge(f"Image is larger than {max_pixels // 1_000_000} megapixels")
+    except (UnidentifiedImageError, OSError, ValueError, SyntaxError):
+        raise InvalidImage('Invalid image file')
+    finally:
+        if position is not None:
+            source.seek(position)
+
+    if image_format not in SUPPORTED_FORMATS:
+        raise UnsupportedImage(f"Unsupported image format: {image_format}")
+    if width <= 0 or height <= 0:
+        raise InvalidImage('Invalid image file')
+    if width * height > max_pixels:
+        raise ImageTooLarge(f"Image is larger than {max_pixels // 1_000_000} megapixels ({width}x{height})")
+    return ImageInfo(SUPPORTED_FORMATS[image_format], width, height, orientation)
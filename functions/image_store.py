@@ -0,0 +1,336 @@
+"""
+Content-addressed, reference-counted image stores
+
+Originals and annotated images are stored under the SHA-256 of their bytes
+(<digest><extension>), so uploading the same photo again, or producing the
+same annotation, reuses the stored image instead of writing it again. Each
+metadata entry holds one reference per image it points at, and an image is
+deleted when its last reference is released. Images stored before content
+addressing (target_<id>_<name>) have no count and are treated as singly
+referenced.
+
+Every store has the same interface, so the upload path (see targets.py) runs
+unchanged against:
+    LocalImageStore: files in a folder, reference counts in SQLite
+    StorageImageStore: Cloud Storage objects, counts in object metadata
+    MemoryImageStore: a dict, for tests and local load tests
+
+This module is shared by the Flask backend and the Cloud Function; Google
+client libraries are imported on first use, to keep cold starts light.
+"""
+import hashlib
+import os
+import re
+import threading
+from collections import namedtuple
+
+CONTENT_NAME = re.compile(r'^([0-9a-f]{64})\.[a-z]+$')
+
+# Result of storing an image; generation identifies the stored bytes where the store has one
+StoredImage = namedtuple('StoredImage', ['name', 'generation'])
+
+
+def content_name(digest, extension):
+    """Name of an image with the given SHA-256 hex digest"""
+    return f"{digest}{extension}"
+
+
+def content_digest(name):
+    """SHA-256 hex digest a content-addressed name stands for, or None for other names"""
+    match = CONTENT_NAME.match(name)
+    return match.group(1) if match else None
+
+
+class ImageStore:
+    """Interface of the image stores"""
+
+    def put(self, data, extension, content_type=None, digest=None):
+        """Store bytes (or add a reference to the identical image already stored); returns a StoredImage"""
+        raise NotImplementedError
+
+    def put_many(self, items):
+        """Store several (data, extension, content_type) items; returns their StoredImages in order"""
+        return [self.put(data, extension, content_type) for data, extension, content_type in items]
+
+    def get(self, name):
+        """Bytes of a stored image, or None if it does not exist"""
+        raise NotImplementedError
+
+    def get_many(self, names):
+        """{name: bytes} for the stored images among names"""
+        found = {}
+        for name in names:
+            data = self.get(name)
+            if data is not None:
+                found[name] = data
+        return found
+
+    def release(self, name):
+        """Drop one reference to an image, deleting it with the last one; returns True if deleted"""
+        raise NotImplementedError
+
+    def release_many(self, names):
+        """Release several references; returns how many images were deleted"""
+        return sum(1 for name in names if self.release(name))
+
+    def refs(self, name):
+        """Current reference count of an image (0 if it does not exist)"""
+        raise NotImplementedError
+
+
+class LocalImageStore(ImageStore):
+    """
+    Image files kept flat in a folder, with reference counts in a SQLite table
+
+    Flat files mean /api/image/<filename> and every reader that opens
+    os.path.join(folder, filename) work unchanged.
+    """
+
+    def __init__(self, folder, db_path, fsync=False):
+        """
+        Args:
+            folder: Directory the files are stored in
+            db_path: SQLite database holding the reference counts
+            fsync: Flush newly written files to disk before returning
+        """
+        self.folder = folder
+        self.db_path = db_path
+        self.fsync = fsync
+        self._local = threading.local()
+        os.makedirs(folder, exist_ok=True)
+        os.makedirs(os.path.dirname(db_path) or '.', exist_ok=True)
+        self._connect().execute('CREATE TABLE IF NOT EXISTS blobs (name TEXT PRIMARY KEY, refs INTEGER NOT NULL)')
+
+    def _connect(self):
+        # One connection per thread; transactions are managed explicitly
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            import sqlite3
+            conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            self._local.conn = conn
+        return conn
+
+    def _write_missing(self, name, data, fsync):
+        path = os.path.join(self.folder, name)
+        if os.path.exists(path):
+            return
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+            if fsync:
+                f.flush()
+                os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+
+    def put(self, data, extension, content_type=None, digest=None, fsync=None):
+        name = content_name(digest or hashlib.sha256(data).hexdigest(), extension)
+        # Taking the reference first means a concurrent release can never
+        # delete the file between the existence check and our caller using it
+        self._connect().execute(
+            'INSERT INTO blobs (name, refs) VALUES (?, 1) ON CONFLICT(name) DO UPDATE SET refs = refs + 1',
+            (name,)
+        )
+        self._write_missing(name, data, self.fsync if fsync is None else fsync)
+        return StoredImage(name, None)
+
+    def put_many(self, items):
+        names = [content_name(hashlib.sha256(data).hexdigest(), extension) for data, extension, _ in items]
+        # All the references in one transaction
+        conn = self._connect()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            conn.executemany(
+                'INSERT INTO blobs (name, refs) VALUES (?, 1) ON CONFLICT(name) DO UPDATE SET refs = refs + 1',
+                [(name,) for name in names]
+            )
+            conn.execute('COMMIT')
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+        for name, (data, _, _) in zip(names, items):
+            self._write_missing(name, data, self.fsync)
+        return [StoredImage(name, None) for name in names]
+
+    def get(self, name):
+        try:
+            with open(os.path.join(self.folder, name), 'rb') as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def release(self, name):
+        conn = self._connect()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            row = conn.execute('SELECT refs FROM blobs WHERE name = ?', (name,)).fetchone()
+            if row is not None and row[0] > 1:
+                conn.execute('UPDATE blobs SET refs = refs - 1 WHERE name = ?', (name,))
+                conn.execute('COMMIT')
+                return False
+            conn.execute('DELETE FROM blobs WHERE name = ?', (name,))
+            # Unlink inside the transaction: a put() of the same bytes waits
+            # for it and then writes the file again
+            try:
+                os.remove(os.path.join(self.folder, name))
+                deleted = True
+            except FileNotFoundError:
+                deleted = False
+            conn.execute('COMMIT')
+            return deleted
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+
+    def refs(self, name):
+        row = self._connect().execute('SELECT refs FROM blobs WHERE name = ?', (name,)).fetchone()
+        if row is not None:
+            return row[0]
+        return 1 if os.path.exists(os.path.join(self.folder, name)) else 0
+
+
+class MemoryImageStore(ImageStore):
+    """Images in a dict; generations count up like Cloud Storage's"""
+
+    def __init__(self):
+        self.images = {}  # name -> [data, refs, generation]
+        self._lock = threading.Lock()
+        self._generation = 0
+
+    def put(self, data, extension, content_type=None, digest=None):
+        name = content_name(digest or hashlib.sha256(data).hexdigest(), extension)
+        with self._lock:
+            stored = self.images.get(name)
+            if stored is None:
+                self._generation += 1
+                stored = self.images[name] = [data, 0, self._generation]
+            stored[1] += 1
+            return StoredImage(name, stored[2])
+
+    def get(self, name):
+        with self._lock:
+            stored = self.images.get(name)
+        return stored[0] if stored is not None else None
+
+    def release(self, name):
+        with self._lock:
+            stored = self.images.get(name)
+            if stored is None:
+                return False
+            stored[1] -= 1
+            if stored[1] > 0:
+                return False
+            del self.images[name]
+            return True
+
+    def refs(self, name):
+        with self._lock:
+            stored = self.images.get(name)
+        return stored[1] if stored is not None else 0
+
+
+class StorageImageStore(ImageStore):
+    """
+    Cloud Storage objects below a prefix, with the reference count in each object's 'refs' metadata
+
+    Creating an object is conditional on it not existing
+    (if_generation_match=0) and every count change is conditional on the
+    metageneration that was read, so concurrent uploads and deletes of the
+    same bytes retry instead of losing an update. Objects are uploaded with
+    the publicRead ACL.
+    """
+    REFS_KEY = 'refs'
+    MAX_ATTEMPTS = 10
+
+    def __init__(self, get_bucket, prefix='uploads/', executor=None, retry=None):
+        """
+        Args:
+            get_bucket: Callable returning the bucket (so clients can be created lazily)
+            prefix: Object name prefix the images are stored under
+            executor: Thread pool for the batched methods (sequential without one)
+            retry: Retry policy for uploads
+        """
+        self.get_bucket = get_bucket
+        self.prefix = prefix
+        self.executor = executor
+        self.retry = retry
+
+    def _map(self, function, items):
+        if self.executor is None or len(items) < 2:
+            return [function(item) for item in items]
+        return list(self.executor.map(function, items))
+
+    def _refs(self, blob):
+        return int((blob.metadata or {}).get(self.REFS_KEY, 1))
+
+    def put(self, data, extension, content_type=None, digest=None):
+        from google.api_core.exceptions import NotFound, PreconditionFailed
+
+        name = content_name(digest or hashlib.sha256(data).hexdigest(), extension)
+        blob = self.get_bucket().blob(self.prefix + name)
+        for _ in range(self.MAX_ATTEMPTS):
+            blob.metadata = {self.REFS_KEY: '1'}
+            try:
+                # The publicRead ACL is applied by the upload request itself
+                blob.upload_from_string(data, content_type=content_type, predefined_acl='publicRead',
+                                        if_generation_match=0, retry=self.retry)
+                return StoredImage(name, blob.generation)
+            except PreconditionFailed:
+                pass
+            # Already stored: count one more reference, unless it changed since we read it
+            try:
+                blob.reload()
+                blob.metadata = {self.REFS_KEY: str(self._refs(blob) + 1)}
+                blob.patch(if_metageneration_match=blob.metageneration)
+                return StoredImage(name, blob.generation)
+            except (NotFound, PreconditionFailed):
+                # Deleted or updated meanwhile; start over
+                continue
+        raise RuntimeError(f"Could not store {name}: too much contention")
+
+    def put_many(self, items):
+        return self._map(lambda item: self.put(*item), items)
+
+    def get(self, name):
+        from google.api_core.exceptions import NotFound
+        try:
+            return self.get_bucket().blob(self.prefix + name).download_as_bytes()
+        except NotFound:
+            return None
+
+    def get_many(self, names):
+        names = list(names)
+        return {name: data for name, data in zip(names, self._map(self.get, names)) if data is not None}
+
+    def release(self, name):
+        from google.api_core.exceptions import NotFound, PreconditionFailed
+
+        blob = self.get_bucket().blob(self.prefix + name)
+        for _ in range(self.MAX_ATTEMPTS):
+            try:
+                blob.reload()
+                refs = self._refs(blob)
+                if refs <= 1:
+                    blob.delete(if_metageneration_match=blob.metageneration)
+                    return True
+                blob.metadata = {self.REFS_KEY: str(refs - 1)}
+                blob.patch(if_metageneration_match=blob.metageneration)
+                return False
+            except NotFound:
+                return False
+            except PreconditionFailed:
+                # Another upload or delete got there first; read the new count
+                continue
+        raise RuntimeError(f"Could not release {name}: too much contention")
+
+    def release_many(self, names):
+        return sum(1 for deleted in self._map(self.release, list(names)) if deleted)
+
+    def refs(self, name):
+        from google.api_core.exceptions import NotFound
+        blob = self.get_bucket().blob(self.prefix + name)
+        try:
+            blob.reload()
+        except NotFound:
+            return 0
+        return self._refs(blob)
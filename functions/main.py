@@ -1,28 +1,148 @@
 from firebase_functions import https_fn
-from flask import Flask, request, jsonify
-from flask_cors import CORS
-import firebase_admin
-from firebase_admin import credentials, storage, firestore
+from flask import Flask, Response, request, jsonify, stream_with_context
 import os
 import json
-import cv2
-import numpy as np
-from PIL import Image
-import base64
-from datetime import datetime
-from shot_detector import ShotDetector
-from moa_calculator import MOACalculator
-import tempfile
-import io
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from annotation import RenderCache, draw_reference_scale, render_annotated, render_key
+from admission import AdmissionController, AdmissionRejected
+from ids import new_id
+from metadata_store import decode_cursor, encode_cursor
+import metrics
+from profiling import RequestProfiler, detector_parameters, profile_requested
+
+# Heavy modules (OpenCV, NumPy, SciPy via MOACalculator, firebase_admin) are
+# imported on first use by the routes that need them, so cold starts for
+# /health and /history do not pay for them. Run bench_imports.py to measure.
+cv2 = None
+np = None
+firestore = None
 
 # Global variables for Firebase services (initialized lazily)
 db = None
 bucket = None
 
+# Analysis components (initialized lazily)
+shot_detector = None
+moa_calculator = None
+DEFAULT_PIXELS_PER_INCH = 100  # MOACalculator's scale before calibration; known without importing it
+
+# Warm-instance cache of original images for repeated edits (initialized lazily)
+IMAGE_CACHE_MEMORY_MB = int(os.environ.get('IMAGE_CACHE_MEMORY_MB', '128'))
+IMAGE_CACHE_DISK_MB = int(os.environ.get('IMAGE_CACHE_DISK_MB', '128'))
+image_cache = None
+
+# Annotated image encoding (see image_encoding.py)
+ANNOTATED_FORMAT = os.environ.get('ANNOTATED_FORMAT', 'jpeg')  # 'jpeg' or 'webp' for new uploads
+ANNOTATED_QUALITY = int(os.environ.get('ANNOTATED_QUALITY', '90'))  # 0-100
+
+# History thumbnails (see derivatives.py)
+DERIVATIVE_QUALITY = int(os.environ.get('DERIVATIVE_QUALITY', '80'))  # WebP quality, 0-100
+
+# Rendered annotated images kept on a warm instance (see annotation.py)
+RENDER_CACHE_MB = int(os.environ.get('RENDER_CACHE_MB', '64'))
+render_cache = RenderCache(RENDER_CACHE_MB * 1024 * 1024)
+
+# Detection admitted per instance by count and estimated memory (see admission.py)
+ADMISSION_MAX_IN_FLIGHT = int(os.environ.get('ADMISSION_MAX_IN_FLIGHT', str(os.cpu_count() or 2)))
+ADMISSION_MEMORY_MB = int(os.environ.get('ADMISSION_MEMORY_MB', '512'))
+ADMISSION_BYTES_PER_PIXEL = int(os.environ.get('ADMISSION_BYTES_PER_PIXEL', '16'))
+ADMISSION_QUEUE_TIMEOUT = float(os.environ.get('ADMISSION_QUEUE_TIMEOUT', '10'))  # Seconds before 429
+ADMISSION_MAX_WAITING = int(os.environ.get('ADMISSION_MAX_WAITING', '16'))
+admission = AdmissionController(
+    ADMISSION_MAX_IN_FLIGHT, ADMISSION_MEMORY_MB * 1024 * 1024,
+    max_waiting=ADMISSION_MAX_WAITING, bytes_per_pixel=ADMISSION_BYTES_PER_PIXEL
+)
+
+# Served at /metrics (see metrics.py); the image cache reports once it exists
+metrics.register_admission(lambda: admission)
+metrics.register_cache('render', lambda: render_cache)
+metrics.register_cache('image', lambda: image_cache)
+
+# Larger images are refused from their header, before decoding (see image_probe.py)
+MAX_IMAGE_MEGAPIXELS = float(os.environ.get('MAX_IMAGE_MEGAPIXELS', '50'))
+MAX_IMAGE_PIXELS = int(MAX_IMAGE_MEGAPIXELS * 1_000_000)
+
+# Opt-in per-request profiles, stored under profiles/<profile id>/ in the bucket (see profiling.py)
+PROFILING = os.environ.get('PROFILING', '0') == '1'
+PROFILING_TOKEN = os.environ.get('PROFILING_TOKEN')  # If set, X-Profile / ?profile= must carry this value
+PROFILE_SAMPLE_INTERVAL_MS = float(os.environ.get('PROFILE_SAMPLE_INTERVAL_MS', '5'))
+
+# Batch uploads (initialized lazily)
+BATCH_WORKERS = int(os.environ.get('BATCH_WORKERS', str(os.cpu_count() or 2)))
+BATCH_MAX_IMAGES = int(os.environ.get('BATCH_MAX_IMAGES', '200'))
+BATCH_MAX_IMAGE_MB = int(os.environ.get('BATCH_MAX_IMAGE_MB', '50'))
+BATCH_MAX_TOTAL_MB = int(os.environ.get('BATCH_MAX_TOTAL_MB', '1024'))  # All images of a batch, uncompressed
+batch_executor = None
+
+# URLs handed out by /image (see image_url)
+IMAGE_URL_MODE = os.environ.get('IMAGE_URL_MODE', 'public')  # 'public' or 'signed'
+SIGNED_URL_TTL = int(os.environ.get('SIGNED_URL_TTL', '3600'))  # Seconds a signed URL stays valid
+IMAGE_URL_CACHE_SIZE = 1024  # URLs kept per instance
+IMAGE_IMMUTABLE_MAX_AGE = 365 * 24 * 3600  # Seconds; for content-addressed images
+_image_urls = OrderedDict()
+_image_urls_lock = threading.Lock()
+
+# Concurrent Storage writes (initialized lazily)
+STORAGE_UPLOAD_WORKERS = int(os.environ.get('STORAGE_UPLOAD_WORKERS', '8'))
+storage_executor = None
+
+# Image and metadata stores and the upload core shared with the backend (initialized lazily)
+image_store = None
+metadata_store = None
+targets = None
+
+def load_image_libraries():
+    """Import OpenCV and NumPy on first use"""
+    global cv2, np
+    if cv2 is None:
+        import cv2 as _cv2
+        import numpy as _np
+        cv2, np = _cv2, _np
+
+def get_shot_detector():
+    """Create the shot detector on first use (only the upload route needs it)"""
+    global shot_detector
+    if shot_detector is None:
+        load_image_libraries()
+        from shot_detector import ShotDetector
+        shot_detector = ShotDetector()
+    return shot_detector
+
+def get_moa_calculator():
+    """Create the default MOA calculator on first use"""
+    global moa_calculator
+    if moa_calculator is None:
+        moa_calculator = new_moa_calculator()
+    return moa_calculator
+
+def new_moa_calculator():
+    """Create a fresh MOACalculator, importing SciPy on first use"""
+    load_image_libraries()
+    from moa_calculator import MOACalculator
+    return MOACalculator()
+
+def get_image_cache():
+    """Create the per-instance original image cache on first use"""
+    global image_cache
+    if image_cache is None:
+        from image_cache import ImageCache
+        image_cache = ImageCache(
+            max_memory_bytes=IMAGE_CACHE_MEMORY_MB * 1024 * 1024,
+            max_disk_bytes=IMAGE_CACHE_DISK_MB * 1024 * 1024
+        )
+    return image_cache
+
 def get_firebase_services():
     """Initialize Firebase services lazily"""
-    global db, bucket
+    global db, bucket, firestore
     if db is None:
+        import firebase_admin
+        from firebase_admin import storage, firestore as _firestore
+        firestore = _firestore
+        
         # Initialize Firebase Admin SDK if not already done
         if not firebase_admin._apps:
             firebase_admin.initialize_app()
@@ -34,68 +154,165 @@ def get_firebase_services():
     
     return db, bucket
 
-# Initialize components
-shot_detector = ShotDetector()
-moa_calculator = MOACalculator()
+HISTORY_MAX_LIMIT = 500  # Largest page /history will return
 
-def load_metadata():
-    """Load metadata from Firestore"""
-    try:
-        db, bucket = get_firebase_services()
-        docs = db.collection('targets').stream()
-        metadata = []
-        for doc in docs:
-            data = doc.to_dict()
-            data['id'] = doc.id
-            metadata.append(data)
-        return metadata
-    except Exception as e:
-        print(f"Error loading metadata: {e}")
-        return []
+def get_metadata_store():
+    """Firestore metadata store (see metadata_store.py); the client is looked up on each call"""
+    global metadata_store
+    if metadata_store is None:
+        from metadata_store import FirestoreMetadataStore
+        metadata_store = FirestoreMetadataStore(lambda: get_firebase_services()[0])
+    return metadata_store
+
+def load_history_page(limit, after=None, fields=None):
+    """
+    Load one page of history from Firestore, newest first
+
+    Ordering, the limit and the cursor are applied by an indexed Firestore
+    query, so each call reads at most `limit` documents.
+
+    Args:
+        limit: Maximum number of entries to return
+        after: Optional (upload_time, id) key of the last entry already seen
+        fields: Optional field names to fetch (projection)
+
+    Returns:
+        List of metadata entries
+    """
+    return get_metadata_store().list_page(limit, after, fields)
+
+def get_metadata(image_id):
+    """Fetch a single metadata entry by document id, or None if it does not exist"""
+    return get_metadata_store().get(image_id)
 
 def save_metadata(metadata_entry):
     """Save single metadata entry to Firestore"""
     try:
-        db, bucket = get_firebase_services()
-        doc_ref = db.collection('targets').document(metadata_entry['id'])
-        doc_ref.set(metadata_entry)
+        get_metadata_store().insert(metadata_entry)
         return True
     except Exception as e:
         print(f"Error saving metadata: {e}")
         return False
 
-def update_metadata(image_id, updates):
-    """Update specific fields in metadata"""
+def save_metadata_batch(entries):
+    """Save several metadata entries to Firestore in batched writes (500 per commit)"""
     try:
-        db, bucket = get_firebase_services()
-        doc_ref = db.collection('targets').document(image_id)
-        doc_ref.update(updates)
+        get_metadata_store().insert_many(entries)
         return True
     except Exception as e:
-        print(f"Error updating metadata: {e}")
-        return False
-def delete_metadata(image_id):
-    """Delete metadata entry from Firestore"""
-    try:
-        db, bucket = get_firebase_services()
-        db.collection('targets').document(image_id).delete()
-        return True
-    except Exception as e:
-        print(f"Error deleting metadata: {e}")
+        print(f"Error saving metadata: {e}")
         return False
 
-def upload_to_storage(file_data, filename):
-    """Upload file to Firebase Storage"""
+def update_metadata(image_id, updates):
+    """Update specific fields in metadata; returns False if the entry does not exist (errors raise)"""
+    return get_metadata_store().update(image_id, updates) is not None
+
+def get_storage_executor():
+    """Thread pool for Storage writes, so a request's uploads run concurrently"""
+    global storage_executor
+    if storage_executor is None:
+        from concurrent.futures import ThreadPoolExecutor
+        storage_executor = ThreadPoolExecutor(max_workers=STORAGE_UPLOAD_WORKERS, thread_name_prefix='storage-upload')
+    return storage_executor
+
+def get_batch_executor():
+    """Thread pool that analyzes the images of batch uploads in parallel"""
+    global batch_executor
+    if batch_executor is None:
+        from concurrent.futures import ThreadPoolExecutor
+        batch_executor = ThreadPoolExecutor(max_workers=BATCH_WORKERS, thread_name_prefix='batch')
+    return batch_executor
+
+def upload_to_storage(file_data, filename, content_type=None, cache_control=None):
+    """Upload file to Firebase Storage and return the blob (its generation is set), or None on error"""
     try:
+        from google.cloud.storage.retry import DEFAULT_RETRY
         db, bucket = get_firebase_services()
         blob = bucket.blob(f"uploads/{filename}")
-        blob.upload_from_string(file_data)
-        blob.make_public()
-        return blob.public_url
+        if cache_control:
+            blob.cache_control = cache_control
+        # The publicRead ACL is applied by the upload request itself, replacing a
+        # separate make_public() round trip. Whole-object writes are safe to retry.
+        blob.upload_from_string(file_data, content_type=content_type, predefined_acl='publicRead',
+                                retry=DEFAULT_RETRY)
+        return blob
     except Exception as e:
         print(f"Error uploading to storage: {e}")
         return None
 
+def upload_to_storage_async(file_data, filename, content_type=None, cache_control=None):
+    """Start upload_to_storage on the storage executor and return its Future"""
+    # Initialize clients on the calling thread so worker threads never race to do it
+    get_firebase_services()
+    return get_storage_executor().submit(upload_to_storage, file_data, filename, content_type, cache_control)
+
+def get_image_store():
+    """Cloud Storage image store for uploads/ (see image_store.py)"""
+    global image_store
+    if image_store is None:
+        from google.cloud.storage.retry import DEFAULT_RETRY
+        from image_store import StorageImageStore
+        # Whole-object writes are conditional, so they are safe to retry
+        image_store = StorageImageStore(lambda: get_firebase_services()[1], 'uploads/',
+                                        executor=get_storage_executor(), retry=DEFAULT_RETRY)
+    return image_store
+
+def get_targets():
+    """Upload and delete core shared with the backend (see targets.py)"""
+    global targets
+    if targets is None:
+        from targets import TargetService
+        targets = TargetService(
+            get_image_store(), get_metadata_store(), get_shot_detector, get_moa_calculator,
+            add_reference_scale, admission, annotated_format=ANNOTATED_FORMAT,
+            annotated_quality=ANNOTATED_QUALITY, max_image_pixels=MAX_IMAGE_PIXELS,
+            executor=get_storage_executor(), on_annotated=annotated_stored, on_original=original_stored
+        )
+    return targets
+
+def annotated_stored(image_id, annotated, annotated_image):
+    """Start uploading a new upload's thumbnails; the upload waits for them"""
+    _, uploads = store_derivatives(image_id, annotated.digest, annotated_image)
+    return uploads
+
+def original_stored(stored, image_data, image):
+    """Keep a new original warm for the edits that usually follow"""
+    if stored.generation is not None:
+        from image_cache import CachedImage
+        get_image_cache().put(CachedImage(f"uploads/{stored.name}", stored.generation, image_data, image=image))
+
+def store_derivatives(image_id, version, annotated_image):
+    """
+    Create the thumbnails of one annotated image version and start uploading them
+
+    Returns ({size: EncodedImage}, [upload Future]). Each object name includes
+    the version, so its bytes never change and it is stored as immutable.
+    """
+    from derivatives import derivative_name, make_derivatives
+    derivatives = make_derivatives(annotated_image, DERIVATIVE_QUALITY)
+    uploads = [
+        upload_to_storage_async(encoded.data, f"derivatives/{derivative_name(image_id, version, size)}",
+                                encoded.mime_type, 'public, max-age=31536000, immutable')
+        for size, encoded in derivatives.items()
+    ]
+    return derivatives, uploads
+
+def delete_derivatives(image_id, keep=()):
+    """Delete an entry's thumbnail objects, except the object names in keep"""
+    try:
+        db, bucket = get_firebase_services()
+        for blob in bucket.list_blobs(prefix=f"uploads/derivatives/{image_id}/"):
+            if blob.name not in keep:
+                blob.delete()
+    except Exception as e:
+        print(f"Error deleting thumbnails for {image_id}: {e}")
+
+def thumbnail_urls(request, entry):
+    """Versioned URLs of an entry's thumbnails (served by /annotated/<id>/<size>)"""
+    from derivatives import DERIVATIVE_SIZES
+    version = annotation_version(entry)
+    return {size: api_url(request, f"/annotated/{entry['id']}/{size}?v={version[:16]}") for size in DERIVATIVE_SIZES}
+
 def download_from_storage(filename):
     """Download file from Firebase Storage"""
     try:
@@ -106,60 +323,98 @@ def download_from_storage(filename):
         print(f"Error downloading from storage: {e}")
         return None
 
-def delete_from_storage(filename):
-    """Delete file from Firebase Storage"""
+def load_original(image_entry):
+    """
+    Get an entry's original image through the warm-instance cache
+
+    Returns a CachedImage (read-only .image array), or None if it
+    could not be loaded. Repeated edits of the same target on a warm
+    instance skip both the download and the decode.
+    """
     try:
         db, bucket = get_firebase_services()
-        blob = bucket.blob(f"uploads/{filename}")
-        blob.delete()
-        return True
+        blob = bucket.blob(f"uploads/{image_entry['filename']}")
+        return get_image_cache().get(blob, image_entry.get('original_generation'))
     except Exception as e:
-        print(f"Error deleting from storage: {e}")
-        return False
+        print(f"Error loading original image: {e}")
+        return None
+
+def annotation_pixels_per_inch(entry):
+    """Scale drawn on an entry's annotated image"""
+    if 'calibration' in entry:
+        return entry['calibration']['pixels_per_inch']
+    return DEFAULT_PIXELS_PER_INCH
+
+# Metadata fields annotation_version() reads
+ANNOTATION_VERSION_FIELDS = {'filename', 'annotated_filename', 'annotated_hash', 'rendered_annotations', 'shots',
+                             'calibration', 'original_generation'}
+
+def annotation_version(entry):
+    """Hash identifying an entry's current annotated image (used as its ETag and ?v=)"""
+    from image_encoding import format_for_filename
+    if entry.get('rendered_annotations'):
+        image_format = format_for_filename(entry['annotated_filename'])
+        return render_key(entry, annotation_pixels_per_inch(entry), image_format, ANNOTATED_QUALITY)
+    if entry.get('annotated_hash'):
+        return entry['annotated_hash']
+    # Older uploads: the stored annotated object is no longer rewritten, so its name identifies it
+    import hashlib
+    return hashlib.sha256(entry['annotated_filename'].encode('utf-8')).hexdigest()
+
+def load_annotated_image(entry):
+    """
+    Current annotated image of an entry as an EncodedImage, or None if its inputs are missing
+
+    Until the first edit this is the object stored at upload (the detector's
+    own annotation). Edits only update metadata and set rendered_annotations,
+    after which the image is rendered from the cached original on request.
+    """
+    from image_encoding import EncodedImage, encode_image, format_for_filename
+    image_format = format_for_filename(entry['annotated_filename'])
+    db, bucket = get_firebase_services()
+    if not entry.get('rendered_annotations'):
+        stored = get_image_cache().get(bucket.blob(f"uploads/{entry['annotated_filename']}"), decode=False)
+        return EncodedImage(stored.data, image_format) if stored is not None else None
+
+    pixels_per_inch = annotation_pixels_per_inch(entry)
+
+    def render():
+        original = load_original(entry)
+        if original is None or original.image is None:
+            return None
+        annotated_image = render_annotated(original.image, entry.get('shots') or [], pixels_per_inch)
+        return encode_image(annotated_image, image_format, ANNOTATED_QUALITY)
+
+    key = render_key(entry, pixels_per_inch, image_format, ANNOTATED_QUALITY)
+    return render_cache.get_or_render(key, render)
+
+def api_url(request, path):
+    """Absolute URL of another route of this function, as the client addresses it"""
+    root = request.base_url[:len(request.base_url) - len(request.path)]
+    prefix = '/api' if request.path.startswith('/api/') else ''
+    return f"{root}{prefix}{path}"
+
+def annotated_image_fields(request, entry, annotated=None):
+    """
+    Response fields for an entry's annotated image
+
+    Inline by default (a base64 data URL, rendered now if needed). With
+    ?response=url the response carries a versioned /annotated URL instead,
+    and nothing is rendered until the browser fetches it.
+    """
+    if request.args.get('response') == 'url':
+        version = annotation_version(entry)
+        return {'annotated_url': api_url(request, f"/annotated/{entry['id']}?v={version[:16]}")}
+    if annotated is None:
+        annotated = load_annotated_image(entry)
+    return {'annotated_image': annotated.data_url()} if annotated is not None else {}
 
 def add_reference_scale(image, pixels_per_inch=None):
     """Add a 1-inch reference scale to the image"""
-    height, width = image.shape[:2]
-    
     # Use provided pixels_per_inch or default from MOA calculator
     if pixels_per_inch is None:
-        pixels_per_inch = moa_calculator.pixels_per_inch
-    scale_length_pixels = int(pixels_per_inch)
-    
-    # Position the scale in the top-right corner
-    margin = 20
-    scale_start_x = width - margin - scale_length_pixels
-    scale_start_y = margin + 30
-    scale_end_x = scale_start_x + scale_length_pixels
-    scale_end_y = scale_start_y
-    
-    # Draw the scale line (thick white line with black border)
-    cv2.line(image, (scale_start_x, scale_start_y), (scale_end_x, scale_end_y), (0, 0, 0), 5)  # Black border
-    cv2.line(image, (scale_start_x, scale_start_y), (scale_end_x, scale_end_y), (255, 255, 255), 3)  # White line
-    
-    # Add tick marks at the ends
-    tick_height = 10
-    cv2.line(image, (scale_start_x, scale_start_y - tick_height//2), (scale_start_x, scale_start_y + tick_height//2), (0, 0, 0), 3)
-    cv2.line(image, (scale_end_x, scale_end_y - tick_height//2), (scale_end_x, scale_end_y + tick_height//2), (0, 0, 0), 3)
-    cv2.line(image, (scale_start_x, scale_start_y - tick_height//2), (scale_start_x, scale_start_y + tick_height//2), (255, 255, 255), 2)
-    cv2.line(image, (scale_end_x, scale_end_y - tick_height//2), (scale_end_x, scale_end_y + tick_height//2), (255, 255, 255), 2)
-    
-    # Add text label
-    label = "1 inch"
-    font = cv2.FONT_HERSHEY_SIMPLEX
-    font_scale = 0.7
-    font_thickness = 2
-    
-    # Get text size to center it above the scale
-    (text_width, text_height), _ = cv2.getTextSize(label, font, font_scale, font_thickness)
-    text_x = scale_start_x + (scale_length_pixels - text_width) // 2
-    text_y = scale_start_y - 10
-    
-    # Draw text with black border for visibility
-    cv2.putText(image, label, (text_x, text_y), font, font_scale, (0, 0, 0), font_thickness + 1)  # Black border
-    cv2.putText(image, label, (text_x, text_y), font, font_scale, (255, 255, 255), font_thickness)  # White text
-    
-    return image
+        pixels_per_inch = get_moa_calculator().pixels_per_inch
+    return draw_reference_scale(image, pixels_per_inch)
 
 @https_fn.on_request()
 def api(request: https_fn.Request):
@@ -181,6 +436,15 @@ def api(request: https_fn.Request):
         'Access-Control-Allow-Headers': 'Content-Type, Authorization',
     }
     
+    started = time.perf_counter()
+    route, response = dispatch(request, headers)
+    metrics.HTTP_REQUESTS.inc(route, request.method, str(response_status(response)))
+    metrics.HTTP_REQUEST_SECONDS.observe(time.perf_counter() - started, route)
+    return response
+
+def dispatch(request, headers):
+    """Route a request to its handler; returns (route pattern, handler response)"""
+    route = 'unmatched'
     try:
         path = request.path
         method = request.method
@@ -190,29 +454,142 @@ def api(request: https_fn.Request):
             path = path[4:]  # Remove '/api'
         
         # Route requests based on path and method
-        if path.startswith('/upload') and method == 'POST':
-            return handle_upload(request, headers)
+        if path.startswith('/upload/batch') and method == 'POST':
+            route = '/upload/batch'
+            return route, handle_upload_batch(request, headers)
+        elif path.startswith('/upload') and method == 'POST':
+            route = '/upload'
+            return route, profiled(route, handle_upload, request, headers)
         elif path.startswith('/history') and method == 'GET':
-            return handle_history(request, headers)
+            route = '/history'
+            return route, handle_history(request, headers)
         elif path.startswith('/update-shots/') and method == 'POST':
+            route = '/update-shots/<image_id>'
             image_id = path.split('/update-shots/')[1]
-            return handle_update_shots(request, image_id, headers)
+            return route, profiled(route, handle_update_shots, request, image_id, headers)
         elif path.startswith('/calibrate/') and method == 'POST':
+            route = '/calibrate/<image_id>'
             image_id = path.split('/calibrate/')[1]
-            return handle_calibrate(request, image_id, headers)
+            return route, profiled(route, handle_calibrate, request, image_id, headers)
         elif path.startswith('/delete/') and method == 'DELETE':
+            route = '/delete/<image_id>'
             image_id = path.split('/delete/')[1]
-            return handle_delete(request, image_id, headers)
+            return route, handle_delete(request, image_id, headers)
+        elif path.startswith('/annotated/') and method == 'GET':
+            image_id, _, size = path.split('/annotated/')[1].partition('/')
+            if size:
+                route = '/annotated/<image_id>/<size>'
+                return route, handle_get_thumbnail(request, image_id, size, headers)
+            route = '/annotated/<image_id>'
+            return route, handle_get_annotated(request, image_id, headers)
         elif path.startswith('/image/') and method == 'GET':
+            route = '/image/<filename>'
             filename = path.split('/image/')[1]
-            return handle_get_image(request, filename, headers)
+            return route, handle_get_image(request, filename, headers)
+        elif path.startswith('/metrics') and method == 'GET':
+            route = '/metrics'
+            return route, handle_metrics(request, headers)
         elif path.startswith('/health') and method == 'GET':
-            return handle_health(request, headers)
+            route = '/health'
+            return route, handle_health(request, headers)
         else:
-            return jsonify({'error': 'Endpoint not found'}), 404, headers
+            return route, (jsonify({'error': 'Endpoint not found'}), 404, headers)
             
     except Exception as e:
-        return jsonify({'error': str(e)}), 500, headers
+        return route, (jsonify({'error': str(e)}), 500, headers)
+
+def profiled(route, handler, request, *args):
+    """
+    Run a handler under RequestProfiler when the request asks for it
+
+    The profile, its parameters and a copy of the image are uploaded to
+    profiles/<profile id>/ in the bucket, and the id is returned in the
+    X-Profile-Id header.
+    """
+    if not profile_requested(request, PROFILING, PROFILING_TOKEN):
+        return handler(request, *args)
+    with RequestProfiler(PROFILE_SAMPLE_INTERVAL_MS / 1000) as profiler:
+        response = handler(request, *args)
+
+    body = response[0] if isinstance(response, tuple) else response
+    image_id = args[0] if len(args) > 1 else (body.get_json(silent=True) or {}).get('id')
+    entry = get_metadata(image_id) if image_id else None
+    params = {
+        'route': route,
+        'method': request.method,
+        'args': request.args.to_dict(),
+        'files': [{'field': field, 'filename': file.filename, 'content_type': file.mimetype}
+                  for field, file in request.files.items(multi=True)],
+        'json': request.get_json(silent=True),
+        'status': response_status(response),
+        'image_id': image_id,
+        'image': entry and {key: entry.get(key) for key in
+                            ('filename', 'original_name', 'annotated_filename', 'shots', 'manual_shots', 'calibration')},
+        'annotated_format': ANNOTATED_FORMAT,
+        'annotated_quality': ANNOTATED_QUALITY,
+        **detector_parameters(get_shot_detector(), get_moa_calculator())
+    }
+    files = profiler.files(params)
+    # Keep the image too, so the profile outlives the entry it was taken on
+    original = entry and get_image_store().get(entry['filename'])
+    if original:
+        files['original' + os.path.splitext(entry['filename'])[1]] = original
+
+    _, bucket = get_firebase_services()
+    profile_id = new_id()
+    for name, data in files.items():
+        bucket.blob(f"profiles/{profile_id}/{name}").upload_from_string(data)
+    headers = response[2] if isinstance(response, tuple) and len(response) == 3 else body.headers
+    headers['X-Profile-Id'] = profile_id
+    headers['Access-Control-Expose-Headers'] = 'X-Profile-Id'
+    return response
+
+def response_status(response):
+    """Status code of a handler's return value (a Response, or a (body, status, headers) tuple)"""
+    if isinstance(response, tuple):
+        if len(response) > 1 and isinstance(response[1], int):
+            return response[1]
+        response = response[0]
+    return getattr(response, 'status_code', 200)
+
+def analyze_upload(image_id, original_name, image_data, content_type=None, admission_timeout=ADMISSION_QUEUE_TIMEOUT):
+    """
+    Detect shots in an uploaded image and store the original, annotated image and thumbnails
+
+    See TargetService.analyze. Returns (metadata_entry, annotated
+    EncodedImage, pending Storage upload futures); the entry is not saved.
+    """
+    # Initialize clients on the calling thread so worker threads never race to do it
+    get_firebase_services()
+    return get_targets().analyze(image_id, original_name, image_data, content_type, admission_timeout)
+
+def uploads_succeeded(pending_uploads):
+    """Wait for every pending Storage upload; whether all of them stored their object"""
+    succeeded = True
+    for upload in pending_uploads:
+        try:
+            # upload_to_storage returns None when it fails
+            succeeded = upload.result() is not None and succeeded
+        except Exception as e:
+            print(f"Error uploading to storage: {e}")
+            succeeded = False
+    return succeeded
+
+def discard_upload(entry):
+    """Give back the image references of an upload whose entry will not be saved, and remove its thumbnails"""
+    get_targets().discard([entry])
+    delete_derivatives(entry['id'])
+
+def upload_response(request, entry, annotated=None):
+    """Body of a successful upload response"""
+    return {
+        'success': True,
+        'id': entry['id'],
+        'shot_count': entry['shot_count'],
+        'moa_value': entry['moa_value'],
+        **annotated_image_fields(request, entry, annotated),
+        'shots': entry['shots']
+    }
 
 def handle_upload(request, headers):
     """Handle target photo upload and analysis"""
@@ -224,103 +601,166 @@ def handle_upload(request, headers):
         if file.filename == '':
             return jsonify({'error': 'No file selected'}), 400, headers
         
-        # Generate timestamp and filenames
-        timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-        filename = f"target_{timestamp}_{file.filename}"
-        annotated_filename = f"annotated_{filename}"
+        # Stored files are named by content; the entry keeps the uploaded name
+        image_id = new_id()
         
-        # Read image data
-        image_data = file.read()
+        try:
+            metadata_entry, annotated, pending_uploads = analyze_upload(
+                image_id, file.filename, file.read(), file.mimetype)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), getattr(e, 'status_code', 400), headers
         
-        # Convert to OpenCV format
-        nparr = np.frombuffer(image_data, np.uint8)
-        image = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
+        # The entry is only saved once every object it points at exists
+        if not (uploads_succeeded(pending_uploads) and save_metadata(metadata_entry)):
+            discard_upload(metadata_entry)
+            return jsonify({'error': 'Could not save the upload'}), 500, headers
         
-        if image is None:
-            return jsonify({'error': 'Invalid image file'}), 400, headers
-        
-        # Detect shots in the image
-        shots, annotated_image = shot_detector.detect_shots(image)
-        
-        # Add 1-inch reference scale to the image
-        annotated_image = add_reference_scale(annotated_image)
-        
-        # Calculate MOA if shots are detected
-        moa_value = None
-        if len(shots) > 0:
-            moa_value = moa_calculator.calculate_moa(shots)
-        
-        # Upload original image to storage
-        upload_to_storage(image_data, filename)
-        
-        # Upload annotated image to storage
-        _, buffer = cv2.imencode('.jpg', annotated_image)
-        annotated_image_data = buffer.tobytes()
-        upload_to_storage(annotated_image_data, annotated_filename)
-        
-        # Convert annotated image to base64 for frontend display
-        img_base64 = base64.b64encode(buffer).decode('utf-8')
-        
-        # Create metadata entry
-        metadata_entry = {
-            'id': timestamp,
-            'filename': filename,
-            'annotated_filename': annotated_filename,
-            'upload_time': datetime.now().isoformat(),
-            'shot_count': len(shots),
-            'moa_value': moa_value,
-            'shots': shots.tolist() if shots is not None else []
-        }
-        
-        # Save metadata to Firestore
-        save_metadata(metadata_entry)
-        
-        return jsonify({
-            'success': True,
-            'id': timestamp,
-            'shot_count': len(shots),
-            'moa_value': moa_value,
-            'annotated_image': f"data:image/jpeg;base64,{img_base64}",
-            'shots': shots.tolist() if shots is not None else []
-        }), 200, headers
+        return jsonify(upload_response(request, metadata_entry, annotated)), 200, headers
         
+    except AdmissionRejected as e:
+        return (jsonify({'error': str(e), 'retry_after': e.retry_after}), 429,
+                {**headers, 'Retry-After': str(e.retry_after)})
     except Exception as e:
         return jsonify({'error': str(e)}), 500, headers
 
+def analyze_batch_item(image_id, original_name, image_data):
+    """Analyze one image of a batch, returning once its Storage uploads finish"""
+    # The batch was accepted as a whole, so its images wait for detection capacity
+    metadata_entry, annotated, pending_uploads = analyze_upload(image_id, original_name, image_data,
+                                                                admission_timeout=None)
+    if not uploads_succeeded(pending_uploads):
+        discard_upload(metadata_entry)
+        raise RuntimeError('Could not store the thumbnails')
+    return metadata_entry, annotated
+
+def handle_upload_batch(request, headers):
+    """
+    Upload and analyze many targets at once
+
+    Accepts any number of 'images' files, each an image or a zip archive of
+    images. They are analyzed in parallel, at most BATCH_WORKERS at a time
+    (archive members are extracted only when their turn comes), and the
+    response streams one NDJSON line per image as it finishes ({index,
+    filename} plus the single upload fields, or an error). The metadata for
+    the whole batch is saved in one batched write, after which a final
+    {"done": true, ...} line is sent.
+    """
+    from batch_upload import BoundedBatch, expand_batch
+    
+    files = request.files.getlist('images')
+    if not files:
+        return jsonify({'error': 'No image files provided'}), 400, headers
+    try:
+        items = expand_batch([(file.filename, file.read()) for file in files],
+                             BATCH_MAX_IMAGES, BATCH_MAX_IMAGE_MB * 1024 * 1024, BATCH_MAX_TOTAL_MB * 1024 * 1024)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400, headers
+    
+    errors = [{'index': index, 'filename': name, 'error': error}
+              for index, (name, _, error) in enumerate(items) if error is not None]
+    batch = BoundedBatch(
+        get_batch_executor(), lambda name, read: analyze_batch_item(new_id(), os.path.basename(name), read()),
+        [(index, name, read) for index, (name, read, error) in enumerate(items) if error is None], BATCH_WORKERS
+    )
+    
+    def stream():
+        try:
+            for line in errors:
+                yield json.dumps(line) + '\n'
+            for index, name, future in batch:
+                try:
+                    entry, annotated = future.result()
+                except Exception as e:
+                    line = {'index': index, 'filename': name, 'error': str(e)}
+                else:
+                    line = {'index': index, 'filename': name, **upload_response(request, entry, annotated)}
+                yield json.dumps(line) + '\n'
+        finally:
+            # A client that disconnects early still gets everything that was analyzed saved
+            entries = [future.result()[0] for future in batch.finish() if future.exception() is None]
+            if entries and not save_metadata_batch(entries):
+                for entry in entries:
+                    discard_upload(entry)
+                entries = []
+        yield json.dumps({
+            'done': True,
+            'saved': len(entries),
+            'failed': len(items) - len(entries),
+            'ids': [entry['id'] for entry in entries]
+        }) + '\n'
+    
+    return Response(stream_with_context(stream()), mimetype='application/x-ndjson'), 200, headers
+
+def project_entry(entry, fields=None, exclude=None):
+    """Return a copy of a metadata entry limited to the requested fields ('id' is always kept)"""
+    if fields:
+        return {key: value for key, value in entry.items() if key in fields or key == 'id'}
+    if exclude:
+        return {key: value for key, value in entry.items() if key not in exclude}
+    return entry
+
+def parse_field_list(value):
+    """Parse a comma separated query parameter into a set of field names"""
+    return {field.strip() for field in value.split(',') if field.strip()} if value else None
+
 def handle_history(request, headers):
-    """Get upload history"""
+    """
+    Get upload history, newest first
+
+    Query parameters (all optional):
+        limit: Page size, up to HISTORY_MAX_LIMIT (defaults to HISTORY_MAX_LIMIT)
+        after: Cursor from the previous page's X-Next-Cursor header
+        fields: Comma separated fields to include, e.g. fields=id,upload_time,moa_value
+        exclude: Comma separated fields to omit, e.g. exclude=shots
+    """
     try:
-        metadata = load_metadata()
-        metadata.sort(key=lambda entry: entry['upload_time'], reverse=True)
-        return jsonify(metadata), 200, headers
+        limit = request.args.get('limit', HISTORY_MAX_LIMIT, type=int)
+        after = request.args.get('after')
+        fields = parse_field_list(request.args.get('fields'))
+        exclude = parse_field_list(request.args.get('exclude'))
+        
+        if not 1 <= limit <= HISTORY_MAX_LIMIT:
+            return jsonify({'error': f'limit must be between 1 and {HISTORY_MAX_LIMIT}'}), 400, headers
+        try:
+            after_key = decode_cursor(after) if after else None
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400, headers
+        
+        # Thumbnail URLs are derived from the fields that identify the annotated image
+        with_thumbnails = not (fields and 'thumbnails' not in fields) and not (exclude and 'thumbnails' in exclude)
+        query_fields = fields | ANNOTATION_VERSION_FIELDS if fields and with_thumbnails else fields
+        
+        # Fetch one extra entry to learn whether another page exists
+        metadata = load_history_page(limit + 1, after_key, query_fields)
+        response_headers = dict(headers)
+        response_headers['Access-Control-Expose-Headers'] = 'X-Next-Cursor'
+        if len(metadata) > limit:
+            metadata = metadata[:limit]
+            response_headers['X-Next-Cursor'] = encode_cursor(metadata[-1])
+        
+        entries = []
+        for entry in metadata:
+            projected = project_entry(entry, fields, exclude)
+            if with_thumbnails:
+                projected = {**projected, 'thumbnails': thumbnail_urls(request, entry)}
+            entries.append(projected)
+        return jsonify(entries), 200, response_headers
     except Exception as e:
         return jsonify({'error': str(e)}), 500, headers
 
 def handle_update_shots(request, image_id, headers):
     """Update shots with manual selections and recalculate MOA"""
     try:
+        load_image_libraries()
+        
         data = request.get_json()
         manual_shots = data.get('manual_shots', [])
         
         # Get metadata from Firestore
-        db, bucket = get_firebase_services()
-        doc_ref = db.collection('targets').document(image_id)
-        doc = doc_ref.get()
-        
-        if not doc.exists:
+        image_entry = get_metadata(image_id)
+        if image_entry is None:
             return jsonify({'error': 'Image not found'}), 404, headers
         
-        image_entry = doc.to_dict()
-        
-        # Download original image from storage
-        image_data = download_from_storage(image_entry['filename'])
-        if image_data is None:
-            return jsonify({'error': 'Could not load original image'}), 400, headers
-        
-        # Convert to OpenCV format
-        nparr = np.frombuffer(image_data, np.uint8)
-        image = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
-        
         # Combine auto-detected shots with manual shots
         auto_shots = np.array(image_entry['shots']) if image_entry['shots'] else np.array([])
         manual_shots_array = np.array(manual_shots) if manual_shots else np.array([])
@@ -342,52 +782,36 @@ def handle_update_shots(request, image_id, headers):
         else:
             all_shots = np.array([])
         
-        # Create new annotated image
-        annotated_image = image.copy()
-        if len(all_shots) > 0:
-            for shot in all_shots:
-                x, y, radius = int(shot[0]), int(shot[1]), int(shot[2])
-                cv2.circle(annotated_image, (x, y), radius, (0, 255, 0), 2)
-                cv2.circle(annotated_image, (x, y), 2, (0, 0, 255), -1)
-        
-        # Add reference scale
-        scale_pixels_per_inch = image_entry.get('calibration', {}).get('pixels_per_inch')
-        annotated_image = add_reference_scale(annotated_image, scale_pixels_per_inch)
-        
         # Recalculate MOA
         moa_value = None
         if len(all_shots) > 0:
             if 'calibration' in image_entry:
-                temp_calculator = MOACalculator()
+                temp_calculator = new_moa_calculator()
                 temp_calculator.set_calibration(image_entry['calibration']['pixels_per_inch'], 100)
                 moa_value = temp_calculator.calculate_moa(all_shots)
             else:
-                moa_value = moa_calculator.calculate_moa(all_shots)
-        
-        # Upload updated annotated image
-        _, buffer = cv2.imencode('.jpg', annotated_image)
-        annotated_image_data = buffer.tobytes()
-        upload_to_storage(annotated_image_data, image_entry['annotated_filename'])
+                moa_value = get_moa_calculator().calculate_moa(all_shots)
         
-        # Convert to base64
-        img_base64 = base64.b64encode(buffer).decode('utf-8')
-        
-        # Update metadata
+        # Update metadata; the annotated image is rendered from it when requested
         updates = {
             'shot_count': len(all_shots),
             'moa_value': moa_value,
             'shots': all_shots.tolist() if len(all_shots) > 0 else [],
             'manual_shots': manual_shots,
-            'last_updated': datetime.now().isoformat()
+            'last_updated': datetime.now().isoformat(),
+            'rendered_annotations': True
         }
-        update_metadata(image_id, updates)
+        # A delete may have removed the entry since it was read
+        if not update_metadata(image_id, updates):
+            return jsonify({'error': 'Image not found'}), 404, headers
+        image_entry.update(updates)
         
         return jsonify({
             'success': True,
             'id': image_id,
             'shot_count': len(all_shots),
             'moa_value': moa_value,
-            'annotated_image': f"data:image/jpeg;base64,{img_base64}",
+            **annotated_image_fields(request, image_entry),
             'shots': all_shots.tolist() if len(all_shots) > 0 else [],
             'manual_shots': manual_shots
         }), 200, headers
@@ -398,6 +822,8 @@ def handle_update_shots(request, image_id, headers):
 def handle_calibrate(request, image_id, headers):
     """Calibrate the scale for an image using two reference points"""
     try:
+        load_image_libraries()
+        
         data = request.get_json()
         point1 = data.get('point1')
         point2 = data.get('point2')
@@ -414,15 +840,10 @@ def handle_calibrate(request, image_id, headers):
         pixels_per_inch = pixel_distance / distance_inches
         
         # Get metadata from Firestore
-        db, bucket = get_firebase_services()
-        doc_ref = db.collection('targets').document(image_id)
-        doc = doc_ref.get()
-        
-        if not doc.exists:
+        image_entry = get_metadata(image_id)
+        if image_entry is None:
             return jsonify({'error': 'Image not found'}), 404, headers
         
-        image_entry = doc.to_dict()
-        
         # Update calibration data
         calibration_data = {
             'point1': point1,
@@ -434,50 +855,32 @@ def handle_calibrate(request, image_id, headers):
         # Recalculate MOA if shots exist
         new_moa_value = image_entry.get('moa_value')
         if image_entry.get('shots'):
-            temp_calculator = MOACalculator()
+            temp_calculator = new_moa_calculator()
             temp_calculator.set_calibration(pixels_per_inch, 100)
             shots_array = np.array(image_entry['shots'])
             if len(shots_array) > 0:
                 new_moa_value = temp_calculator.calculate_moa(shots_array)
         
-        # Regenerate annotated image with new calibration
-        image_data = download_from_storage(image_entry['filename'])
-        if image_data:
-            nparr = np.frombuffer(image_data, np.uint8)
-            image = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
-            
-            annotated_image = image.copy()
-            if image_entry.get('shots'):
-                shots_array = np.array(image_entry['shots'])
-                if len(shots_array) > 0:
-                    if shots_array.shape[1] == 2:
-                        shots_array = np.column_stack([shots_array, np.full(len(shots_array), 10)])
-                    
-                    for shot in shots_array:
-                        x, y, radius = int(shot[0]), int(shot[1]), int(shot[2])
-                        cv2.circle(annotated_image, (x, y), radius, (0, 255, 0), 2)
-                        cv2.circle(annotated_image, (x, y), 2, (0, 0, 255), -1)
-            
-            # Add reference scale with new calibration
-            annotated_image = add_reference_scale(annotated_image, pixels_per_inch)
-            
-            # Upload updated annotated image
-            _, buffer = cv2.imencode('.jpg', annotated_image)
-            annotated_image_data = buffer.tobytes()
-            upload_to_storage(annotated_image_data, image_entry['annotated_filename'])
-        
-        # Update metadata
+        # Update metadata; the annotated image (with the new scale) is rendered when requested
         updates = {
             'calibration': calibration_data,
-            'moa_value': new_moa_value
+            'moa_value': new_moa_value,
+            'rendered_annotations': True
         }
-        update_metadata(image_id, updates)
+        # A delete may have removed the entry since it was read
+        if not update_metadata(image_id, updates):
+            return jsonify({'error': 'Image not found'}), 404, headers
+        image_entry.update(updates)
         
-        return jsonify({
+        result = {
             'success': True,
             'pixels_per_inch': pixels_per_inch,
             'moa_value': new_moa_value
-        }), 200, headers
+        }
+        # Only URL mode returns the annotated image, which costs nothing until it is fetched
+        if request.args.get('response') == 'url':
+            result.update(annotated_image_fields(request, image_entry))
+        return jsonify(result), 200, headers
         
     except Exception as e:
         return jsonify({'error': str(e)}), 500, headers
@@ -485,43 +888,168 @@ def handle_calibrate(request, image_id, headers):
 def handle_delete(request, image_id, headers):
     """Delete a target and its associated files"""
     try:
-        # Get metadata from Firestore
-        db, bucket = get_firebase_services()
-        doc_ref = db.collection('targets').document(image_id)
-        doc = doc_ref.get()
-        
-        if not doc.exists:
+        # Remove the entry; image objects other entries share stay
+        if get_targets().delete(image_id) is None:
             return jsonify({'error': 'Image not found'}), 404, headers
-        
-        image_entry = doc.to_dict()
-        
-        # Delete files from storage
-        delete_from_storage(image_entry['filename'])
-        delete_from_storage(image_entry['annotated_filename'])
-        
-        # Delete metadata from Firestore
-        delete_metadata(image_id)
+        delete_derivatives(image_id)
         
         return jsonify({'success': True, 'message': 'Target deleted successfully'}), 200, headers
         
     except Exception as e:
         return jsonify({'error': str(e)}), 500, headers
 
+def image_url(filename):
+    """
+    URL clients download an uploaded image from, cached per instance
+
+    Uploads are stored with the publicRead ACL, so a public URL is built
+    from the object name alone. With IMAGE_URL_MODE=signed, a V4 signed URL
+    is generated instead and reused until half its lifetime has passed.
+    Returns (url, seconds clients may cache it for).
+    """
+    from image_store import content_digest
+    now = time.monotonic()
+    with _image_urls_lock:
+        cached = _image_urls.get(filename)
+        if cached is not None and (cached[1] is None or cached[1] > now):
+            _image_urls.move_to_end(filename)
+            url, refresh_at, max_age = cached
+            return url, max_age if refresh_at is None else int(refresh_at - now)
+    
+    db, bucket = get_firebase_services()
+    blob = bucket.blob(f"uploads/{filename}")
+    if IMAGE_URL_MODE == 'signed':
+        url = blob.generate_signed_url(version='v4', expiration=timedelta(seconds=SIGNED_URL_TTL), method='GET')
+        max_age = SIGNED_URL_TTL // 2
+        refresh_at = now + max_age
+    else:
+        url = blob.public_url
+        # A content-addressed name never points at other bytes
+        max_age = IMAGE_IMMUTABLE_MAX_AGE if content_digest(filename) else 0
+        refresh_at = None
+    
+    with _image_urls_lock:
+        _image_urls[filename] = (url, refresh_at, max_age)
+        _image_urls.move_to_end(filename)
+        while len(_image_urls) > IMAGE_URL_CACHE_SIZE:
+            _image_urls.popitem(last=False)
+    return url, max_age
+
 def handle_get_image(request, filename, headers):
-    """Serve images from storage"""
+    """
+    Return the URL of a stored image
+
+    No Storage requests are made (see image_url): a missing object is
+    reported by Storage when the URL is fetched.
+    """
     try:
-        # For Firebase, we'll redirect to the public URL
-        db, bucket = get_firebase_services()
-        blob = bucket.blob(f"uploads/{filename}")
-        if not blob.exists():
+        if not filename or '/' in filename:
             return jsonify({'error': 'Image not found'}), 404, headers
-        
-        blob.make_public()
-        return jsonify({'url': blob.public_url}), 200, headers
+        url, max_age = image_url(filename)
+        cache_control = f"public, max-age={max_age}" if max_age else 'no-cache'
+        return jsonify({'url': url}), 200, {**headers, 'Cache-Control': cache_control}
         
     except Exception as e:
         return jsonify({'error': str(e)}), 404, headers
 
+def handle_get_annotated(request, image_id, headers):
+    """
+    Serve an entry's current annotated image, rendering it on first request
+
+    The strong ETag is the annotation version, so revalidation (If-None-Match)
+    is answered from metadata alone. A ?v= matching it is cached as immutable.
+    """
+    try:
+        image_entry = get_metadata(image_id)
+        if image_entry is None:
+            return jsonify({'error': 'Image not found'}), 404, headers
+        version = annotation_version(image_entry)
+
+        requested = request.args.get('v')
+        response_headers = dict(headers)
+        if requested and version.startswith(requested):
+            response_headers['Cache-Control'] = 'public, max-age=31536000, immutable'
+        else:
+            response_headers['Cache-Control'] = 'no-cache'
+
+        if version in request.if_none_match:
+            response = Response(status=304)
+        else:
+            load_image_libraries()
+            annotated = load_annotated_image(image_entry)
+            if annotated is None:
+                return jsonify({'error': 'Image not found'}), 404, headers
+            response = Response(annotated.data, mimetype=annotated.mime_type)
+        response.set_etag(version)
+        response.headers.update(response_headers)
+        return response
+        
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500, headers
+
+def handle_get_thumbnail(request, image_id, size, headers):
+    """
+    Serve a thumbnail of an entry's current annotated image (size is 'small' or 'medium')
+
+    Thumbnails are stored at upload. One that does not exist yet (e.g. right
+    after an edit) is generated and stored here; warm instances keep them in
+    the render cache.
+    """
+    try:
+        from derivatives import DERIVATIVE_SIZES, derivative_name
+        from google.api_core.exceptions import NotFound
+        from image_encoding import EncodedImage
+        image_entry = get_metadata(image_id)
+        if image_entry is None or size not in DERIVATIVE_SIZES:
+            return jsonify({'error': 'Image not found'}), 404, headers
+        version = annotation_version(image_entry)
+        etag = f"{version}-{size}"
+
+        requested = request.args.get('v')
+        response_headers = dict(headers)
+        if requested and version.startswith(requested):
+            response_headers['Cache-Control'] = 'public, max-age=31536000, immutable'
+        else:
+            response_headers['Cache-Control'] = 'no-cache'
+
+        def load():
+            db, bucket = get_firebase_services()
+            try:
+                blob = bucket.blob(f"uploads/derivatives/{derivative_name(image_id, version, size)}")
+                return EncodedImage(blob.download_as_bytes(), 'webp')
+            except NotFound:
+                pass
+            load_image_libraries()
+            annotated = load_annotated_image(image_entry)
+            if annotated is None:
+                return None
+            image = cv2.imdecode(np.frombuffer(annotated.data, np.uint8), cv2.IMREAD_COLOR)
+            derivatives, uploads = store_derivatives(image_id, version, image)
+            for upload in uploads:
+                upload.result()
+            # Thumbnails of earlier versions are no longer referenced
+            delete_derivatives(image_id, keep={f"uploads/derivatives/{derivative_name(image_id, version, other)}"
+                                               for other in derivatives})
+            return derivatives[size]
+
+        if etag in request.if_none_match:
+            response = Response(status=304)
+        else:
+            thumbnail = render_cache.get_or_render(etag, load)
+            if thumbnail is None:
+                return jsonify({'error': 'Image not found'}), 404, headers
+            response = Response(thumbnail.data, mimetype=thumbnail.mime_type)
+        response.set_etag(etag)
+        response.headers.update(response_headers)
+        return response
+        
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500, headers
+
+def handle_metrics(request, headers):
+    """Request, upload, detection and cache metrics of this instance in the Prometheus text format"""
+    return Response(metrics.REGISTRY.render(), content_type=metrics.CONTENT_TYPE), 200, headers
+
 def handle_health(request, headers):
     """Health check endpoint"""
     return jsonify({'status': 'healthy', 'service': 'photoMOA Firebase backend'}), 200, headers
\ No newline at end of file
@@ -0,0 +1,208 @@
+"""
+In-memory stand-in for the subset of the Firestore client used by main.py
+
+Lets the Firestore code paths (ordered queries, cursors, projections,
+single-document and batched reads, and transactions) run locally and in
+tests without credentials or the emulator. Document reads are counted so
+tests can check query cost.
+"""
+import copy
+import functools
+import itertools
+import threading
+
+DESCENDING = 'DESCENDING'
+ASCENDING = 'ASCENDING'
+
+
+class MemoryDocumentSnapshot:
+    def __init__(self, reference, data):
+        self.reference = reference
+        self.id = reference.id
+        self._data = data
+
+    @property
+    def exists(self):
+        return self._data is not None
+
+    def to_dict(self):
+        return copy.deepcopy(self._data) if self._data is not None else None
+
+
+class MemoryDocumentReference:
+    def __init__(self, collection, doc_id):
+        self._collection = collection
+        self.id = doc_id
+
+    def get(self, transaction=None):
+        self._collection._client.reads += 1
+        return MemoryDocumentSnapshot(self, copy.deepcopy(self._collection._docs.get(self.id)))
+
+    def set(self, data):
+        self._collection._docs[self.id] = copy.deepcopy(data)
+
+    def update(self, updates):
+        if self.id not in self._collection._docs:
+            from google.api_core.exceptions import NotFound
+            raise NotFound(f"No document to update: {self.id}")
+        self._collection._docs[self.id].update(copy.deepcopy(updates))
+
+    def delete(self):
+        self._collection._docs.pop(self.id, None)
+
+
+class MemoryQuery:
+    def __init__(self, collection, orders=(), limit=None, start_after=None, fields=None):
+        self._collection = collection
+        self._orders = list(orders)
+        self._limit = limit
+        self._start_after = start_after
+        self._fields = fields
+
+    def _copy(self, **changes):
+        args = {
+            'orders': self._orders,
+            'limit': self._limit,
+            'start_after': self._start_after,
+            'fields': self._fields,
+        }
+        args.update(changes)
+        return MemoryQuery(self._collection, **args)
+
+    def order_by(self, field_path, direction=ASCENDING):
+        return self._copy(orders=self._orders + [(field_path, direction)])
+
+    def limit(self, count):
+        return self._copy(limit=count)
+
+    def start_after(self, document_fields):
+        return self._copy(start_after=document_fields)
+
+    def select(self, field_paths):
+        return self._copy(fields=list(field_paths))
+
+    def _value(self, doc_id, data, field_path):
+        return doc_id if field_path == '__name__' else data.get(field_path)
+
+    def _compare(self, a, b):
+        for field_path, direction in self._orders:
+            left, right = self._value(a[0], a[1], field_path), self._value(b[0], b[1], field_path)
+            if left != right:
+                result = -1 if left < right else 1
+                return -result if direction == DESCENDING else result
+        return 0
+
+    def stream(self):
+        docs = [(doc_id, data) for doc_id, data in self._collection._docs.items()
+                if all(field_path == '__name__' or field_path in data for field_path, _ in self._orders)]
+        docs.sort(key=functools.cmp_to_key(self._compare))
+
+        if self._start_after is not None:
+            cursor_id = self._start_after.get('__name__')
+            cursor = (cursor_id, self._start_after)
+            docs = [doc for doc in docs if self._compare(doc, cursor) > 0]
+
+        if self._limit is not None:
+            docs = docs[:self._limit]
+
+        for doc_id, data in docs:
+            self._collection._client.reads += 1
+            if self._fields is not None:
+                data = {key: value for key, value in data.items() if key in self._fields}
+            yield MemoryDocumentSnapshot(self._collection.document(doc_id), copy.deepcopy(data))
+
+
+class MemoryCollectionReference(MemoryQuery):
+    def __init__(self, client, name):
+        self._client = client
+        self.name = name
+        self._docs = {}
+        super().__init__(self)
+
+    def document(self, doc_id):
+        return MemoryDocumentReference(self, doc_id)
+
+
+class MemoryWriteBatch:
+    """Buffered document writes applied together on commit()"""
+
+    def __init__(self, client):
+        self._client = client
+        self._writes = []
+
+    def set(self, reference, data):
+        self._writes.append((reference, data))
+
+    def commit(self):
+        for reference, data in self._writes:
+            reference.set(data)
+        self._client.commits += 1
+        self._writes = []
+
+
+class MemoryTransaction(MemoryWriteBatch):
+    """
+    Transaction usable with firestore.transactional
+
+    Transactions of one client run one at a time, which is the isolation
+    Firestore's locking gives concurrent transactions on the same documents.
+    """
+    _read_only = False
+    _max_attempts = 5
+
+    def __init__(self, client):
+        super().__init__(client)
+        self._id = None
+        self._deletes = []
+
+    def _clean_up(self):
+        self._writes, self._deletes = [], []
+
+    def _begin(self, retry_id=None):
+        self._client._transaction_lock.acquire()
+        self._id = next(self._client._transaction_ids)
+
+    def _end(self):
+        self._id = None
+        self._clean_up()
+        self._client._transaction_lock.release()
+
+    def delete(self, reference):
+        self._deletes.append(reference)
+
+    def _commit(self):
+        for reference, data in self._writes:
+            reference.set(data)
+        for reference in self._deletes:
+            reference.delete()
+        self._client.commits += 1
+        self._end()
+
+    def _rollback(self):
+        if self._id is not None:
+            self._end()
+
+
+class MemoryFirestoreClient:
+    """Drop-in for firestore.client() covering collection/document/query, batched write and transaction calls"""
+
+    def __init__(self):
+        self._collections = {}
+        self._transaction_lock = threading.Lock()
+        self._transaction_ids = itertools.count(1)
+        self.reads = 0
+        self.commits = 0
+
+    def collection(self, name):
+        if name not in self._collections:
+            self._collections[name] = MemoryCollectionReference(self, name)
+        return self._collections[name]
+
+    def batch(self):
+        return MemoryWriteBatch(self)
+
+    def transaction(self):
+        return MemoryTransaction(self)
+
+    def get_all(self, references):
+        return [reference.get() for reference in references]
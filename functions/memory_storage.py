@@ -0,0 +1,103 @@
+"""
+In-memory stand-in for the subset of the Cloud Storage client used by main.py
+
+Keeps objects, generations, metagenerations and custom metadata so the
+conditional writes and reference counts of image_store.py behave as they do
+against a real bucket.
+"""
+import threading
+
+from google.api_core.exceptions import NotFound, NotModified, PreconditionFailed
+
+
+class SlowBucket:
+    """
+    Storage bucket stand-in that records how many uploads overlap
+
+    Each upload waits up to `delay` seconds for another one to start, so
+    concurrent uploads overlap regardless of how long detection takes.
+    """
+
+    def __init__(self, delay=2.0):
+        self.delay = delay
+        self.objects = {}
+        self.generations = {}
+        self.metadata = {}
+        self.metagenerations = {}
+        self.signed = 0
+        self.uploads = []
+        self.in_flight = 0
+        self.peak_in_flight = 0
+        self.downloads = 0
+        self._lock = threading.Condition()
+
+    def blob(self, name):
+        return SlowBlob(self, name)
+
+    def list_blobs(self, prefix=''):
+        return [SlowBlob(self, name) for name in list(self.objects) if name.startswith(prefix)]
+
+
+class SlowBlob:
+    def __init__(self, bucket, name):
+        self.bucket = bucket
+        self.name = name
+        self.generation = None
+        self.metageneration = None
+        self.metadata = None
+        self.public_url = f"https://storage.example/{name}"
+
+    def upload_from_string(self, data, content_type=None, predefined_acl=None, retry=None, if_generation_match=None):
+        bucket = self.bucket
+        with bucket._lock:
+            bucket.in_flight += 1
+            bucket.peak_in_flight = max(bucket.peak_in_flight, bucket.in_flight)
+            bucket._lock.notify_all()
+            bucket._lock.wait_for(lambda: bucket.peak_in_flight > 1, timeout=bucket.delay)
+        with bucket._lock:
+            bucket.in_flight -= 1
+            if if_generation_match == 0 and self.name in bucket.objects:
+                raise PreconditionFailed(self.name)
+            bucket.objects[self.name] = data
+            bucket.metadata[self.name] = dict(self.metadata or {})
+            bucket.metagenerations[self.name] = self.metageneration = 1
+            bucket.uploads.append((self.name, content_type, predefined_acl, retry is not None))
+            self.generation = bucket.generations[self.name] = len(bucket.uploads)
+
+    def _check(self, if_metageneration_match):
+        if self.name not in self.bucket.objects:
+            raise NotFound(self.name)
+        if if_metageneration_match is not None and if_metageneration_match != self.bucket.metagenerations[self.name]:
+            raise PreconditionFailed(self.name)
+
+    def reload(self):
+        with self.bucket._lock:
+            self._check(None)
+            self.metadata = dict(self.bucket.metadata[self.name])
+            self.generation = self.bucket.generations[self.name]
+            self.metageneration = self.bucket.metagenerations[self.name]
+
+    def patch(self, if_metageneration_match=None):
+        with self.bucket._lock:
+            self._check(if_metageneration_match)
+            self.bucket.metadata[self.name].update(self.metadata or {})
+            self.metageneration = self.bucket.metagenerations[self.name] = self.metageneration + 1
+
+    def delete(self, if_metageneration_match=None):
+        with self.bucket._lock:
+            if if_metageneration_match is not None:
+                self._check(if_metageneration_match)
+            self.bucket.objects.pop(self.name, None)
+
+    def generate_signed_url(self, version=None, expiration=None, method='GET'):
+        self.bucket.signed += 1
+        return f"{self.public_url}?X-Goog-Signature={self.bucket.signed}"
+
+    def download_as_bytes(self, if_generation_not_match=None):
+        if self.name not in self.bucket.objects:
+            raise NotFound(self.name)
+        if if_generation_not_match == self.bucket.generations[self.name]:
+            raise NotModified(self.name)
+        self.bucket.downloads += 1
+        self.generation = self.bucket.generations[self.name]
+        return self.bucket.objects[self.name]
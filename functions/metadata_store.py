@@ -0,0 +1,1051 @@
+import base64
+import bisect
+import contextlib
+import fcntl
+import json
+import os
+import sqlite3
+import threading
+import time
+
+
+class InterProcessLock:
+    """
+    Advisory file lock that serializes threads in this process and other processes
+
+    Re-entrant within a process, so store methods can call each other while
+    holding it. The lock file is opened per acquisition so processes forked
+    from a common parent never share a lock.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._thread_lock = threading.RLock()
+        self._depth = 0
+        self._fd = None
+        self._exclusive = False
+
+    @contextlib.contextmanager
+    def hold(self, exclusive=True):
+        with self._thread_lock:
+            if self._depth == 0:
+                self._fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+                fcntl.flock(self._fd, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+                self._exclusive = exclusive
+            elif exclusive and not self._exclusive:
+                raise RuntimeError('Cannot upgrade a shared metadata lock to exclusive')
+            self._depth += 1
+            try:
+                yield
+            finally:
+                self._depth -= 1
+                if self._depth == 0:
+                    fcntl.flock(self._fd, fcntl.LOCK_UN)
+                    os.close(self._fd)
+                    self._fd = None
+
+
+def write_json_atomic(path, data):
+    """Write JSON to a temporary file and rename it into place, so readers never see a partial file"""
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'w') as f:
+        json.dump(data, f, indent=2)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+class MetadataStore:
+    """Interface for persisting target metadata entries"""
+
+    def list_entries(self):
+        """Return all entries, newest upload first"""
+        raise NotImplementedError
+
+    def list_page(self, limit, after=None):
+        """
+        Return up to `limit` entries, newest first, strictly older than a cursor
+
+        Args:
+            limit: Maximum number of entries to return
+            after: Optional (upload_time, id) key of the last entry already seen
+
+        Returns:
+            List of entries
+        """
+        entries = self.list_entries()
+        if after is not None:
+            entries = [entry for entry in entries if (entry['upload_time'], entry['id']) < tuple(after)]
+        return entries[:limit]
+
+    def get(self, image_id):
+        """Return the entry with the given id, or None"""
+        raise NotImplementedError
+
+    def get_many(self, image_ids):
+        """Return {id: entry} for the ids that exist"""
+        found = {}
+        for image_id in image_ids:
+            entry = self.get(image_id)
+            if entry is not None:
+                found[image_id] = entry
+        return found
+
+    def insert(self, entry):
+        """Add a new entry"""
+        raise NotImplementedError
+
+    def insert_many(self, entries):
+        """Add several entries"""
+        for entry in entries:
+            self.insert(entry)
+
+    def update(self, image_id, updates):
+        """Merge updates into an existing entry and return it, or None if missing"""
+        raise NotImplementedError
+
+    def delete(self, image_id):
+        """Remove an entry and return it, or None if missing"""
+        raise NotImplementedError
+
+    def version(self):
+        """Return a token that changes whenever the stored metadata changes"""
+        raise NotImplementedError
+
+    def next_version(self, version):
+        """Return the version a single write on top of `version` produces, or None if unknown"""
+        return None
+
+    def changes_since(self, version):
+        """
+        Return what changed after `version`, for caches to catch up without reloading
+
+        Returns:
+            (changed entries, deleted ids, current version), or None if the
+            store cannot tell (callers then reload everything)
+        """
+        return None
+
+    def last_modified(self):
+        """Return the time of the last change as a Unix timestamp, or None if never written"""
+        raise NotImplementedError
+
+    def write_lock(self):
+        """Context manager that keeps other writers out, for stores that need one"""
+        return contextlib.nullcontext()
+
+    def close(self):
+        """Release background resources"""
+
+
+class JSONMetadataStore(MetadataStore):
+    """
+    Metadata kept as a single JSON list, rewritten on every change
+
+    The file records no history, so a cache over it reloads everything when
+    another process writes (changes_since is not supported).
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = InterProcessLock(f"{path}.lock")
+
+    def _load(self):
+        if os.path.exists(self.path):
+            with open(self.path, 'r') as f:
+                return json.load(f)
+        return []
+
+    def _save(self, metadata):
+        write_json_atomic(self.path, metadata)
+
+    def write_lock(self):
+        return self._lock.hold()
+
+    def version(self):
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            return None
+        return (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+
+    def last_modified(self):
+        try:
+            return os.path.getmtime(self.path)
+        except FileNotFoundError:
+            return None
+
+    def list_entries(self):
+        metadata = self._load()
+        metadata.sort(key=lambda entry: entry['upload_time'], reverse=True)
+        return metadata
+
+    def get(self, image_id):
+        for entry in self._load():
+            if entry['id'] == image_id:
+                return entry
+        return None
+
+    def get_many(self, image_ids):
+        wanted = set(image_ids)
+        return {entry['id']: entry for entry in self._load() if entry['id'] in wanted}
+
+    def insert(self, entry):
+        with self._lock.hold():
+            metadata = self._load()
+            metadata.append(entry)
+            self._save(metadata)
+
+    def insert_many(self, entries):
+        with self._lock.hold():
+            metadata = self._load()
+            metadata.extend(entries)
+            self._save(metadata)
+
+    def update(self, image_id, updates):
+        with self._lock.hold():
+            metadata = self._load()
+            for entry in metadata:
+                if entry['id'] == image_id:
+                    entry.update(updates)
+                    self._save(metadata)
+                    return entry
+        return None
+
+    def delete(self, image_id):
+        with self._lock.hold():
+            metadata = self._load()
+            for i, entry in enumerate(metadata):
+                if entry['id'] == image_id:
+                    metadata.pop(i)
+                    self._save(metadata)
+                    return entry
+        return None
+
+
+class SQLiteMetadataStore(MetadataStore):
+    """
+    Metadata kept one row per target in SQLite, indexed by id and upload_time
+
+    Each row records the store version that last wrote it, and deletes leave
+    a tombstone with theirs, so changes_since is two indexed range scans.
+    Only the newest MAX_TOMBSTONES tombstones are kept; a cache older than
+    the ones dropped reloads instead.
+    """
+
+    MAX_TOMBSTONES = 10000
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        with self._connect() as conn:
+            conn.execute(
+                'CREATE TABLE IF NOT EXISTS targets ('
+                'id TEXT PRIMARY KEY, '
+                'upload_time TEXT NOT NULL, '
+                'data TEXT NOT NULL)'
+            )
+            # Composite index so history pages are a range scan in (upload_time, id) order
+            conn.execute('DROP INDEX IF EXISTS idx_targets_upload_time')
+            conn.execute('CREATE INDEX IF NOT EXISTS idx_targets_upload_time_id ON targets (upload_time, id)')
+            conn.execute('CREATE TABLE IF NOT EXISTS store_info (key TEXT PRIMARY KEY, value TEXT)')
+            conn.execute("INSERT OR IGNORE INTO store_info (key, value) VALUES ('version', 0)")
+            conn.execute("INSERT OR IGNORE INTO store_info (key, value) VALUES ('modified_at', NULL)")
+            # Changes up to this version may be missing from changes_since (dropped tombstones)
+            conn.execute("INSERT OR IGNORE INTO store_info (key, value) VALUES ('tombstone_horizon', 0)")
+            # Store version that last wrote each row, and tombstones of deleted rows
+            if 'version' not in [column[1] for column in conn.execute('PRAGMA table_info(targets)')]:
+                conn.execute('ALTER TABLE targets ADD COLUMN version INTEGER NOT NULL DEFAULT 0')
+                # Nothing earlier was recorded
+                conn.execute("UPDATE store_info SET value = (SELECT value FROM store_info WHERE key = 'version') "
+                             "WHERE key = 'tombstone_horizon'")
+            conn.execute('CREATE INDEX IF NOT EXISTS idx_targets_version ON targets (version)')
+            conn.execute('CREATE TABLE IF NOT EXISTS deleted_targets (id TEXT PRIMARY KEY, version INTEGER NOT NULL)')
+            conn.execute('CREATE INDEX IF NOT EXISTS idx_deleted_targets_version ON deleted_targets (version)')
+
+    def _connect(self):
+        # One connection per thread; sqlite3 connections are not shareable across threads
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+        return conn
+
+    def _bump_version(self, conn):
+        # Runs inside the write transaction so every committed change gets its own version
+        conn.execute("UPDATE store_info SET value = value + 1 WHERE key = 'version'")
+        conn.execute("UPDATE store_info SET value = ? WHERE key = 'modified_at'", (time.time(),))
+        return int(conn.execute("SELECT value FROM store_info WHERE key = 'version'").fetchone()[0])
+
+    def version(self):
+        row = self._connect().execute("SELECT value FROM store_info WHERE key = 'version'").fetchone()
+        return int(row[0])
+
+    def next_version(self, version):
+        return version + 1
+
+    def changes_since(self, version):
+        conn = self._connect()
+        with conn:
+            # One read transaction, so the rows, tombstones and version agree
+            conn.execute('BEGIN')
+            info = dict(conn.execute(
+                "SELECT key, value FROM store_info WHERE key IN ('version', 'tombstone_horizon')"
+            ))
+            current = int(info['version'])
+            if not int(info['tombstone_horizon']) <= version <= current:
+                return None
+            changed = [json.loads(data) for (data,) in
+                       conn.execute('SELECT data FROM targets WHERE version > ?', (version,))]
+            deleted = [image_id for (image_id,) in
+                       conn.execute('SELECT id FROM deleted_targets WHERE version > ?', (version,))]
+        return changed, deleted, current
+
+    def last_modified(self):
+        value = self.get_info('modified_at')
+        return float(value) if value is not None else None
+
+    def list_entries(self):
+        rows = self._connect().execute('SELECT data FROM targets ORDER BY upload_time DESC, id DESC')
+        return [json.loads(data) for (data,) in rows]
+
+    def list_page(self, limit, after=None):
+        if after is None:
+            rows = self._connect().execute(
+                'SELECT data FROM targets ORDER BY upload_time DESC, id DESC LIMIT ?', (limit,)
+            )
+        else:
+            rows = self._connect().execute(
+                'SELECT data FROM targets WHERE (upload_time, id) < (?, ?) '
+                'ORDER BY upload_time DESC, id DESC LIMIT ?',
+                (after[0], after[1], limit)
+            )
+        return [json.loads(data) for (data,) in rows]
+
+    def get(self, image_id):
+        row = self._connect().execute('SELECT data FROM targets WHERE id = ?', (image_id,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def get_many(self, image_ids):
+        image_ids = list(image_ids)
+        found = {}
+        # Chunked to stay under SQLite's bound parameter limit
+        for start in range(0, len(image_ids), 500):
+            chunk = image_ids[start:start + 500]
+            rows = self._connect().execute(
+                f"SELECT id, data FROM targets WHERE id IN ({', '.join('?' * len(chunk))})", chunk
+            )
+            found.update((image_id, json.loads(data)) for image_id, data in rows)
+        return found
+
+    def insert(self, entry):
+        with self._connect() as conn:
+            version = self._bump_version(conn)
+            conn.execute(
+                'INSERT INTO targets (id, upload_time, data, version) VALUES (?, ?, ?, ?)',
+                (entry['id'], entry['upload_time'], json.dumps(entry), version)
+            )
+            conn.execute('DELETE FROM deleted_targets WHERE id = ?', (entry['id'],))
+
+    def insert_many(self, entries):
+        """Add several entries in a single transaction"""
+        with self._connect() as conn:
+            version = self._bump_version(conn)
+            conn.executemany(
+                'INSERT OR REPLACE INTO targets (id, upload_time, data, version) VALUES (?, ?, ?, ?)',
+                [(entry['id'], entry['upload_time'], json.dumps(entry), version) for entry in entries]
+            )
+            conn.executemany('DELETE FROM deleted_targets WHERE id = ?', [(entry['id'],) for entry in entries])
+
+    def update(self, image_id, updates):
+        conn = self._connect()
+        with conn:
+            # Take the write lock up front so the read-merge-write is atomic
+            conn.execute('BEGIN IMMEDIATE')
+            row = conn.execute('SELECT data FROM targets WHERE id = ?', (image_id,)).fetchone()
+            if not row:
+                return None
+            entry = json.loads(row[0])
+            entry.update(updates)
+            conn.execute(
+                'UPDATE targets SET upload_time = ?, data = ?, version = ? WHERE id = ?',
+                (entry['upload_time'], json.dumps(entry), self._bump_version(conn), image_id)
+            )
+        return entry
+
+    def delete(self, image_id):
+        conn = self._connect()
+        with conn:
+            conn.execute('BEGIN IMMEDIATE')
+            row = conn.execute('SELECT data FROM targets WHERE id = ?', (image_id,)).fetchone()
+            if not row:
+                return None
+            conn.execute('DELETE FROM targets WHERE id = ?', (image_id,))
+            conn.execute('INSERT OR REPLACE INTO deleted_targets (id, version) VALUES (?, ?)',
+                         (image_id, self._bump_version(conn)))
+            self._drop_old_tombstones(conn)
+        return json.loads(row[0])
+
+    def _drop_old_tombstones(self, conn):
+        # Caches older than the dropped tombstones reload instead of catching up
+        excess = conn.execute('SELECT COUNT(*) FROM deleted_targets').fetchone()[0] - self.MAX_TOMBSTONES
+        if excess > 0:
+            horizon = conn.execute('SELECT version FROM deleted_targets ORDER BY version LIMIT 1 OFFSET ?',
+                                   (excess - 1,)).fetchone()[0]
+            conn.execute('DELETE FROM deleted_targets WHERE version <= ?', (horizon,))
+            conn.execute("UPDATE store_info SET value = ? WHERE key = 'tombstone_horizon'", (horizon,))
+
+    def get_info(self, key):
+        row = self._connect().execute('SELECT value FROM store_info WHERE key = ?', (key,)).fetchone()
+        return row[0] if row else None
+
+    def set_info(self, key, value):
+        with self._connect() as conn:
+            conn.execute('INSERT OR REPLACE INTO store_info (key, value) VALUES (?, ?)', (key, value))
+
+
+class JournaledMetadataStore(MetadataStore):
+    """
+    Metadata kept as a JSON snapshot plus an append-only journal of changes
+
+    Every write appends one JSON line to the journal, so writes cost O(1)
+    regardless of history size. A background thread periodically folds the
+    journal into a new snapshot, written to a temporary file and atomically
+    renamed over the old one. On startup the snapshot is loaded and the
+    journal replayed on top of it; a torn final line left by a crash is
+    discarded. Replayed records are idempotent, so a crash between writing
+    the snapshot and truncating the journal is harmless.
+
+    Appends and compaction hold an exclusive file lock and first replay any
+    records other processes appended, so several workers can share the files.
+    changes_since reads only the journal records after a version's offset;
+    after a compaction (a new snapshot) caches reload instead.
+
+    fsync policy:
+        'always'   - fsync after every append (no acknowledged write is lost)
+        'interval' - fsync from the background thread every compact_interval seconds
+        'never'    - leave flushing to the OS
+    """
+
+    FSYNC_POLICIES = ('always', 'interval', 'never')
+
+    def __init__(self, snapshot_path, journal_path, fsync='always', compact_interval=60):
+        if fsync not in self.FSYNC_POLICIES:
+            raise ValueError(f"Unknown fsync policy: {fsync}")
+        self.snapshot_path = snapshot_path
+        self.journal_path = journal_path
+        self.fsync = fsync
+        self.compact_interval = compact_interval
+        self._lock = InterProcessLock(f"{journal_path}.lock")
+        self._entries = {}
+        self._snapshot_id = None
+        self._offset = 0
+        self._journal = None
+        self._dirty = False
+        self._stop = threading.Event()
+
+        with self._lock.hold():
+            self._load(repair=True)
+
+        self._compactor = None
+        if compact_interval and compact_interval > 0:
+            self._compactor = threading.Thread(target=self._compact_loop, name='metadata-compactor', daemon=True)
+            self._compactor.start()
+
+    # Loading and replay
+
+    def _stat_id(self, path):
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            return None
+        return (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+
+    def _journal_size(self):
+        try:
+            return os.path.getsize(self.journal_path)
+        except FileNotFoundError:
+            return 0
+
+    def _load(self, repair=False):
+        """Load the snapshot and replay the whole journal"""
+        self._snapshot_id = self._stat_id(self.snapshot_path)
+        self._entries = {}
+        if os.path.exists(self.snapshot_path):
+            with open(self.snapshot_path, 'r') as f:
+                for entry in json.load(f):
+                    self._entries[entry['id']] = entry
+        self._offset = 0
+        self._replay(repair)
+
+    def _replay(self, repair=False):
+        """
+        Apply journal records written since the last replay
+
+        A trailing partial line is skipped; with repair (only while holding the
+        exclusive lock, when it cannot be an append in progress) it is truncated.
+        """
+        if not os.path.exists(self.journal_path):
+            return
+        with open(self.journal_path, 'rb') as f:
+            f.seek(self._offset)
+            data = f.read()
+
+        end = data.rfind(b'\n') + 1
+        for line in data[:end].splitlines():
+            if line.strip():
+                self._apply(json.loads(line))
+        self._offset += end
+
+        if repair and end < len(data):
+            # Torn final record from a crash mid-append; drop it so the next
+            # append starts on a clean line
+            print(f"Discarding {len(data) - end} bytes of incomplete journal record")
+            with open(self.journal_path, 'r+b') as f:
+                f.truncate(self._offset)
+
+    def _apply(self, record):
+        op = record['op']
+        if op == 'insert':
+            self._entries[record['entry']['id']] = dict(record['entry'])
+        elif op == 'insert_many':
+            for entry in record['entries']:
+                self._entries[entry['id']] = dict(entry)
+        elif op == 'update':
+            entry = self._entries.get(record['id'])
+            if entry is not None:
+                entry.update(record['updates'])
+        elif op == 'delete':
+            self._entries.pop(record['id'], None)
+
+    def _catch_up(self, repair=False):
+        """Pick up changes made to the files since we last looked, including by other processes"""
+        if self._stat_id(self.snapshot_path) != self._snapshot_id or self._journal_size() < self._offset:
+            self._load(repair)
+        elif self._journal_size() > self._offset:
+            self._replay(repair)
+
+    # Writing
+
+    def _append(self, record):
+        if self._journal is None:
+            self._journal = open(self.journal_path, 'ab')
+        line = json.dumps(record).encode('utf-8') + b'\n'
+        self._journal.write(line)
+        self._journal.flush()
+        if self.fsync == 'always':
+            os.fsync(self._journal.fileno())
+        else:
+            self._dirty = True
+        self._offset += len(line)
+        self._apply(record)
+
+    def _write_snapshot(self):
+        write_json_atomic(self.snapshot_path, list(self._entries.values()))
+        self._snapshot_id = self._stat_id(self.snapshot_path)
+
+    def compact(self):
+        """Fold the journal into a fresh snapshot and truncate the journal"""
+        with self._lock.hold():
+            self._catch_up(repair=True)
+            if self._offset == 0:
+                return False
+            self._write_snapshot()
+            if self._journal is not None:
+                self._journal.close()
+                self._journal = None
+            with open(self.journal_path, 'wb') as f:
+                os.fsync(f.fileno())
+            self._offset = 0
+            self._dirty = False
+            return True
+
+    def _compact_loop(self):
+        while not self._stop.wait(self.compact_interval):
+            try:
+                with self._lock.hold():
+                    if self._dirty and self._journal is not None:
+                        os.fsync(self._journal.fileno())
+                        self._dirty = False
+                self.compact()
+            except Exception as e:
+                print(f"Error compacting metadata journal: {e}")
+
+    def close(self):
+        """Stop the compactor and flush the journal"""
+        self._stop.set()
+        if self._compactor is not None:
+            self._compactor.join()
+        with self._lock.hold():
+            if self._journal is not None:
+                self._journal.flush()
+                os.fsync(self._journal.fileno())
+                self._journal.close()
+                self._journal = None
+
+    # MetadataStore interface
+
+    def list_entries(self):
+        with self._lock.hold(exclusive=False):
+            self._catch_up()
+            entries = [dict(entry) for entry in self._entries.values()]
+        entries.sort(key=lambda entry: entry['upload_time'], reverse=True)
+        return entries
+
+    def get(self, image_id):
+        with self._lock.hold(exclusive=False):
+            self._catch_up()
+            entry = self._entries.get(image_id)
+            return dict(entry) if entry else None
+
+    def insert(self, entry):
+        with self._lock.hold():
+            self._catch_up(repair=True)
+            self._append({'op': 'insert', 'entry': entry})
+
+    def insert_many(self, entries):
+        """Add several entries as one journal record, so a crash keeps all or none of them"""
+        with self._lock.hold():
+            self._catch_up(repair=True)
+            self._append({'op': 'insert_many', 'entries': entries})
+
+    def update(self, image_id, updates):
+        with self._lock.hold():
+            self._catch_up(repair=True)
+            if image_id not in self._entries:
+                return None
+            self._append({'op': 'update', 'id': image_id, 'updates': updates})
+            return dict(self._entries[image_id])
+
+    def delete(self, image_id):
+        with self._lock.hold():
+            self._catch_up(repair=True)
+            entry = self._entries.get(image_id)
+            if entry is None:
+                return None
+            self._append({'op': 'delete', 'id': image_id})
+            return entry
+
+    def write_lock(self):
+        return self._lock.hold()
+
+    def version(self):
+        return (self._stat_id(self.snapshot_path), self._journal_size())
+
+    def changes_since(self, version):
+        with self._lock.hold(exclusive=False):
+            snapshot_id, offset = version
+            if snapshot_id != self._stat_id(self.snapshot_path) or offset > self._journal_size():
+                return None
+            self._catch_up()
+            if snapshot_id != self._snapshot_id or offset > self._offset:
+                return None
+            # Only the ids are needed from the records; the entries are already applied
+            with open(self.journal_path, 'rb') as f:
+                f.seek(offset)
+                data = f.read(self._offset - offset)
+            ids = set()
+            for line in data.splitlines():
+                if line.strip():
+                    record = json.loads(line)
+                    if record['op'] == 'insert':
+                        ids.add(record['entry']['id'])
+                    elif record['op'] == 'insert_many':
+                        ids.update(entry['id'] for entry in record['entries'])
+                    else:
+                        ids.add(record['id'])
+            changed = [dict(self._entries[image_id]) for image_id in ids if image_id in self._entries]
+            deleted = [image_id for image_id in ids if image_id not in self._entries]
+            return changed, deleted, (self._snapshot_id, self._offset)
+
+    def last_modified(self):
+        times = [os.path.getmtime(path) for path in (self.snapshot_path, self.journal_path) if os.path.exists(path)]
+        return max(times) if times else None
+
+
+class CachedMetadataStore(MetadataStore):
+    """
+    In-memory index over another store, keyed by id and sorted by upload_time
+
+    The index is loaded once per worker. When the underlying store's version
+    changes (another process wrote to it), only the changes are applied, for
+    stores that can list them (SQLite, the journal); over the JSON file the
+    index is reloaded. Writes made through this wrapper are applied to the
+    index in place.
+    """
+
+    def __init__(self, store):
+        self.store = store
+        self._lock = threading.Lock()
+        self._version = None
+        self._loaded = False
+        self._by_id = {}
+        self._order = []  # (upload_time, id) keys, oldest first
+
+    def _reload(self):
+        self._version = self.store.version()
+        entries = self.store.list_entries()
+        self._by_id = {entry['id']: entry for entry in entries}
+        self._order = sorted((entry['upload_time'], entry['id']) for entry in entries)
+        self._loaded = True
+
+    def _catch_up(self, since):
+        """Apply the store's changes after version `since`, or reload if it cannot list them"""
+        changes = self.store.changes_since(since)
+        if changes is None:
+            self._reload()
+            return
+        changed, deleted, self._version = changes
+        for entry in changed:
+            if entry['id'] in self._by_id:
+                self._unindex(self._by_id[entry['id']])
+            self._index(entry)
+        for image_id in deleted:
+            if image_id in self._by_id:
+                self._unindex(self._by_id[image_id])
+
+    def _refresh(self):
+        """Bring the index up to date if the underlying store changed; returns the current version"""
+        if not self._loaded:
+            self._reload()
+        elif self.store.version() != self._version:
+            self._catch_up(self._version)
+        return self._version
+
+    def _written(self, before):
+        """
+        Record the store version after a write, catching up if someone else wrote too
+
+        Called with the store's write lock held, so for stores without a
+        predictable next version no other writer can have slipped in.
+        """
+        after = self.store.version()
+        expected = self.store.next_version(before)
+        if expected is not None and after != expected:
+            self._catch_up(before)
+        else:
+            self._version = after
+
+    def _index(self, entry):
+        self._by_id[entry['id']] = entry
+        bisect.insort(self._order, (entry['upload_time'], entry['id']))
+
+    def _unindex(self, entry):
+        key = (entry['upload_time'], entry['id'])
+        i = bisect.bisect_left(self._order, key)
+        if i < len(self._order) and self._order[i] == key:
+            self._order.pop(i)
+        self._by_id.pop(entry['id'], None)
+
+    def list_entries(self):
+        """Return all entries, newest first; the returned dicts must be treated as read-only"""
+        with self._lock:
+            self._refresh()
+            return [self._by_id[image_id] for _, image_id in reversed(self._order)]
+
+    def list_page(self, limit, after=None):
+        with self._lock:
+            self._refresh()
+            # _order is oldest first, so the page is the `limit` keys just below the cursor
+            end = bisect.bisect_left(self._order, tuple(after)) if after is not None else len(self._order)
+            start = max(0, end - limit)
+            return [self._by_id[image_id] for _, image_id in reversed(self._order[start:end])]
+
+    def get(self, image_id):
+        with self._lock:
+            self._refresh()
+            entry = self._by_id.get(image_id)
+            return dict(entry) if entry else None
+
+    def get_many(self, image_ids):
+        with self._lock:
+            self._refresh()
+            return {image_id: dict(self._by_id[image_id]) for image_id in image_ids if image_id in self._by_id}
+
+    def insert(self, entry):
+        with self._lock, self.store.write_lock():
+            before = self._refresh()
+            self.store.insert(entry)
+            self._index(dict(entry))
+            self._written(before)
+
+    def insert_many(self, entries):
+        with self._lock, self.store.write_lock():
+            before = self._refresh()
+            self.store.insert_many(entries)
+            for entry in entries:
+                if entry['id'] in self._by_id:
+                    self._unindex(self._by_id[entry['id']])
+                self._index(dict(entry))
+            self._written(before)
+
+    def update(self, image_id, updates):
+        with self._lock, self.store.write_lock():
+            before = self._refresh()
+            entry = self.store.update(image_id, updates)
+            if entry is not None:
+                if image_id in self._by_id:
+                    self._unindex(self._by_id[image_id])
+                self._index(dict(entry))
+                self._written(before)
+            return entry
+
+    def delete(self, image_id):
+        with self._lock, self.store.write_lock():
+            before = self._refresh()
+            entry = self.store.delete(image_id)
+            if entry is not None:
+                self._unindex(entry)
+                self._written(before)
+            return entry
+
+    def version(self):
+        with self._lock:
+            return self._refresh()
+
+    def last_modified(self):
+        return self.store.last_modified()
+
+    def close(self):
+        self.store.close()
+
+
+class MemoryMetadataStore(MetadataStore):
+    """Metadata kept in a dict, for tests and local load tests"""
+
+    def __init__(self):
+        self._entries = {}
+        self._lock = threading.Lock()
+        self._version = 0
+        self._modified_at = None
+
+    def _written(self):
+        self._version += 1
+        self._modified_at = time.time()
+
+    def list_entries(self):
+        with self._lock:
+            entries = sorted(self._entries.values(), key=lambda entry: (entry['upload_time'], entry['id']), reverse=True)
+            return [dict(entry) for entry in entries]
+
+    def get(self, image_id):
+        with self._lock:
+            entry = self._entries.get(image_id)
+            return dict(entry) if entry else None
+
+    def get_many(self, image_ids):
+        with self._lock:
+            return {image_id: dict(self._entries[image_id]) for image_id in image_ids if image_id in self._entries}
+
+    def insert(self, entry):
+        self.insert_many([entry])
+
+    def insert_many(self, entries):
+        with self._lock:
+            for entry in entries:
+                self._entries[entry['id']] = dict(entry)
+            self._written()
+
+    def update(self, image_id, updates):
+        with self._lock:
+            entry = self._entries.get(image_id)
+            if entry is None:
+                return None
+            entry.update(updates)
+            self._written()
+            return dict(entry)
+
+    def delete(self, image_id):
+        with self._lock:
+            entry = self._entries.pop(image_id, None)
+            if entry is not None:
+                self._written()
+            return entry
+
+    def version(self):
+        return self._version
+
+    def next_version(self, version):
+        return version + 1
+
+    def last_modified(self):
+        return self._modified_at
+
+
+class FirestoreMetadataStore(MetadataStore):
+    """
+    Metadata kept one document per target in a Firestore collection
+
+    History pages are indexed queries on (upload_time, document id), so each
+    page reads at most `limit` documents. Firestore keeps no store-wide
+    version, so version() and last_modified() are None, and update() does
+    not read the document back (that would cost another read). delete()
+    reads it in a transaction, so of several racing deletes exactly one gets
+    the entry back.
+    """
+    BATCH_SIZE = 500  # Most writes Firestore accepts in one batch
+
+    def __init__(self, get_client, collection='targets'):
+        """
+        Args:
+            get_client: Callable returning the Firestore client (so it can be created lazily)
+            collection: Collection holding one document per target
+        """
+        self.get_client = get_client
+        self.collection = collection
+
+    def _collection(self):
+        return self.get_client().collection(self.collection)
+
+    def list_entries(self):
+        return self.list_page(None)
+
+    def list_page(self, limit, after=None, fields=None):
+        """As MetadataStore.list_page; fields optionally limits the fields read (a projection)"""
+        query = (self._collection()
+                 .order_by('upload_time', direction='DESCENDING')
+                 .order_by('__name__', direction='DESCENDING'))
+        if after is not None:
+            query = query.start_after({'upload_time': after[0], '__name__': after[1]})
+        if fields:
+            # upload_time is always needed to build the next cursor
+            query = query.select(sorted(set(fields) | {'upload_time'}))
+        if limit is not None:
+            query = query.limit(limit)
+
+        entries = []
+        for doc in query.stream():
+            data = doc.to_dict()
+            data['id'] = doc.id
+            entries.append(data)
+        return entries
+
+    def get(self, image_id):
+        doc = self._collection().document(image_id).get()
+        return doc.to_dict() if doc.exists else None
+
+    def get_many(self, image_ids):
+        """Read all the documents in one round trip"""
+        collection = self._collection()
+        references = [collection.document(image_id) for image_id in image_ids]
+        if not references:
+            return {}
+        return {doc.id: doc.to_dict() for doc in self.get_client().get_all(references) if doc.exists}
+
+    def insert(self, entry):
+        self._collection().document(entry['id']).set(entry)
+
+    def insert_many(self, entries):
+        """Add several entries in batched writes"""
+        client = self.get_client()
+        collection = client.collection(self.collection)
+        for start in range(0, len(entries), self.BATCH_SIZE):
+            batch = client.batch()
+            for entry in entries[start:start + self.BATCH_SIZE]:
+                batch.set(collection.document(entry['id']), entry)
+            batch.commit()
+
+    def update(self, image_id, updates):
+        """Merge updates into an existing entry; returns the id and updates, or None if missing"""
+        from google.api_core.exceptions import NotFound
+        try:
+            self._collection().document(image_id).update(updates)
+        except NotFound:
+            return None
+        return {'id': image_id, **updates}
+
+    def delete(self, image_id):
+        from google.cloud import firestore
+
+        client = self.get_client()
+        reference = client.collection(self.collection).document(image_id)
+
+        @firestore.transactional
+        def remove(transaction):
+            snapshot = reference.get(transaction=transaction)
+            if not snapshot.exists:
+                return None
+            transaction.delete(reference)
+            return snapshot.to_dict()
+
+        return remove(client.transaction())
+
+    def version(self):
+        return None
+
+    def last_modified(self):
+        return None
+
+
+def encode_cursor(entry):
+    """Encode an entry's (upload_time, id) sort key as an opaque pagination cursor"""
+    raw = json.dumps([entry['upload_time'], entry['id']]).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor):
+    """Decode a pagination cursor back to an (upload_time, id) key; raises ValueError if malformed"""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        upload_time, image_id = json.loads(raw)
+    except Exception:
+        raise ValueError(f"Invalid cursor: {cursor}")
+    return (str(upload_time), str(image_id))
+
+
+def import_json_metadata(json_path, store):
+    """
+    One-time import of an existing metadata.json into a SQLite store
+
+    Args:
+        json_path: Path to the legacy metadata.json file
+        store: SQLiteMetadataStore to import into
+
+    Returns:
+        Number of entries imported (0 if the file was already imported or missing)
+    """
+    source = os.path.abspath(json_path)
+    if store.get_info('imported_from') == source or not os.path.exists(json_path):
+        return 0
+
+    with open(json_path, 'r') as f:
+        metadata = json.load(f)
+
+    store.insert_many(metadata)
+    store.set_info('imported_from', source)
+    return len(metadata)
+
+
+def create_metadata_store(backend, json_path, db_path, cache=True, journal_path=None,
+                          fsync='always', compact_interval=60):
+    """Create the configured metadata store, importing legacy JSON metadata on first use"""
+    if backend == 'json':
+        store = JSONMetadataStore(json_path)
+    elif backend == 'journal':
+        # The snapshot is the legacy metadata.json, so existing history needs no import
+        store = JournaledMetadataStore(json_path, journal_path or f"{json_path}.journal",
+                                       fsync=fsync, compact_interval=compact_interval)
+    elif backend == 'memory':
+        return MemoryMetadataStore()
+    elif backend == 'sqlite':
+        store = SQLiteMetadataStore(db_path)
+        imported = import_json_metadata(json_path, store)
+        if imported:
+            print(f"Imported {imported} entries from {json_path} into {db_path}")
+    else:
+        raise ValueError(f"Unknown metadata backend: {backend}")
+
+    return CachedMetadataStore(store) if cache else store
+
+
+if __name__ == '__main__':
+    import sys
+
+    if len(sys.argv) != 3:
+        print("Usage: python metadata_store.py <metadata.json> <metadata.db>")
+        sys.exit(1)
+
+    count = import_json_metadata(sys.argv[1], SQLiteMetadataStore(sys.argv[2]))
+    print(f"Imported {count} entries")
@@ -0,0 +1,261 @@
+"""
+Process-local metrics in the Prometheus text format
+
+Recording happens on every request and inside detection, so it must never
+become a contention point. Each thread records into its own shard, a plain
+dict that only that thread writes, so counters and histograms are updated
+without any lock. A scrape sums the shards, and folds the shards of
+threads that have exited into a retired total, so short-lived request
+threads do not pile up. Values a component already tracks (cache hit
+counts, queue depth, admission state) are read by callbacks at scrape
+time instead of being recorded.
+
+This module is shared by the Flask backend and the Cloud Function.
+"""
+import bisect
+import threading
+import time
+from contextlib import contextmanager
+
+# Latency buckets in seconds
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format_labels(names, values, extra=()):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    pairs.extend(f'{name}="{_escape(value)}"' for name, value in extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    def __init__(self, registry, name, help_text, labels):
+        self.registry = registry
+        self.name = name
+        self.help = help_text
+        self.labels = labels
+
+    def inc(self, *label_values, amount=1):
+        shard = self.registry._shard()
+        key = (self.name, label_values)
+        shard[key] = shard.get(key, 0) + amount
+
+    def _render(self, totals):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        for label_values, value in sorted(totals.get(self.name, {}).items()):
+            lines.append(f"{self.name}{_format_labels(self.labels, label_values)} {_format_value(value)}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, registry, name, help_text, labels, buckets):
+        self.registry = registry
+        self.name = name
+        self.help = help_text
+        self.labels = labels
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, *label_values):
+        shard = self.registry._shard()
+        key = (self.name, label_values)
+        counts = shard.get(key)
+        if counts is None:
+            # One slot per bucket plus +Inf, then the sum
+            counts = shard[key] = [0] * (len(self.buckets) + 2)
+        counts[bisect.bisect_left(self.buckets, value)] += 1
+        counts[-1] += value
+
+    @contextmanager
+    def time(self, *label_values):
+        """Observe the duration of the with-block in seconds"""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, *label_values)
+
+    def _render(self, totals):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        for label_values, counts in sorted(totals.get(self.name, {}).items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += count
+                labels = _format_labels(self.labels, label_values, [('le', _format_value(float(bound)))])
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = _format_labels(self.labels, label_values)
+            lines.append(f"{self.name}_sum{labels} {_format_value(counts[-1])}")
+            lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+
+class Callback:
+    """Gauge or counter whose values are read from a callable at scrape time"""
+
+    def __init__(self, name, help_text, kind, function, labels):
+        self.name = name
+        self.help = help_text
+        self.kind = kind
+        self.function = function
+        self.labels = labels
+
+    def _render(self, totals):
+        try:
+            values = self.function()
+        except Exception:
+            return []
+        if values is None:
+            return []
+        if not isinstance(values, dict):
+            values = {(): values}
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        for label_values, value in sorted(values.items()):
+            if not isinstance(label_values, tuple):
+                label_values = (label_values,)
+            lines.append(f"{self.name}{_format_labels(self.labels, label_values)} {_format_value(value)}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = {}
+        self._local = threading.local()
+        self._shards = []  # (thread, shard)
+        self._retired = {}
+        # Taken when a thread records for the first time and by scrapes, never per sample
+        self._lock = threading.Lock()
+
+    def _shard(self):
+        try:
+            return self._local.shard
+        except AttributeError:
+            shard = {}
+            with self._lock:
+                # Fold exited threads in here too, so the list stays bounded without scrapes
+                self._retire_dead_shards()
+                self._shards.append((threading.current_thread(), shard))
+            self._local.shard = shard
+            return shard
+
+    def _register(self, metric):
+        # Modules may be reloaded (e.g. by tests); keep the first definition
+        return self._metrics.setdefault(metric.name, metric)
+
+    def counter(self, name, help_text, labels=()):
+        return self._register(Counter(self, name, help_text, tuple(labels)))
+
+    def histogram(self, name, help_text, labels=(), buckets=DEFAULT_BUCKETS):
+        return self._register(Histogram(self, name, help_text, tuple(labels), buckets))
+
+    def gauge_callback(self, name, help_text, function, labels=()):
+        """function returns a number, or {label values: number}; None or an exception skips the metric"""
+        self._metrics[name] = Callback(name, help_text, 'gauge', function, tuple(labels))
+
+    def counter_callback(self, name, help_text, function, labels=()):
+        self._metrics[name] = Callback(name, help_text, 'counter', function, tuple(labels))
+
+    @staticmethod
+    def _merge(totals, shard):
+        # dict() and list() copies are atomic under the GIL, so a live shard can be read while its thread writes
+        for (name, label_values), value in dict(shard).items():
+            series = totals.setdefault(name, {})
+            if isinstance(value, list):
+                value = list(value)
+                current = series.get(label_values)
+                series[label_values] = value if current is None else [a + b for a, b in zip(current, value)]
+            else:
+                series[label_values] = series.get(label_values, 0) + value
+
+    def _retire_dead_shards(self):
+        # Called with _lock held
+        live = []
+        for thread, shard in self._shards:
+            if thread.is_alive():
+                live.append((thread, shard))
+            else:
+                # Nobody writes this shard any more
+                self._merge(self._retired, shard)
+        self._shards = live
+
+    def collect(self):
+        """{metric name: {label values: value}} summed over all threads"""
+        with self._lock:
+            self._retire_dead_shards()
+            totals = {}
+            for name, series in self._retired.items():
+                totals[name] = {key: list(value) if isinstance(value, list) else value for key, value in series.items()}
+            for _, shard in self._shards:
+                self._merge(totals, shard)
+        return totals
+
+    def render(self):
+        """All metrics in the Prometheus text exposition format"""
+        totals = self.collect()
+        lines = []
+        for metric in list(self._metrics.values()):
+            lines.extend(metric._render(totals))
+        return '\n'.join(lines) + '\n'
+
+
+def peak_rss_bytes():
+    """High-water mark of this process's resident memory"""
+    import resource
+    import sys
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Reported in kilobytes on Linux, bytes on macOS
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+REGISTRY = Registry()
+
+HTTP_REQUESTS = REGISTRY.counter(
+    'photomoa_http_requests_total', 'HTTP requests by route, method and status', ('route', 'method', 'status'))
+HTTP_REQUEST_SECONDS = REGISTRY.histogram(
+    'photomoa_http_request_duration_seconds', 'Time to produce a response, by route', ('route',))
+UPLOAD_STAGE_SECONDS = REGISTRY.histogram(
+    'photomoa_upload_stage_seconds',
+    'Time spent in each upload stage (probe, admission_wait, decode, detect, scale, moa, encode, store_original)',
+    ('stage',))
+DETECTION_STAGE_SECONDS = REGISTRY.histogram(
+    'photomoa_detection_stage_seconds', 'Time spent in each shot detection method', ('stage',))
+UPLOAD_BYTES = REGISTRY.histogram(
+    'photomoa_upload_bytes', 'Size of uploaded images',
+    buckets=(64e3, 256e3, 1e6, 2e6, 4e6, 8e6, 16e6, 32e6, 64e6))
+UPLOAD_MEGAPIXELS = REGISTRY.histogram(
+    'photomoa_upload_megapixels', 'Dimensions of uploaded images in megapixels',
+    buckets=(0.5, 1, 2, 4, 8, 12, 16, 24, 32, 50))
+
+
+def register_admission(get_admission):
+    """Expose the queue depth and memory estimate of the AdmissionController get_admission() returns"""
+    REGISTRY.gauge_callback('photomoa_detections_in_flight', 'Detections running now',
+                            lambda: get_admission().in_flight)
+    REGISTRY.gauge_callback('photomoa_detections_waiting', 'Uploads waiting for detection capacity',
+                            lambda: get_admission().waiting)
+    REGISTRY.gauge_callback('photomoa_detection_memory_bytes', 'Estimated memory of running detections',
+                            lambda: get_admission().memory_bytes)
+    REGISTRY.gauge_callback('photomoa_detection_memory_peak_bytes', 'High-water mark of estimated detection memory',
+                            lambda: get_admission().peak_memory_bytes)
+    REGISTRY.counter_callback('photomoa_admission_rejected_total', 'Uploads turned away for lack of capacity',
+                              lambda: get_admission().rejected)
+
+
+def register_cache(name, get_cache):
+    """Expose the hits and misses of the cache get_cache() returns (skipped while it returns None)"""
+    for outcome in ('hits', 'misses'):
+        REGISTRY.counter_callback(
+            f"photomoa_{name}_cache_{outcome}_total", f"{name.replace('_', ' ').capitalize()} cache {outcome}",
+            lambda outcome=outcome: getattr(get_cache(), outcome))
+
+
+REGISTRY.gauge_callback('photomoa_process_peak_rss_bytes', 'High-water mark of resident memory', peak_rss_bytes)
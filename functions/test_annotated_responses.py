@@ -0,0 +1,63 @@
+import base64
+import io
+
+import main
+from memory_storage import SlowBucket
+from upload_testing import call, target_image, use_bucket
+
+
+def test_annotated_image_encoded_once():
+    bucket = SlowBucket(delay=0)
+    use_bucket(bucket)
+    response, status, _ = call(main.handle_upload, '/upload', method='POST',
+                               data={'image': (io.BytesIO(target_image()), 'target.jpg', 'image/jpeg')})
+    assert status == 200
+
+    # The stored and returned annotated bytes are the same encode
+    result = response.get_json()
+    prefix = 'data:image/jpeg;base64,'
+    metadata = main.db.collection('targets').document(result['id']).get().to_dict()
+    stored = bucket.objects[f"uploads/{metadata['annotated_filename']}"]
+    assert base64.b64decode(result['annotated_image'][len(prefix):]) == stored
+    print("✓ Annotated image encoded once")
+
+
+def test_url_mode_and_render_on_read():
+    bucket = SlowBucket(delay=0)
+    use_bucket(bucket)
+
+    response, status, _ = call(main.handle_upload, '/upload?response=url', method='POST',
+                               data={'image': (io.BytesIO(target_image()), 'target.jpg', 'image/jpeg')})
+    result = response.get_json()
+    assert status == 200 and 'annotated_image' not in result
+    image_id = result['id']
+
+    # Until the first edit the URL is versioned by the hash of the uploaded annotation
+    metadata = main.db.collection('targets').document(image_id).get().to_dict()
+    assert result['annotated_url'] == f"http://localhost/annotated/{image_id}?v={metadata['annotated_hash'][:16]}"
+    served = call(main.handle_get_annotated, '/annotated/' + image_id, image_id)
+    assert served.data == bucket.objects[f"uploads/{metadata['annotated_filename']}"]
+
+    # Edits are metadata writes only: nothing is uploaded or rendered
+    uploads = len(bucket.uploads)
+    response, status, _ = call(main.handle_update_shots, f"/update-shots/{image_id}?response=url", image_id,
+                               method='POST', json={'manual_shots': [[300, 300]]})
+    assert status == 200
+    call(main.handle_calibrate, f"/calibrate/{image_id}?response=url", image_id,
+         method='POST', json={'point1': [0, 0], 'point2': [0, 50]})
+    assert len(bucket.uploads) == uploads and main.render_cache.misses == 0
+
+    # The image is rendered when fetched, once, and revalidation never renders
+    url = response.get_json()['annotated_url'].replace('http://localhost', '')
+    first = call(main.handle_get_annotated, url, image_id)
+    assert first.status_code == 200 and first.mimetype == 'image/jpeg'
+    etag = first.headers['ETag']
+    assert call(main.handle_get_annotated, url, image_id, headers={'If-None-Match': etag}).status_code == 304
+    assert call(main.handle_get_annotated, url, image_id).data == first.data
+    assert main.render_cache.misses == 1 and main.render_cache.hits == 1
+    print("✓ URL response mode and render-on-read")
+
+
+if __name__ == "__main__":
+    test_annotated_image_encoded_once()
+    test_url_mode_and_render_on_read()
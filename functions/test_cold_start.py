@@ -0,0 +1,18 @@
+from bench_imports import history_image_modules, loaded_heavy_modules
+
+
+def test_import_main_stays_light():
+    # /health and /history cold starts must not pay for OpenCV, SciPy or the Firestore client
+    assert loaded_heavy_modules() == []
+    print("✓ import main loads no heavy modules")
+
+
+def test_history_stays_light():
+    # Versioning thumbnails of an edited, uncalibrated entry must not construct the MOA calculator
+    assert history_image_modules() == []
+    print("✓ /history loads no image libraries")
+
+
+if __name__ == "__main__":
+    test_import_main_stays_light()
+    test_history_stays_light()
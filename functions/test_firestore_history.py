@@ -0,0 +1,103 @@
+import threading
+
+from flask import Flask
+
+import main
+from memory_firestore import MemoryFirestoreClient
+
+app = Flask(__name__)
+
+
+def use_memory_firestore(count):
+    """Swap the Firestore client for an in-memory one seeded with `count` targets"""
+    db = MemoryFirestoreClient()
+    for i in range(count):
+        db.collection('targets').document(f"20250101_1200{i:02d}").set({
+            'filename': f"target_{i}.jpg",
+            'annotated_filename': f"annotated_target_{i}.jpg",
+            'upload_time': f"2025-01-01T12:00:{i:02d}",
+            'shot_count': 1,
+            'moa_value': None,
+            'shots': [[i, i]]
+        })
+    main.db, main.bucket = db, object()
+    return db
+
+
+def get_history(query_string):
+    with app.test_request_context(f"/history?{query_string}"):
+        from flask import request
+        response, status, headers = main.handle_history(request, {})
+        return response.get_json(), status, headers
+
+
+def test_history_pages_read_only_what_they_return():
+    db = use_memory_firestore(7)
+
+    seen = []
+    cursor = None
+    while True:
+        reads_before = db.reads
+        page, status, headers = get_history(f"limit=3&exclude=shots{'&after=' + cursor if cursor else ''}")
+        assert status == 200
+        # At most one extra document is read to detect the next page
+        assert db.reads - reads_before <= 4
+        assert all('shots' not in entry for entry in page)
+        seen.extend(entry['id'] for entry in page)
+        cursor = headers.get('X-Next-Cursor')
+        if not cursor:
+            break
+
+    assert seen == [f"20250101_1200{i:02d}" for i in reversed(range(7))]
+    print("✓ Firestore history pagination")
+
+
+def test_history_projection_and_validation():
+    use_memory_firestore(2)
+    page, status, _ = get_history("limit=1&fields=moa_value")
+    assert status == 200
+    assert page == [{'id': '20250101_120001', 'moa_value': None}]
+
+    assert get_history("limit=0")[1] == 400
+    assert get_history("after=bogus")[1] == 400
+    print("✓ Firestore history projection")
+
+
+def test_get_metadata_reads_one_document():
+    db = use_memory_firestore(5)
+    reads_before = db.reads
+    assert main.get_metadata('20250101_120003')['filename'] == 'target_3.jpg'
+    assert main.get_metadata('missing') is None
+    assert db.reads - reads_before == 2
+    print("✓ Single-entry lookups by document id")
+
+
+def test_metadata_store_batches():
+    db = use_memory_firestore(5)
+    store = main.get_metadata_store()
+    found = store.get_many(['20250101_120001', '20250101_120004', 'missing'])
+    assert sorted(found) == ['20250101_120001', '20250101_120004']
+    assert store.update('missing', {'shot_count': 2}) is None
+
+    commits = db.commits
+    store.insert_many([{'id': f"new_{i}", 'upload_time': f"2025-02-01T00:00:{i:02d}"} for i in range(3)])
+    assert db.commits == commits + 1
+    assert [entry['id'] for entry in store.list_page(2)] == ['new_2', 'new_1']
+
+    # Deletes run in a transaction, so only one of several racing deletes gets the entry
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(store.delete('new_0'))) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert [result['upload_time'] for result in results if result is not None] == ['2025-02-01T00:00:00']
+    assert store.get('new_0') is None and store.delete('new_0') is None
+    print("✓ Batched Firestore metadata reads and writes")
+
+
+if __name__ == "__main__":
+    test_history_pages_read_only_what_they_return()
+    test_history_projection_and_validation()
+    test_get_metadata_reads_one_document()
+    test_metadata_store_batches()
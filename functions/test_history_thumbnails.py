@@ -0,0 +1,35 @@
+import io
+
+import main
+from memory_storage import SlowBucket
+from upload_testing import call, target_image, use_bucket
+
+
+def test_history_thumbnails():
+    bucket = SlowBucket(delay=0)
+    use_bucket(bucket)
+    response, _, _ = call(main.handle_upload, '/upload', method='POST',
+                          data={'image': (io.BytesIO(target_image()), 'target.jpg', 'image/jpeg')})
+    image_id = response.get_json()['id']
+    uploaded = sorted(name for name in bucket.objects if '/derivatives/' in name)
+    assert len(uploaded) == 2
+
+    thumbnails = call(main.handle_history, '/history?limit=1')[0].get_json()[0]['thumbnails']
+    small = thumbnails['small'].replace('http://localhost', '')
+    served = call(main.handle_get_thumbnail, small, image_id, 'small')
+    assert served.mimetype == 'image/webp' and 'immutable' in served.headers['Cache-Control']
+    assert served.data == bucket.objects[uploaded[1]]
+
+    # After an edit the thumbnail is generated on request and older versions are removed
+    call(main.handle_update_shots, f"/update-shots/{image_id}?response=url", image_id,
+         method='POST', json={'manual_shots': [[300, 300]]})
+    edited = call(main.handle_history, '/history?limit=1')[0].get_json()[0]['thumbnails']['medium']
+    assert edited != thumbnails['medium']
+    assert call(main.handle_get_thumbnail, edited.replace('http://localhost', ''), image_id, 'medium').status_code == 200
+    current = sorted(name for name in bucket.objects if '/derivatives/' in name)
+    assert len(current) == 2 and not set(current) & set(uploaded)
+    print("✓ History thumbnails")
+
+
+if __name__ == "__main__":
+    test_history_thumbnails()
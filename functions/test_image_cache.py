@@ -0,0 +1,83 @@
+import tempfile
+
+import cv2
+import numpy as np
+from google.api_core.exceptions import NotFound, NotModified
+
+from image_cache import CachedImage, ImageCache
+
+
+class FakeBlob:
+    """Stands in for a Storage blob and counts downloads"""
+
+    def __init__(self, name, data, generation=1):
+        self.name = name
+        self.data = data
+        self.generation = generation
+        self.stored_generation = generation
+        self.downloads = 0
+
+    def download_as_bytes(self, if_generation_not_match=None):
+        if self.data is None:
+            raise NotFound('missing')
+        if if_generation_not_match == self.stored_generation:
+            raise NotModified('unchanged')
+        self.downloads += 1
+        self.generation = self.stored_generation
+        return self.data
+
+
+def encoded_image(width=64, height=48):
+    image = np.full((height, width, 3), 255, np.uint8)
+    cv2.circle(image, (width // 2, height // 2), 5, (0, 0, 0), -1)
+    return cv2.imencode('.png', image)[1].tobytes()
+
+
+def test_repeated_edits_skip_download_and_decode():
+    with tempfile.TemporaryDirectory() as tmp:
+        cache = ImageCache(disk_dir=tmp)
+        blob = FakeBlob('uploads/target.png', encoded_image())
+
+        first = cache.get(blob, expected_generation=1)
+        second = cache.get(blob, expected_generation=1)
+        assert blob.downloads == 1
+        assert second is first and second.image.shape == (48, 64, 3)
+        assert not second.image.flags.writeable
+
+        # Without a recorded generation the copy is revalidated with a conditional request
+        cache.get(blob)
+        assert blob.downloads == 1
+
+        # A new generation is picked up
+        blob.stored_generation = 2
+        assert cache.get(blob, expected_generation=2).generation == 2
+        assert blob.downloads == 2
+
+        assert cache.get(FakeBlob('uploads/missing.png', None)) is None
+    print("✓ Image cache hits, revalidation and generation changes")
+
+
+def test_disk_tier_and_eviction():
+    with tempfile.TemporaryDirectory() as tmp:
+        data = encoded_image()
+        cache = ImageCache(max_memory_bytes=1, disk_dir=tmp)
+        a, b = FakeBlob('uploads/a.png', data), FakeBlob('uploads/b.png', data)
+        cache.get(a, expected_generation=1)
+        cache.get(b, expected_generation=1)
+
+        # 'a' was evicted from memory but is still on disk, so no new download
+        assert list(cache._entries) == ['uploads/b.png']
+        assert cache.get(a, expected_generation=1).image is not None
+        assert a.downloads == 1
+
+        # Entries seeded on upload are warm for the first edit
+        cache.put(CachedImage('uploads/c.png', 7, data))
+        c = FakeBlob('uploads/c.png', data, generation=7)
+        cache.get(c, expected_generation=7)
+        assert c.downloads == 0
+    print("✓ Image cache disk tier and eviction")
+
+
+if __name__ == "__main__":
+    test_repeated_edits_skip_download_and_decode()
+    test_disk_tier_and_eviction()
@@ -0,0 +1,37 @@
+import io
+
+import main
+from memory_storage import SlowBucket
+from upload_testing import call, target_image, use_bucket
+
+
+def test_image_urls():
+    bucket = SlowBucket(delay=0)
+    use_bucket(bucket)
+    main._image_urls.clear()
+    response, _, _ = call(main.handle_upload, '/upload?response=url', method='POST',
+                          data={'image': (io.BytesIO(target_image()), 'target.jpg', 'image/jpeg')})
+    filename = main.db.collection('targets').document(response.get_json()['id']).get().to_dict()['filename']
+
+    # Public URLs come from the name alone; content-addressed ones are cacheable for good
+    response, status, headers = call(main.handle_get_image, f"/image/{filename}", filename)
+    assert status == 200 and response.get_json()['url'] == f"https://storage.example/uploads/{filename}"
+    assert headers['Cache-Control'] == f"public, max-age={main.IMAGE_IMMUTABLE_MAX_AGE}"
+    assert call(main.handle_get_image, '/image/target_1_a.jpg', 'target_1_a.jpg')[2]['Cache-Control'] == 'no-cache'
+
+    # Signed URLs are generated once and reused while fresh
+    main._image_urls.clear()
+    main.IMAGE_URL_MODE = 'signed'
+    try:
+        first = call(main.handle_get_image, f"/image/{filename}", filename)
+        second = call(main.handle_get_image, f"/image/{filename}", filename)
+    finally:
+        main.IMAGE_URL_MODE = 'public'
+        main._image_urls.clear()
+    assert first[0].get_json() == second[0].get_json() and bucket.signed == 1
+    assert 'X-Goog-Signature' in first[0].get_json()['url']
+    print("✓ Cached image URLs")
+
+
+if __name__ == "__main__":
+    test_image_urls()
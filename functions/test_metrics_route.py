@@ -0,0 +1,28 @@
+import io
+
+import main
+from memory_storage import SlowBucket
+from upload_testing import app, target_image, use_bucket
+
+
+def test_metrics_route():
+    bucket = SlowBucket(delay=0)
+    use_bucket(bucket)
+    with app.test_request_context('/api/upload', method='POST',
+                                  data={'image': (io.BytesIO(target_image()), 'target.jpg', 'image/jpeg')}):
+        from flask import request
+        route, response = main.dispatch(request, {})
+    assert route == '/upload' and main.response_status(response) == 200
+
+    with app.test_request_context('/api/metrics'):
+        from flask import request
+        route, (response, status, _) = main.dispatch(request, {})
+    text = response.get_data(as_text=True)
+    assert route == '/metrics' and status == 200
+    assert 'photomoa_upload_stage_seconds_count{stage="detect"}' in text
+    assert 'photomoa_image_cache_hits_total' in text and 'photomoa_detection_memory_peak_bytes' in text
+    print("✓ Metrics route")
+
+
+if __name__ == "__main__":
+    test_metrics_route()
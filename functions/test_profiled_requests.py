@@ -0,0 +1,30 @@
+import io
+import json
+
+import main
+from memory_storage import SlowBucket
+from upload_testing import app, target_image, use_bucket
+
+
+def test_profiled_upload():
+    bucket = SlowBucket(delay=0)
+    use_bucket(bucket)
+    main.PROFILING = True
+    try:
+        with app.test_request_context('/api/upload?profile=1', method='POST',
+                                      data={'image': (io.BytesIO(target_image()), 'slow.jpg', 'image/jpeg')}):
+            from flask import request
+            _, (response, status, headers) = main.dispatch(request, {})
+    finally:
+        main.PROFILING = False
+    assert status == 200
+    prefix = f"profiles/{headers['X-Profile-Id']}/"
+    params = json.loads(bucket.objects[prefix + 'params.json'])
+    assert params['image_id'] == response.get_json()['id'] and params['image']['original_name'] == 'slow.jpg'
+    assert bucket.objects[prefix + 'original.jpg'] == bucket.objects['uploads/' + params['image']['filename']]
+    assert prefix + 'stacks.collapsed' in bucket.objects and prefix + 'profile.prof' in bucket.objects
+    print("✓ Profiled upload")
+
+
+if __name__ == "__main__":
+    test_profiled_upload()
@@ -0,0 +1,36 @@
+import io
+
+import main
+from memory_storage import SlowBucket
+from upload_testing import call, target_image, use_bucket
+
+
+def test_duplicate_uploads_share_objects():
+    bucket = SlowBucket(delay=0)
+    use_bucket(bucket)
+
+    def upload(name):
+        response, status, _ = call(main.handle_upload, '/upload?response=url', method='POST',
+                                   data={'image': (io.BytesIO(target_image()), name, 'image/jpeg')})
+        assert status == 200
+        return main.db.collection('targets').document(response.get_json()['id']).get().to_dict()
+
+    first, second = upload('monday.jpg'), upload('tuesday.jpg')
+    assert first['filename'] == second['filename'] and first['original_name'] == 'monday.jpg'
+    assert first['original_generation'] == second['original_generation']
+    names = [f"uploads/{first[key]}" for key in ('filename', 'annotated_filename')]
+    assert [bucket.metadata[name]['refs'] for name in names] == ['2', '2']
+    # The second upload only bumped the counts: each image was uploaded once
+    assert [uploaded[0] for uploaded in bucket.uploads].count(names[0]) == 1
+
+    # Deleting one target leaves the other's images in place
+    assert call(main.handle_delete, f"/delete/{first['id']}", first['id'], method='DELETE')[1] == 200
+    assert all(name in bucket.objects for name in names)
+    assert bucket.metadata[names[0]]['refs'] == '1'
+    assert call(main.handle_delete, f"/delete/{second['id']}", second['id'], method='DELETE')[1] == 200
+    assert not any(name in bucket.objects for name in names)
+    print("✓ Duplicate uploads share Storage objects")
+
+
+if __name__ == "__main__":
+    test_duplicate_uploads_share_objects()
@@ -0,0 +1,75 @@
+import io
+
+import main
+from memory_storage import SlowBucket
+from upload_testing import app, call, target_image, use_bucket
+
+
+def test_upload_stores_both_images_concurrently():
+    bucket = SlowBucket()
+    use_bucket(bucket)
+
+    with app.test_request_context('/upload', method='POST',
+                                  data={'image': (io.BytesIO(target_image()), 'target.jpg', 'image/jpeg')}):
+        from flask import request
+        response, status, _ = main.handle_upload(request, {})
+    assert status == 200, response.get_json()
+
+    # Original, annotated and thumbnail uploads overlap instead of running back to back
+    assert bucket.peak_in_flight >= 2
+    assert len(bucket.objects) == 4
+    # Each upload sets its ACL in the same request and retries on transient errors
+    assert all(acl == 'publicRead' and retried for _, _, acl, retried in bucket.uploads)
+    assert {content_type for _, content_type, _, _ in bucket.uploads} == {'image/jpeg', 'image/webp'}
+
+    # Metadata is only written once the original's generation is known
+    metadata = main.db.collection('targets').document(response.get_json()['id']).get().to_dict()
+    assert metadata['original_generation'] is not None
+    print("✓ Concurrent Storage uploads")
+
+
+def test_failed_writes_leave_nothing_behind():
+    bucket = SlowBucket(delay=0)
+    use_bucket(bucket)
+
+    def upload():
+        return call(main.handle_upload, '/upload?response=url', method='POST',
+                    data={'image': (io.BytesIO(target_image()), 'target.jpg', 'image/jpeg')})
+
+    # Neither a failed Firestore write nor a failed thumbnail upload reports success or keeps objects
+    upload_to_storage = main.upload_to_storage
+    failures = {
+        'save_metadata': lambda entry: False,
+        'upload_to_storage': lambda data, name, *args: None if name.startswith('derivatives/')
+        else upload_to_storage(data, name, *args)
+    }
+    for name, failing in failures.items():
+        working = getattr(main, name)
+        setattr(main, name, failing)
+        try:
+            response, status, _ = upload()
+        finally:
+            setattr(main, name, working)
+        assert status == 500 and 'error' in response.get_json()
+        assert bucket.objects == {} and list(main.db.collection('targets').stream()) == []
+
+    # An edit that loses the race with a delete is a 404, not a success for a target that is gone
+    response, status, _ = upload()
+    image_id = response.get_json()['id']
+    entry = main.get_metadata(image_id)
+    assert call(main.handle_delete, f"/delete/{image_id}", image_id, method='DELETE')[1] == 200
+    get_metadata = main.get_metadata
+    main.get_metadata = lambda image_id: dict(entry)
+    try:
+        assert call(main.handle_update_shots, f"/update-shots/{image_id}", image_id,
+                    method='POST', json={'manual_shots': [[300, 300]]})[1] == 404
+        assert call(main.handle_calibrate, f"/calibrate/{image_id}", image_id,
+                    method='POST', json={'point1': [0, 0], 'point2': [0, 50]})[1] == 404
+    finally:
+        main.get_metadata = get_metadata
+    print("✓ Failed writes leave nothing behind")
+
+
+if __name__ == "__main__":
+    test_upload_stores_both_images_concurrently()
+    test_failed_writes_leave_nothing_behind()
@@ -0,0 +1,35 @@
+import io
+import json
+import zipfile
+
+import main
+from memory_storage import SlowBucket
+from upload_testing import call, target_image, use_bucket
+
+
+def test_batch_upload():
+    bucket = SlowBucket(delay=0)
+    use_bucket(bucket)
+    archive = io.BytesIO()
+    with zipfile.ZipFile(archive, 'w') as zipped:
+        zipped.writestr('range/second.jpg', target_image())
+        zipped.writestr('range/readme.txt', b'not an image')
+
+    response, status, _ = call(main.handle_upload_batch, '/upload/batch?response=url', method='POST',
+                               data={'images': [(io.BytesIO(target_image()), 'first.jpg'),
+                                                (io.BytesIO(archive.getvalue()), 'range.zip')]})
+    assert status == 200
+    lines = [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+    results = {line['filename']: line for line in lines[:-1]}
+    assert results['first.jpg']['shot_count'] == 3 and 'annotated_url' in results['second.jpg']
+    assert results['readme.txt']['error'] == 'Invalid image file'
+
+    # Both entries are written in a single Firestore batch
+    assert lines[-1]['saved'] == 2 and main.db.commits == 1
+    for image_id in lines[-1]['ids']:
+        assert main.db.collection('targets').document(image_id).get().exists
+    print("✓ Batch upload")
+
+
+if __name__ == "__main__":
+    test_batch_upload()
@@ -0,0 +1,36 @@
+"""
+Helpers shared by the Cloud Function tests: a test image, fresh fakes for
+main.py's clients and caches, and calling a handler inside a request context
+"""
+import tempfile
+
+import cv2
+import numpy as np
+from flask import Flask
+
+import main
+from annotation import RenderCache
+from image_cache import ImageCache
+from memory_firestore import MemoryFirestoreClient
+
+app = Flask(__name__)
+
+
+def target_image():
+    image = np.full((400, 400, 3), 255, np.uint8)
+    for center in [(100, 100), (200, 150), (150, 250)]:
+        cv2.circle(image, center, 8, (0, 0, 0), -1)
+    return cv2.imencode('.jpg', image)[1].tobytes()
+
+
+def use_bucket(bucket):
+    main.db, main.bucket = MemoryFirestoreClient(), bucket
+    main.image_cache = ImageCache(disk_dir=tempfile.mkdtemp())
+    main.render_cache = RenderCache()
+
+
+def call(handler, path, *args, **kwargs):
+    with app.test_request_context(path, **kwargs):
+        from flask import request
+        return handler(request, *args, {})
+